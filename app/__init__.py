@@ -6,9 +6,9 @@ import os
 
 db = SQLAlchemy()
 
-def create_app():
+def create_app(config_class=Config):
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config_class)
     
     # Ensure QR codes are saved under the Flask static directory so they can be served
     app.config['UPLOAD_FOLDER'] = os.path.join(app.static_folder, 'qr_codes')
@@ -16,16 +16,64 @@ def create_app():
     # Initialize extensions
     db.init_app(app)
     
+    # First, so its request timer wraps every other hook
+    from app import metrics
+    metrics.init_app(app, db)
+    
+    from app import instrumentation
+    instrumentation.init_app(app, db)
+    
+    from app import profiling
+    profiling.init_app(app)
+    
     login_manager = LoginManager()
     login_manager.login_view = 'auth.login'
     login_manager.init_app(app)
 
-    # Import User after db is initialized to avoid circular import
-    from app.models import User
+    # Cached: most requests resolve the logged-in user without a query
+    from app import user_cache
+    user_cache.init_app(app)
 
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return user_cache.load_user(int(user_id))
+    
+    from app import bootstrap
+    bootstrap.init_app(app)
+    
+    from app import stats
+    stats.init_app(app)
+    
+    from app import low_stock
+    low_stock.init_app(app)
+    
+    from app import refdata
+    refdata.init_app(app)
+    
+    from app import tombstones
+    tombstones.init_app(app)
+    
+    from app import fulltext  # noqa: F401 - registers `flask db reindex-search`
+    
+    from app import stock
+    stock.init_app(app)
+
+    from app import rollups
+    rollups.init_app(app)
+
+    from app import forecast  # noqa: F401 - registers `flask stock reorder-levels`
+    
+    from app import snapshots
+    snapshots.init_app(app)
+    
+    from app import labels
+    labels.init_app(app)
+    
+    from app import export_jobs
+    export_jobs.init_app(app)
+
+    from app import benchmark
+    benchmark.init_app(app)
     
     # Create upload directories
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
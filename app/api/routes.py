@@ -1,44 +1,279 @@
-from flask import jsonify, request
-from flask_login import login_required
+import hashlib
+from datetime import datetime, timedelta
+from flask import jsonify, request, abort, current_app
+from flask_login import login_required, current_user
 from app.api import bp
-from app.models import Item, Warehouse, User
+from app.models import Item, Transaction, StockLevelEvent
+from app.queries import (api_item_rows, api_transaction_rows, stock_level_events, search_items,
+                         ITEM_API_FIELDS, DEFAULT_ITEM_API_FIELDS)
+from app.pagination import keyset_paginate
+from app.stock import apply_batch, StockConflict
+from app import refdata, fulltext, tombstones
+from app.utils import (json_array_chunks, ndjson_chunks, stream_response, accepts_gzip,
+                       jsonable, NDJSON_MIMETYPE)
+
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+SEARCH_MAX_RESULTS = 50
+WAREHOUSE_API_FIELDS = ('id', 'name', 'location', 'description', 'created_at')
+DEFAULT_WAREHOUSE_API_FIELDS = ('id', 'name', 'location')
+
+def _page_args():
+    limit = min(request.args.get('limit', API_PAGE_SIZE, type=int), API_MAX_PAGE_SIZE)
+    return request.args.get('cursor'), max(limit, 1)
+
+def _page_response(page, records):
+    return jsonify({
+        'items': records,
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor
+    })
+
+def _fields(allowed, default):
+    """Fields named in ?fields=a,b (in that order), or `default`; 400 on unknown names"""
+    if not request.args.get('fields'):
+        return list(default)
+    fields = [f.strip() for f in request.args['fields'].split(',') if f.strip()]
+    if not fields or any(f not in allowed for f in fields):
+        abort(400)
+    return list(dict.fromkeys(fields))
+
+def _stream_format():
+    fmt = request.args.get('format')
+    if fmt is None:
+        return 'ndjson' if request.accept_mimetypes.best == NDJSON_MIMETYPE else 'json'
+    if fmt not in ('json', 'ndjson'):
+        abort(400)
+    return fmt
+
+def _conditional(fingerprint):
+    """Weak ETag over a fingerprint of the result set and the request arguments"""
+    key = repr((fingerprint, sorted(request.args.items(multi=True)), _stream_format()))
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+def _not_modified(etag):
+    response = current_app.response_class(status=304)
+    response.set_etag(etag, weak=True)
+    return response
+
+def _stream(records, fmt, etag, headers=None):
+    chunks = ndjson_chunks(records) if fmt == 'ndjson' else json_array_chunks(records)
+    response = stream_response(chunks, NDJSON_MIMETYPE if fmt == 'ndjson' else 'application/json',
+                               compress=accepts_gzip())
+    response.set_etag(etag, weak=True)
+    response.headers.update(headers or {})
+    return response
 
 @bp.route('/items')
 @login_required
 def get_items():
+    """Items, streamed as a JSON array or NDJSON in id order.
+
+    ?fields= picks columns, ?warehouse_id= filters, and ?updated_since=<ISO
+    time> returns only items changed since then plus {"id", "deleted": true}
+    for items deleted since then; pass the X-Updated-Until header of one
+    response as updated_since of the next. That watermark trails the clock
+    by API_UPDATED_SINCE_SLACK seconds, because updated_at is stamped before
+    a write commits: items changed in that window are sent again by the next
+    poll, so clients must accept repeats. Responses carry a weak ETag, so
+    unchanged polls get 304. With ?cursor= or ?limit= the result is a keyset
+    page ({"items", "next_cursor", "prev_cursor"}) instead of a stream.
+    """
+    fields = _fields(ITEM_API_FIELDS, DEFAULT_ITEM_API_FIELDS)
     warehouse_id = request.args.get('warehouse_id', type=int)
+    since = None
+    if request.args.get('updated_since'):
+        try:
+            since = datetime.fromisoformat(request.args['updated_since'])
+        except ValueError:
+            abort(400)
     
-    query = Item.query
+    # Taken before reading: writes stamped up to API_UPDATED_SINCE_SLACK
+    # seconds earlier may still be uncommitted and invisible to this read
+    watermark = datetime.utcnow() - timedelta(seconds=current_app.config['API_UPDATED_SINCE_SLACK'])
+    query = api_item_rows(fields)
     if warehouse_id:
         query = query.filter(Item.warehouse_id == warehouse_id)
+    if since is not None:
+        query = query.filter(Item.updated_at >= since)
+    
+    # Bumped by every commit that changes the (warehouse's) items, in commit order
+    etag = _conditional(('items', tombstones.items_version(warehouse_id)))
+    if request.if_none_match.contains_weak(etag):
+        return _not_modified(etag)
+    
+    # Paginated when a cursor or limit is given; otherwise the full list, streamed
+    if 'cursor' in request.args or 'limit' in request.args:
+        cursor, limit = _page_args()
+        sort = 'ssid' if request.args.get('sort') == 'ssid' else 'id'
+        key = [] if sort in fields else [ITEM_API_FIELDS[sort].label(sort)]
+        try:
+            page = keyset_paginate(query.add_columns(*key), [ITEM_API_FIELDS[sort]],
+                                   cursor=cursor, per_page=limit)
+        except ValueError:
+            abort(400)
+        response = _page_response(page, [{f: jsonable(getattr(row, f)) for f in fields} for row in page.items])
+        response.set_etag(etag, weak=True)
+        return response
+    
+    fmt = _stream_format()
+    chunk = current_app.config['EXPORT_CHUNK_SIZE']
     
-    items = query.all()
+    def records():
+        if since is not None:
+            for item_id in tombstones.deleted_since(since, warehouse_id):
+                yield {'id': item_id, 'deleted': True}
+        for row in query.order_by(Item.id).yield_per(chunk):
+            yield dict(zip(fields, row))
     
+    headers = {}
+    if since is not None:
+        headers['X-Updated-Until'] = max(watermark, since).isoformat()
+    return _stream(records(), fmt, etag, headers)
+
+@bp.route('/items/search')
+@login_required
+def search_items_api():
+    """Typeahead: items whose SSID or name starts with (or contains) `q`"""
+    limit = max(min(request.args.get('limit', 20, type=int), SEARCH_MAX_RESULTS), 1)
+    rows = search_items(request.args.get('q', ''), limit)
     return jsonify([{
-        'id': item.id,
-        'ssid': item.ssid,
-        'name': item.name,
-        'current_stock': item.current_stock,
-        'warehouse_id': item.warehouse_id
-    } for item in items])
+        'id': r.id,
+        'ssid': r.ssid,
+        'name': r.name,
+        'current_stock': r.current_stock,
+        'unit': r.unit,
+        'label': f"{r.ssid} - {r.name} (Stock: {r.current_stock})"
+    } for r in rows])
+
+@bp.route('/search')
+@login_required
+def search():
+    """Ranked full-text item search over SSID, name, description and category.
+
+    Every word is matched as a prefix, so partial scanner reads work. Pages
+    are numbered from 1; `has_next` tells whether another page exists.
+    """
+    q = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    limit = max(min(request.args.get('limit', 20, type=int), SEARCH_MAX_RESULTS), 1)
+    rows, has_next = fulltext.search(q, page=page, per_page=limit) if q else ([], False)
+    return jsonify({
+        'items': [{
+            'id': r.id,
+            'ssid': r.ssid,
+            'name': r.name,
+            'warehouse': r.warehouse,
+            'category': r.category,
+            'current_stock': r.current_stock,
+            'unit': r.unit,
+            'reorder_level': r.reorder_level,
+            'is_low_stock': (r.current_stock or 0) <= (r.reorder_level or 0)
+        } for r in rows],
+        'page': page,
+        'has_next': has_next
+    })
+
+@bp.route('/transactions')
+@login_required
+def get_transactions():
+    """Transactions newest first, paginated with next/prev cursors"""
+    query = api_transaction_rows()
+    for arg, column in (('warehouse_id', Transaction.warehouse_id),
+                        ('item_id', Transaction.item_id),
+                        ('user_id', Transaction.user_id)):
+        value = request.args.get(arg, type=int)
+        if value:
+            query = query.filter(column == value)
+    
+    cursor, limit = _page_args()
+    try:
+        page = keyset_paginate(query, [Transaction.created_at, Transaction.id],
+                               cursor=cursor, per_page=limit, descending=True)
+    except ValueError:
+        abort(400)
+    return _page_response(page, [{
+        'id': t.id,
+        'created_at': t.created_at.isoformat(),
+        'transaction_type': t.transaction_type.value,
+        'quantity': t.quantity,
+        'item_id': t.item_id,
+        'ssid': t.ssid,
+        'warehouse_id': t.warehouse_id,
+        'user_id': t.user_id,
+        'notes': t.notes
+    } for t in page.items])
+
+@bp.route('/transactions/batch', methods=['POST'])
+@login_required
+def create_transactions_batch():
+    """Apply a batch of IN/OUT/ADJUSTMENT movements in a single commit.
+
+    Body: {"movements": [{"item_id" or "ssid", "type", "quantity", "notes"}, ...],
+    "atomic": false}. Each line gets its own result; with "atomic" any
+    rejected line cancels the whole batch.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('movements'), list):
+        return jsonify({'error': 'Expected a JSON object with a "movements" list'}), 400
+    
+    movements = payload['movements']
+    max_movements = current_app.config['BATCH_MAX_MOVEMENTS']
+    if not movements:
+        return jsonify({'error': 'No movements given'}), 400
+    if len(movements) > max_movements:
+        return jsonify({'error': f'At most {max_movements} movements per batch'}), 400
+    
+    try:
+        results = apply_batch(movements, current_user, atomic=bool(payload.get('atomic')))
+    except StockConflict as exc:
+        return jsonify({'error': str(exc)}), 409
+    applied = sum(1 for r in results if r['status'] == 'ok')
+    return jsonify({
+        'applied': applied,
+        'rejected': len(results) - applied,
+        'results': results
+    })
 
 @bp.route('/warehouses')
 @login_required
 def get_warehouses():
-    warehouses = Warehouse.query.all()
-    return jsonify([{
-        'id': w.id,
-        'name': w.name,
-        'location': w.location
-    } for w in warehouses])
+    """Warehouses as a JSON array or NDJSON; ?fields= picks columns, ETag from the reference-data version"""
+    fields = _fields(WAREHOUSE_API_FIELDS, DEFAULT_WAREHOUSE_API_FIELDS)
+    etag = _conditional(('warehouses', refdata.version('warehouses')))
+    if request.if_none_match.contains_weak(etag):
+        return _not_modified(etag)
+    records = ({f: getattr(w, f) for f in fields} for w in refdata.warehouses())
+    return _stream(records, _stream_format(), etag)
 
 @bp.route('/users')
 @login_required
 def get_users():
-    users = User.query.filter(User.is_active == True).all()
     return jsonify([{
         'id': u.id,
         'username': u.username,
         'role': u.role.value
-    } for u in users])
+    } for u in refdata.users(active_only=True)])
 
+@bp.route('/low-stock-events')
+@login_required
+def get_low_stock_events():
+    """Threshold crossings after `after_id`, oldest first; poll with the last id seen"""
+    after_id = request.args.get('after_id', 0, type=int)
+    limit = max(min(request.args.get('limit', 100, type=int), 1000), 1)
+    
+    query = stock_level_events().filter(StockLevelEvent.id > after_id)
+    if request.args.get('became_low', type=int) == 1:
+        query = query.filter(StockLevelEvent.became_low == True)
+    
+    events = query.order_by(StockLevelEvent.id).limit(limit).all()
+    return jsonify([{
+        'id': e.id,
+        'item_id': e.item_id,
+        'ssid': e.item.ssid,
+        'name': e.item.name,
+        'became_low': e.became_low,
+        'current_stock': e.current_stock,
+        'reorder_level': e.reorder_level,
+        'created_at': e.created_at.isoformat()
+    } for e in events])
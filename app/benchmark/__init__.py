@@ -0,0 +1,175 @@
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+import click
+from flask.cli import with_appcontext
+from app.benchmark.data import SCALES, generate, is_empty
+
+# Benchmarks of the hot request paths against synthetic data.
+#
+#     flask bench run --scale small --output before.json
+#     flask bench run --scale small --output after.json
+#     flask bench compare before.json after.json
+#
+# `run` builds a throwaway SQLite database from the scale and seed (or
+# reuses --database), drives each endpoint through the test client and
+# writes latency, statement count and peak memory per benchmark together
+# with the commit and versions it ran on, and fails when an endpoint runs
+# more statements than its query budget (app/benchmark/suite.py), which
+# makes `flask bench run --scale tiny` usable as a CI check for N+1
+# regressions. `generate` fills the configured database instead, for load
+# testing by hand.
+
+
+def _scale(name, overrides):
+    return SCALES[name]._replace(**{k: v for k, v in overrides.items() if v is not None})
+
+
+def _scale_options(fn):
+    for field in reversed(SCALES['small']._fields):
+        fn = click.option(f'--{field}', type=int, help=f'Override the number of {field}.')(fn)
+    fn = click.option('--seed', default=0, show_default=True, help='Random seed for the data.')(fn)
+    fn = click.option('--scale', 'scale_name', type=click.Choice(list(SCALES)), default='small',
+                      show_default=True)(fn)
+    return fn
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.dirname(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.group('bench')
+def bench_cli():
+    """Synthetic data and endpoint benchmarks."""
+
+
+@bench_cli.command('generate')
+@_scale_options
+@with_appcontext
+def generate_command(scale_name, seed, **overrides):
+    """Fill the configured (empty) database with synthetic data."""
+    from app.bootstrap import bootstrap
+    bootstrap()
+    if not is_empty():
+        raise click.ClickException('The database already has items; generate into an empty one.')
+    scale = _scale(scale_name, overrides)
+    started = time.perf_counter()
+    counts = generate(scale, seed)
+    click.echo(', '.join(f'{n} {table}' for table, n in counts.items())
+               + f' ({time.perf_counter() - started:.1f}s)')
+
+
+@bench_cli.command('run')
+@_scale_options
+@click.option('--repeat', default=5, show_default=True, help='Timed requests per benchmark.')
+@click.option('--only', multiple=True, help='Run benchmarks whose name starts with this (repeatable).')
+@click.option('--database', type=click.Path(dir_okay=False),
+              help='SQLite file to keep the data in; reused if it already has items.')
+@click.option('--output', type=click.Path(dir_okay=False), default='benchmark-results.json', show_default=True)
+def run_command(scale_name, seed, repeat, only, database, output, **overrides):
+    """Benchmark the hot endpoints and write the results as JSON."""
+    from app import create_app, db
+    from app.bootstrap import bootstrap
+    from app.benchmark.suite import run
+    from config import Config
+
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    path = os.path.abspath(database) if database else os.path.join(workdir, 'bench.db')
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+        WTF_CSRF_ENABLED = False
+        BOOTSTRAP_ON_FIRST_REQUEST = False
+        SQL_INSTRUMENTATION = True
+        STOCK_SNAPSHOT_HOURS = 0
+        EXPORT_WORKER_THREADS = 0
+        EXPORT_FOLDER = os.path.join(workdir, 'exports')
+        UPLOAD_FOLDER = os.path.join(workdir, 'qr_codes')
+
+    scale = _scale(scale_name, overrides)
+    app = create_app(BenchConfig)
+    try:
+        with app.app_context():
+            bootstrap()
+            reused = not is_empty()
+            started = time.perf_counter()
+            if not reused:
+                click.echo(f'Generating {scale_name} data (seed {seed})...')
+                generate(scale, seed)
+            generate_seconds = None if reused else round(time.perf_counter() - started, 1)
+            db.session.remove()
+
+        def progress(name, result):
+            click.echo(f"{name:40} {result['status']}  {result['latency_ms']['median']:9.1f}ms "
+                       f"{result['queries']:4d}q  {result['peak_memory_kb']:9.0f}KB")
+
+        results = run(app, repeat=repeat, only=only, progress=progress)
+        report = {
+            'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'commit': _commit(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'scale': dict(scale._asdict(), name=scale_name),
+            'seed': seed,
+            'repeat': repeat,
+            'database_reused': reused,
+            'generate_seconds': generate_seconds,
+            'benchmarks': results,
+        }
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        click.echo(f'Results written to {output}')
+        failed = {name: result['over_budget'] for name, result in results.items() if result['over_budget']}
+        for name, problem in failed.items():
+            click.echo(f'{name}: {problem}', err=True)
+    finally:
+        with app.app_context():
+            db.engine.dispose()
+        shutil.rmtree(workdir, ignore_errors=True)
+    if failed:
+        raise click.ClickException(f'{len(failed)} benchmark(s) over their query budget')
+
+
+@bench_cli.command('compare')
+@click.argument('before', type=click.File())
+@click.argument('after', type=click.File())
+@click.option('--threshold', default=10.0, show_default=True, help='Percent slower that counts as a regression.')
+def compare_command(before, after, threshold):
+    """Compare two result files; exits 1 when a benchmark regressed."""
+    old, new = json.load(before), json.load(after)
+    if old.get('scale') != new.get('scale') or old.get('seed') != new.get('seed'):
+        click.echo('Warning: the runs used different data (scale or seed).')
+    regressed = []
+    click.echo(f"{'benchmark':40} {'before':>10} {'after':>10} {'change':>8} {'queries':>11} {'memory KB':>19}")
+    for name, result in new['benchmarks'].items():
+        previous = old['benchmarks'].get(name)
+        if previous is None:
+            click.echo(f"{name:40} {'-':>10} {result['latency_ms']['median']:9.1f}ms")
+            continue
+        a, b = previous['latency_ms']['median'], result['latency_ms']['median']
+        change = (b - a) / a * 100 if a else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  !'
+            regressed.append(name)
+        click.echo(f"{name:40} {a:9.1f}ms {b:9.1f}ms {change:+7.1f}% "
+                   f"{previous['queries']:5d}->{result['queries']:<5d} "
+                   f"{previous['peak_memory_kb']:9.0f}->{result['peak_memory_kb']:<9.0f}{flag}")
+    if regressed:
+        raise click.ClickException(f"{len(regressed)} benchmark(s) more than {threshold:g}% slower: "
+                                   + ', '.join(regressed))
+
+
+def init_app(app):
+    app.cli.add_command(bench_cli)
@@ -0,0 +1,153 @@
+import random
+from collections import namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import select, insert, update, bindparam, func
+from werkzeug.security import generate_password_hash
+from app import db, stats, low_stock, refdata, rollups, tombstones
+from app.models import (User, Role, Warehouse, Category, Item, Transaction, TransactionType, Seller, Payment)
+
+# Deterministic synthetic data. Everything is drawn from one random.Random
+# seeded by the caller and dated from a fixed START, so the same scale and
+# seed always produce the same rows. Rows are written with bulk inserts,
+# after which the derived tables (dashboard counters, low-stock watch set,
+# movement rollups, reference-data versions) are rebuilt; the full-text
+# index fills itself through its triggers. Stock never goes negative:
+# current_stock is the running sum of the generated ledger.
+Scale = namedtuple('Scale', 'warehouses categories items transactions sellers payments')
+
+SCALES = {
+    'tiny': Scale(2, 5, 200, 1_000, 10, 100),
+    'small': Scale(3, 20, 5_000, 50_000, 50, 5_000),
+    'medium': Scale(10, 50, 50_000, 500_000, 500, 50_000),
+    'large': Scale(20, 200, 500_000, 5_000_000, 5_000, 500_000),
+}
+
+START = datetime(2024, 1, 1)
+HISTORY_DAYS = 365
+STAFF_USERS = 5
+BATCH = 10_000
+
+_ADJECTIVES = ['Steel', 'Copper', 'Plastic', 'Rubber', 'Glass', 'Oak', 'Nylon', 'Ceramic', 'Carbon', 'Brass']
+_NOUNS = ['Bolt', 'Washer', 'Bracket', 'Hinge', 'Valve', 'Gasket', 'Spring', 'Bearing', 'Clamp', 'Fitting']
+_UNITS = ['pcs', 'box', 'kg', 'm', 'pack']
+_METHODS = ['card', 'bank-transfer', 'cash']
+_STATUSES = ['completed'] * 6 + ['pending'] * 3 + ['refunded']
+
+
+def _batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _insert(connection, model, rows):
+    count = 0
+    for batch in _batches(rows):
+        connection.execute(insert(model.__table__), batch)
+        count += len(batch)
+    return count
+
+
+def generate(scale, seed=0):
+    """Fill the (empty) database with `scale` rows drawn from `seed`; returns {table: rows}"""
+    rng = random.Random(seed)
+    connection = db.session.connection()
+    counts = {}
+
+    admin_id = connection.execute(select(User.id).where(User.role == Role.ADMIN).order_by(User.id)).scalar()
+    password = generate_password_hash('bench')
+    counts['users'] = _insert(connection, User, ({
+        'username': f'bench-staff-{n}', 'email': f'bench-staff-{n}@warehouse.com', 'password_hash': password,
+        'role': Role.STAFF, 'created_at': START, 'is_active': True,
+    } for n in range(STAFF_USERS)))
+    user_ids = [admin_id] + list(connection.execute(
+        select(User.id).where(User.username.like('bench-staff-%')).order_by(User.id)).scalars())
+
+    counts['warehouses'] = _insert(connection, Warehouse, ({
+        'name': f'Warehouse {n + 1}', 'location': f'Site {n + 1}', 'created_at': START,
+    } for n in range(scale.warehouses)))
+    counts['categories'] = _insert(connection, Category, ({
+        'name': f'Category {n + 1}',
+    } for n in range(scale.categories)))
+    warehouse_ids = list(connection.execute(select(Warehouse.id).order_by(Warehouse.id)).scalars())
+    category_ids = list(connection.execute(select(Category.id).order_by(Category.id)).scalars())
+
+    def items():
+        for n in range(scale.items):
+            created_at = START - timedelta(days=rng.randrange(30), seconds=rng.randrange(86400))
+            name = f'{rng.choice(_ADJECTIVES)} {rng.choice(_NOUNS)} {n + 1}'
+            yield {
+                'ssid': f'BENCH{n + 1:07d}', 'name': name, 'description': f'{name} for benchmark runs',
+                'unit': rng.choice(_UNITS), 'current_stock': 0, 'reorder_level': rng.randint(5, 50),
+                'unit_price': Decimal(rng.randint(50, 50_000)) / 100,
+                'warehouse_id': rng.choice(warehouse_ids), 'category_id': rng.choice(category_ids),
+                'created_at': created_at, 'updated_at': created_at,
+            }
+
+    counts['items'] = _insert(connection, Item, items())
+    items_table = Item.__table__
+    placement = dict(connection.execute(select(items_table.c.id, items_table.c.warehouse_id)).all())
+    item_ids = sorted(placement)
+    stock = dict.fromkeys(item_ids, 0)
+
+    # Evenly spaced over HISTORY_DAYS with jitter, in time order
+    step = HISTORY_DAYS * 86400 / max(scale.transactions, 1)
+
+    def transactions():
+        for n in range(scale.transactions):
+            item_id = rng.choice(item_ids)
+            roll = rng.random()
+            quantity = rng.randint(1, 20)
+            if roll < 0.5 or stock[item_id] == 0:
+                transaction_type = TransactionType.IN
+            elif roll < 0.9:
+                transaction_type = TransactionType.OUT
+                quantity = min(quantity, stock[item_id])
+            else:
+                transaction_type = TransactionType.ADJUSTMENT
+                quantity = rng.randint(-min(5, stock[item_id]), 5) or 1
+            stock[item_id] += -quantity if transaction_type == TransactionType.OUT else quantity
+            yield {
+                'transaction_type': transaction_type, 'quantity': quantity, 'notes': None,
+                'item_id': item_id, 'warehouse_id': placement[item_id], 'user_id': rng.choice(user_ids),
+                'created_at': START + timedelta(seconds=n * step + rng.random() * step),
+            }
+
+    counts['transactions'] = _insert(connection, Transaction, transactions())
+    end = START + timedelta(days=HISTORY_DAYS)
+    set_stock = update(items_table).where(items_table.c.id == bindparam('b_id')).values(
+        current_stock=bindparam('b_stock'), updated_at=end
+    )
+    for batch in _batches({'b_id': item_id, 'b_stock': value} for item_id, value in stock.items() if value):
+        connection.execute(set_stock, batch)
+
+    counts['sellers'] = _insert(connection, Seller, ({
+        'name': f'Seller {n + 1}', 'email': f'seller{n + 1}@example.com', 'phone': f'+1-555-{n:06d}',
+        'created_at': START + timedelta(days=rng.randrange(HISTORY_DAYS)), 'updated_at': START,
+    } for n in range(scale.sellers)))
+    seller_ids = list(connection.execute(select(Seller.id).order_by(Seller.id)).scalars())
+    counts['payments'] = _insert(connection, Payment, ({
+        'amount': Decimal(rng.randint(100, 1_000_000)) / 100, 'currency': 'USD', 'method': rng.choice(_METHODS),
+        'status': rng.choice(_STATUSES), 'notes': None,
+        'seller_id': rng.choice(seller_ids) if seller_ids and rng.random() < 0.9 else None,
+        'processed_by_id': admin_id,
+        'created_at': START + timedelta(seconds=rng.randrange(HISTORY_DAYS * 86400)),
+    } for _ in range(scale.payments)))
+
+    low_stock.rebuild(connection)
+    rollups.rebuild(connection)
+    refdata.bump(connection, refdata.DATASETS)
+    tombstones.bump(connection, set(placement.values()))
+    db.session.commit()
+    stats.recount()
+    return counts
+
+
+def is_empty():
+    return not db.session.execute(select(func.count()).select_from(Item)).scalar()
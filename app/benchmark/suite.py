@@ -0,0 +1,143 @@
+import statistics
+import time
+import tracemalloc
+from collections import namedtuple
+from sqlalchemy import select, func
+from app import db
+from app.instrumentation import record_queries, assert_query_budget
+from app.models import Item, Transaction, User, Role
+from app.pagination import encode_cursor
+
+# The benchmarked requests. Each runs once to warm caches, `repeat` times
+# timed (latency, statements run, SQL time) and once more under tracemalloc
+# for peak Python memory, which would otherwise distort the timings. Bodies
+# are read in full inside the measurement, so streamed exports count.
+#
+# The first timed request must also stay within the benchmark's query
+# budget, with no repeated lazy loads; budgets do not grow with the data,
+# so an N+1 regression fails `flask bench run` at any scale.
+Benchmark = namedtuple('Benchmark', 'name method path data max_queries')
+
+DEEP_FRACTION = 0.9  # how far into the listings the deep-page cursors point
+
+
+def _deep_cursors():
+    items = db.session.execute(select(func.count(Item.id))).scalar()
+    item_id = db.session.execute(
+        select(Item.id).order_by(Item.id).offset(int(items * DEEP_FRACTION)).limit(1)
+    ).scalar()
+    ledger = db.session.execute(select(func.count(Transaction.id))).scalar()
+    row = db.session.execute(
+        select(Transaction.created_at, Transaction.id)
+        .order_by(Transaction.created_at.desc(), Transaction.id.desc())
+        .offset(int(ledger * DEEP_FRACTION)).limit(1)
+    ).first()
+    return (encode_cursor([item_id or 0], 'next'),
+            encode_cursor(list(row), 'next') if row else None)
+
+
+def benchmarks():
+    """Benchmarks for the database in the current app context"""
+    item_cursor, transaction_cursor = _deep_cursors()
+    sample = db.session.execute(select(Item.id, Item.ssid).order_by(Item.id).limit(1)).first()
+    item_id, ssid = sample if sample else (0, '')
+    return [
+        Benchmark('main.dashboard', 'GET', '/', None, 5),
+        Benchmark('items.list_items', 'GET', '/items/', None, 3),
+        Benchmark('items.list_items.deep', 'GET', f'/items/?cursor={item_cursor}', None, 3),
+        Benchmark('transactions.list_transactions', 'GET', '/transactions/', None, 3),
+        Benchmark('transactions.list_transactions.deep', 'GET',
+                  f'/transactions/?cursor={transaction_cursor or ""}', None, 3),
+        Benchmark('transactions.create_transaction', 'POST', '/transactions/create',
+                  {'item_id': item_id, 'transaction_type': 'in', 'quantity': 1, 'notes': 'benchmark'}, 10),
+        Benchmark('api.get_items', 'GET', '/api/items', None, 4),
+        Benchmark('api.get_items.page', 'GET', f'/api/items?cursor={item_cursor}&limit=100', None, 4),
+        Benchmark('main.search', 'GET', f'/search?ssid={ssid}', None, 2),
+        Benchmark('api.search', 'GET', '/api/search?q=steel+bolt', None, 2),
+        Benchmark('api.search_items', 'GET', '/api/items/search?q=BENCH00', None, 3),
+        Benchmark('reports.export_transactions', 'GET', '/reports/transactions-export', None, 2),
+        Benchmark('reports.export_transactions.month', 'GET',
+                  '/reports/transactions-export?start_date=2024-06-01&end_date=2024-06-30', None, 2),
+        Benchmark('reports.export_inventory', 'GET', '/reports/inventory-export', None, 2),
+        Benchmark('reports.export_inventory.as_of', 'GET', '/reports/inventory-export?as_of=2024-06-30', None, 4),
+        Benchmark('reports.export_low_stock', 'GET', '/reports/low-stock-export', None, 2),
+        Benchmark('reports.export_movements', 'GET',
+                  '/reports/movements-export?period=week&from=2024-01-01&to=2024-12-31', None, 3),
+        Benchmark('reports.export_reorder', 'GET', '/reports/reorder-export?window_days=1000', None, 2),
+        Benchmark('payments.export', 'GET', '/payments/export', None, 2),
+        Benchmark('payments.export.json', 'GET', '/payments/export?format=json', None, 2),
+    ]
+
+
+def _request(client, benchmark):
+    response = client.open(benchmark.path, method=benchmark.method, data=benchmark.data)
+    body = response.get_data()
+    return response.status_code, len(body)
+
+
+def _measure(client, benchmark):
+    with record_queries(keep_statements=False) as queries:
+        started = time.perf_counter()
+        status, size = _request(client, benchmark)
+        elapsed = time.perf_counter() - started
+    return status, size, elapsed, queries
+
+
+def login(client, username):
+    response = client.post('/login', data={'username': username, 'password': 'admin123'})
+    if response.status_code != 302:
+        raise RuntimeError('Benchmark login failed; the admin user must have the default password')
+
+
+def run(app, repeat=5, only=None, progress=None):
+    """Run the benchmarks (those whose name starts with one of `only`); returns {name: result}"""
+    client = app.test_client()
+    with app.app_context():
+        selected = [b for b in benchmarks() if not only or b.name.startswith(tuple(only))]
+        admin = db.session.execute(
+            select(User.username).where(User.role == Role.ADMIN).order_by(User.id)
+        ).scalar()
+    login(client, admin)
+
+    threshold = app.config['SQL_N_PLUS_ONE_THRESHOLD']
+    results = {}
+    for benchmark in selected:
+        _request(client, benchmark)
+        over_budget = None
+        try:
+            with assert_query_budget(benchmark.max_queries, threshold=threshold):
+                runs = [_measure(client, benchmark)]
+        except AssertionError as exc:
+            over_budget = str(exc).splitlines()[0]
+        runs += [_measure(client, benchmark) for _ in range(repeat - 1)]
+        tracemalloc.start()
+        try:
+            _request(client, benchmark)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        status, size = runs[-1][0], runs[-1][1]
+        latencies = sorted(elapsed * 1000 for _, _, elapsed, _ in runs)
+        result = {
+            'method': benchmark.method,
+            'path': benchmark.path,
+            'status': status,
+            'bytes': size,
+            'queries': runs[-1][3].count,
+            'sql_ms': round(statistics.median(q.duration * 1000 for _, _, _, q in runs), 2),
+            'latency_ms': {
+                'min': round(latencies[0], 2),
+                'median': round(statistics.median(latencies), 2),
+                'p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2),
+                'mean': round(statistics.fmean(latencies), 2),
+                'max': round(latencies[-1], 2),
+            },
+            'peak_memory_kb': round(peak / 1024, 1),
+            'query_budget': benchmark.max_queries,
+            'over_budget': over_budget,
+        }
+        results[benchmark.name] = result
+        if progress:
+            progress(benchmark.name, result)
+    return results
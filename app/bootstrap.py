@@ -0,0 +1,297 @@
+import math
+import re
+import sqlite3
+import threading
+from datetime import datetime
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, inspect, text
+from sqlalchemy.schema import CreateIndex
+from app import db
+
+# Ordered schema migrations, applied once each by `flask db upgrade`.
+# db.create_all() runs first, so a migration only has to bring tables that
+# already existed up to date (new columns, new indexes, backfills) and must
+# be safe to run against a freshly created schema too.
+MIGRATIONS = []
+
+
+def migration(version):
+    """Register a schema migration under an increasing version number"""
+    def decorator(fn):
+        MIGRATIONS.append((version, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return decorator
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def add_column(table, column, ddl):
+    """Add a column to an existing table unless it is already there"""
+    columns = [c['name'] for c in inspect(db.engine).get_columns(table)]
+    if column not in columns:
+        db.session.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}'))
+
+
+def create_indexes(model):
+    """Create any indexes declared on a model that the table is missing"""
+    # IF NOT EXISTS rather than checkfirst: expression indexes are not reflected
+    with db.engine.begin() as connection:
+        for index in model.__table__.indexes:
+            connection.execute(CreateIndex(index, if_not_exists=True))
+
+
+@migration(1)
+def _baseline():
+    """Tables as originally created by db.create_all()"""
+
+
+@migration(2)
+def _ledger_and_item_indexes():
+    """Indexes for transaction listings/exports and item lookups"""
+    from app.models import Item, Transaction
+    create_indexes(Item)
+    create_indexes(Transaction)
+
+
+@migration(3)
+def _summary_counters():
+    """Seed the dashboard summary counters"""
+    from app.stats import recount
+    recount()
+
+
+@migration(4)
+def _low_stock_watch_set():
+    """Populate the low-stock watch set from current stock levels"""
+    from app.low_stock import rebuild
+    rebuild(db.session.connection())
+
+
+@migration(5)
+def _item_search_indexes():
+    """Expression indexes for the typeahead item search"""
+    from app.models import Item
+    create_indexes(Item)
+
+
+@migration(6)
+def _reference_data_versions():
+    """Version stamps for the reference-data cache"""
+    from app.refdata import seed_versions
+    seed_versions(db.session.connection())
+
+
+@migration(7)
+def _item_search_index():
+    """Full-text item search index (SQLite FTS5) and its sync triggers"""
+    from app import fulltext
+    if fulltext.available():
+        fulltext.create(db.session.connection())
+
+
+@migration(8)
+def _item_updated_at_index():
+    """Index for delta polling of the items API"""
+    from app.models import Item
+    create_indexes(Item)
+
+
+@migration(9)
+def _payment_export_indexes():
+    """Indexes for filtered payment exports"""
+    from app.models import Payment
+    create_indexes(Payment)
+
+
+@migration(10)
+def _movement_rollups():
+    """Daily movement rollups, filled from the existing ledger"""
+    from app.rollups import rebuild
+    rebuild(db.session.connection())
+
+
+@migration(11)
+def _movement_rollup_demand_index():
+    """Covering index for demand forecasts"""
+    from app.models import MovementRollup
+    create_indexes(MovementRollup)
+
+
+@migration(12)
+def _item_listing_versions():
+    """Warehouse of deleted items, for warehouse-scoped item polling"""
+    add_column('deleted_item', 'warehouse_id', 'INTEGER')
+
+
+@migration(13)
+def _drop_item_low_stock_index():
+    """Drop the partial low-stock item index; the low_stock_item watch set replaced it"""
+    db.session.execute(text('DROP INDEX IF EXISTS ix_item_low_stock'))
+
+
+def current_version():
+    from app.models import SchemaVersion
+    if not inspect(db.engine).has_table(SchemaVersion.__tablename__):
+        return 0
+    row = SchemaVersion.query.first()
+    return row.version if row else 0
+
+
+def upgrade():
+    """Create missing tables and apply pending migrations; returns applied versions"""
+    from app.models import SchemaVersion
+    db.create_all()
+    row = SchemaVersion.query.first()
+    if row is None:
+        row = SchemaVersion(version=0)
+        db.session.add(row)
+        db.session.commit()
+
+    applied = []
+    for version, fn in MIGRATIONS:
+        if version <= row.version:
+            continue
+        fn()
+        row.version = version
+        row.applied_at = datetime.utcnow()
+        db.session.commit()
+        applied.append(version)
+    return applied
+
+
+def seed_admin():
+    """Create the default admin user when the database has no users"""
+    from app.models import User, Role
+    if User.query.first():
+        return None
+    admin_user = User(
+        username='admin',
+        email='admin@warehouse.com',
+        role=Role.ADMIN
+    )
+    admin_user.set_password('admin123')
+    db.session.add(admin_user)
+    db.session.commit()
+    return admin_user
+
+
+def bootstrap():
+    applied = upgrade()
+    admin_user = seed_admin()
+    return applied, admin_user
+
+
+@click.group('db')
+def db_cli():
+    """Schema and seed data management."""
+
+
+@db_cli.command('upgrade')
+@with_appcontext
+def upgrade_command():
+    """Create or migrate the schema and seed the admin user."""
+    applied, admin_user = bootstrap()
+    if applied:
+        click.echo(f"Applied schema migrations: {', '.join(str(v) for v in applied)}")
+    click.echo(f'Schema is at version {current_version()}')
+    if admin_user:
+        click.echo("Default admin user created: username='admin', password='admin123'")
+
+
+@db_cli.command('current')
+@with_appcontext
+def current_command():
+    """Show the schema version of the configured database."""
+    version = current_version()
+    click.echo(f'Schema version {version} (latest {latest_version()})')
+
+
+def explain(query):
+    """Return the SQLite EXPLAIN QUERY PLAN detail lines for an ORM query"""
+    compiled = query.statement.compile(dialect=db.engine.dialect,
+                                       compile_kwargs={'render_postcompile': True})
+    # Bound values do not change the plan, so placeholders are left empty
+    params = tuple(None for _ in (compiled.positiontup or ()))
+    rows = db.session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params)
+    return [row[-1] for row in rows]
+
+
+def full_scans(plan):
+    """Plan lines that read a whole table without an index"""
+    # Virtual tables (FTS5) report constrained lookups as 'SCAN ... VIRTUAL TABLE INDEX n:<constraint>',
+    # and scans of subqueries the plan materialized or runs as a co-routine only read their (bounded) result
+    materialized = {line.split()[1] for line in plan if line.startswith(('MATERIALIZE', 'CO-ROUTINE'))}
+    return [line for line in plan if line.startswith('SCAN') and 'USING' not in line
+            and not re.search(r'VIRTUAL TABLE INDEX \d+:\S', line)
+            and line.split()[1] not in materialized]
+
+
+@db_cli.command('check-plans')
+@with_appcontext
+def check_plans_command():
+    """Fail if any hot-path query falls back to a full table scan."""
+    from app.queries import hot_queries
+    if db.engine.dialect.name != 'sqlite':
+        raise click.ClickException('check-plans only understands SQLite query plans')
+    failed = False
+    for name, query in hot_queries().items():
+        plan = explain(query)
+        scans = full_scans(plan)
+        failed = failed or bool(scans)
+        click.echo(f"{'FAIL' if scans else 'ok'}  {name}")
+        for line in plan:
+            click.echo(f'      {line}')
+    if failed:
+        raise click.ClickException('full table scans found in hot queries')
+
+
+def _enable_wal(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.close()
+
+
+def _math_functions(dbapi_connection, connection_record):
+    # Demand forecasts use sqrt() and ceil(); SQLite builds without
+    # SQLITE_ENABLE_MATH_FUNCTIONS get Python's instead
+    try:
+        dbapi_connection.execute('SELECT sqrt(1), ceil(1)')
+    except sqlite3.OperationalError:
+        dbapi_connection.create_function('sqrt', 1, math.sqrt, deterministic=True)
+        dbapi_connection.create_function('ceil', 1, math.ceil, deterministic=True)
+
+
+def init_app(app):
+    """Register the CLI, SQLite connection settings and a once-per-process schema check"""
+    app.cli.add_command(db_cli)
+
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name != 'sqlite':
+                continue
+            if not event.contains(engine, 'connect', _math_functions):
+                event.listen(engine, 'connect', _math_functions)
+            if app.config['SQLITE_WAL'] and not event.contains(engine, 'connect', _enable_wal):
+                event.listen(engine, 'connect', _enable_wal)
+
+    ready = threading.Event()
+    lock = threading.Lock()
+
+    @app.before_request
+    def ensure_schema():
+        if ready.is_set():
+            return
+        with lock:
+            if ready.is_set():
+                return
+            if app.config['BOOTSTRAP_ON_FIRST_REQUEST']:
+                _, admin_user = bootstrap()
+                if admin_user:
+                    app.logger.warning("Default admin user created: username='admin', password='admin123'")
+            elif current_version() < latest_version():
+                raise RuntimeError('Database schema is out of date; run `flask db upgrade`')
+            ready.set()
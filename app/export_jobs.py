@@ -0,0 +1,470 @@
+import json
+import os
+import socket
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from enum import Enum
+import click
+from flask import abort, current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, update, delete
+from werkzeug.datastructures import MultiDict
+from app import db
+from app.models import ExportJob, Transaction, Item, Payment, Seller, MovementRollup
+from app.queries import (transaction_export_rows, inventory_rows, inventory_rows_as_of, low_stock_rows,
+                         payment_export_rows, seller_export_rows, queued_export_jobs, movement_totals,
+                         PAYMENT_EXPORT_FIELDS, SELLER_EXPORT_FIELDS)
+from app.metrics import EXPORT_BYTES
+from app.exports import EXPORT_MIMETYPES, export_chunks, filter_created, filter_values, parse_day
+from app.utils import excel_chunks, XLSX_MIMETYPE
+from app.snapshots import stock_as_of
+from app.rollups import PERIODS
+from app.forecast import forecast_settings, suggestions
+from app.labels import LABEL_FORMATS, label_report, write_label_job
+
+# Exports built off the request path. A request stores an export_job row
+# (kind, format and the kind's filter arguments) and returns at once;
+# workers claim queued rows with a conditional UPDATE, so any number of
+# threads and processes on the box can share the queue without a broker.
+# Workers normally run in a separate `flask exports worker` process, so web
+# workers never build files; EXPORT_WORKER_THREADS starts some in each web
+# process instead. A running job
+# writes to <EXPORT_FOLDER>/<id>.<format>.part and records rows done (and
+# a heartbeat) every EXPORT_PROGRESS_SECONDS for the progress page; the same
+# update notices cancellation. Finished files are renamed into place and
+# deleted with their row once EXPORT_RETENTION_HOURS have passed.
+#
+# An export kind builds (headers, query, shape) from filter arguments; the
+# synchronous report routes use the same builders, so both paths produce
+# identical files. Only the arguments named in `filters` are stored with a
+# job. Kinds that are not tables (label sheets) bring their own
+# `write(query, path, format, count)` and file extension instead.
+JOB_FORMATS = ('xlsx', 'csv', 'json', 'ndjson')
+JOB_MIMETYPES = dict(EXPORT_MIMETYPES, xlsx=XLSX_MIMETYPE, zip='application/zip')
+
+ExportKind = namedtuple('ExportKind', 'title basename build admin_only filters formats write extension',
+                        defaults=(JOB_FORMATS, None, None))
+HOUSEKEEPING_SECONDS = 60
+
+TRANSACTION_HEADERS = ['Date/Time', 'Type', 'SSID', 'Item Name', 'Warehouse', 'Quantity', 'User', 'Notes']
+INVENTORY_HEADERS = ['SSID', 'Name', 'Warehouse', 'Category', 'Current Stock', 'Unit', 'Reorder Level',
+                     'Status', 'Unit Price', 'Description']
+LOW_STOCK_HEADERS = ['SSID', 'Name', 'Warehouse', 'Category', 'Current Stock', 'Reorder Level',
+                     'Shortage', 'Unit', 'Unit Price']
+REORDER_HEADERS = ['SSID', 'Name', 'Warehouse', 'Current Stock', 'Reorder Level', 'Avg Daily Demand',
+                   'Demand Std Dev', 'Suggested Reorder Level', 'Days of Cover']
+MOVEMENT_HEADERS = {
+    'item': ['Period', 'SSID', 'Item Name', 'Warehouse', 'In', 'Out', 'Adjustment', 'Movements'],
+    'warehouse': ['Period', 'Warehouse', 'In', 'Out', 'Adjustment', 'Movements'],
+}
+
+
+class JobCancelled(Exception):
+    """The job was cancelled (or taken over by another worker) while running"""
+
+
+def _transaction_row(row):
+    created_at, transaction_type, ssid, item_name, warehouse_name, quantity, username, notes = row
+    return [created_at.strftime('%Y-%m-%d %H:%M:%S'), transaction_type.value.upper(), ssid, item_name,
+            warehouse_name, quantity, username, notes or '']
+
+
+def transaction_report(args):
+    """?start_date= / ?end_date= (inclusive) and ?warehouse_id= / ?item_id= / ?user_id="""
+    query = transaction_export_rows()
+    if args.get('start_date'):
+        query = query.filter(Transaction.created_at >= parse_day(args['start_date']))
+    if args.get('end_date'):
+        query = query.filter(Transaction.created_at < parse_day(args['end_date'], end=True))
+    for arg, column in (('warehouse_id', Transaction.warehouse_id),
+                        ('item_id', Transaction.item_id),
+                        ('user_id', Transaction.user_id)):
+        value = args.get(arg, type=int)
+        if value:
+            query = query.filter(column == value)
+    return TRANSACTION_HEADERS, query.order_by(Transaction.created_at.desc()), _transaction_row
+
+
+def _inventory_row(row):
+    ssid, name, warehouse_name, category_name, current_stock, unit, reorder_level, unit_price, description = row
+    return [ssid, name, warehouse_name, category_name, current_stock, unit, reorder_level,
+            'LOW STOCK' if current_stock <= reorder_level else 'OK', float(unit_price), description or '']
+
+
+def inventory_report(args):
+    """?warehouse_id= and ?as_of= (stock at the end of that day, or at an ISO datetime)"""
+    if args.get('as_of'):
+        when = parse_day(args['as_of'], end=True)
+        query = inventory_rows_as_of(stock_as_of(when)).filter(Item.created_at < when)
+    else:
+        query = inventory_rows()
+    warehouse_id = args.get('warehouse_id', type=int)
+    if warehouse_id:
+        query = query.filter(Item.warehouse_id == warehouse_id)
+    return INVENTORY_HEADERS, query, _inventory_row
+
+
+def _low_stock_row(row):
+    ssid, name, warehouse_name, category_name, current_stock, unit, reorder_level, unit_price, _ = row
+    return [ssid, name, warehouse_name, category_name, current_stock, reorder_level,
+            reorder_level - current_stock, unit, float(unit_price)]
+
+
+def low_stock_report(args):
+    return LOW_STOCK_HEADERS, low_stock_rows(), _low_stock_row
+
+
+def movement_report(args):
+    """?period=day|week|month, ?by=item|warehouse, ?from= / ?to= days (inclusive; the
+    first and last periods only count days in range) and ?warehouse_id= / ?item_id="""
+    period = args.get('period', 'day')
+    by = args.get('by', 'item')
+    if period not in PERIODS or by not in MOVEMENT_HEADERS:
+        abort(400)
+    query = movement_totals(period, by)
+    if args.get('from'):
+        query = query.filter(MovementRollup.day >= parse_day(args['from']).date())
+    if args.get('to'):
+        query = query.filter(MovementRollup.day <= parse_day(args['to']).date())
+    for arg, column in (('warehouse_id', MovementRollup.warehouse_id),
+                        ('item_id', MovementRollup.item_id)):
+        value = args.get(arg, type=int)
+        if value:
+            query = query.filter(column == value)
+    return MOVEMENT_HEADERS[by], query, list
+
+
+def reorder_report(args):
+    """?window_days= / ?lead_days= / ?service_z= (see app/forecast.py) and ?warehouse_id="""
+    settings = forecast_settings(args)
+
+    def shape(row):
+        _, ssid, name, warehouse_name, current_stock, reorder_level, daily, deviation, level, cover = row
+        return [ssid, name, warehouse_name, current_stock, reorder_level, round(daily, 2),
+                round(deviation, 2), level, round(cover, 1)]
+
+    return REORDER_HEADERS, suggestions(settings, args.get('warehouse_id', type=int)), shape
+
+
+def payment_report(args):
+    """?from= / ?to= creation dates and ?status=a,b, newest first"""
+    query = filter_created(payment_export_rows(), Payment.created_at, args)
+    query = filter_values(query, Payment.status, 'status', args)
+    return PAYMENT_EXPORT_FIELDS, query.order_by(Payment.created_at.desc()), list
+
+
+def seller_report(args):
+    """?from= / ?to= creation dates"""
+    query = filter_created(seller_export_rows(), Seller.created_at, args)
+    return SELLER_EXPORT_FIELDS, query.order_by(Seller.name, Seller.id), list
+
+
+EXPORT_KINDS = {
+    'transactions': ExportKind('Transactions', 'transactions_export', transaction_report, False,
+                               ('start_date', 'end_date', 'warehouse_id', 'item_id', 'user_id')),
+    'inventory': ExportKind('Inventory', 'inventory_export', inventory_report, False, ('warehouse_id', 'as_of')),
+    'low_stock': ExportKind('Low stock', 'low_stock_report', low_stock_report, False, ()),
+    'movements': ExportKind('Stock movements', 'stock_movements', movement_report, False,
+                            ('period', 'by', 'from', 'to', 'warehouse_id', 'item_id')),
+    'reorder': ExportKind('Reorder levels', 'reorder_levels', reorder_report, False,
+                          ('window_days', 'lead_days', 'service_z', 'warehouse_id')),
+    'payments': ExportKind('Payments', 'payments', payment_report, True, ('from', 'to', 'status')),
+    'sellers': ExportKind('Sellers', 'sellers', seller_report, True, ('from', 'to')),
+    'labels': ExportKind('QR labels', 'labels', label_report, False, ('warehouse_id', 'category_id', 'ids'),
+                         LABEL_FORMATS, write_label_job, 'zip'),
+}
+
+
+def job_args(job):
+    return MultiDict(json.loads(job.params))
+
+
+def _extension(kind, fmt):
+    return getattr(EXPORT_KINDS.get(kind), 'extension', None) or fmt
+
+
+def job_mimetype(job):
+    return JOB_MIMETYPES[_extension(job.kind, job.format)]
+
+
+def job_path(job):
+    return _job_path(job.id, job.kind, job.format)
+
+
+def _job_path(job_id, kind, fmt):
+    return os.path.join(current_app.config['EXPORT_FOLDER'], f'{job_id}.{_extension(kind, fmt)}')
+
+
+def enqueue(kind, fmt, args, user):
+    """Queue an export of `kind` with filter `args` (a MultiDict) for `user`.
+
+    Arguments that are not among the kind's filters (form fields such as
+    the CSRF token) are dropped. The query is built once here so invalid
+    filters fail the request (400) instead of the job.
+    """
+    filters = EXPORT_KINDS[kind].filters
+    args = MultiDict([(name, value) for name, value in args.items(multi=True) if name in filters])
+    EXPORT_KINDS[kind].build(args)
+    job = ExportJob(kind=kind, format=fmt, params=json.dumps(list(args.items(multi=True))),
+                    created_by_id=user.id)
+    db.session.add(job)
+    db.session.commit()
+    pool = current_app.extensions.get('export_workers')
+    if pool is not None:
+        pool.wake()
+    return job
+
+
+def cancel(job):
+    """Cancel a queued or running job; a running worker stops at its next progress update"""
+    table = ExportJob.__table__
+    now = datetime.utcnow()
+    result = db.session.execute(
+        update(table).where(table.c.id == job.id, table.c.status.in_(['queued', 'running'])).values(
+            status='cancelled', finished_at=now, expires_at=_expiry(now)
+        )
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def _expiry(now):
+    return now + timedelta(hours=current_app.config['EXPORT_RETENTION_HOURS'])
+
+
+def claim_next(worker):
+    """Mark the oldest queued job as running for `worker`; returns its id or None"""
+    table = ExportJob.__table__
+    while True:
+        job_id = queued_export_jobs().with_entities(ExportJob.id).limit(1).scalar()
+        db.session.rollback()
+        if job_id is None:
+            return None
+        now = datetime.utcnow()
+        with db.engine.begin() as connection:
+            claimed = connection.execute(
+                update(table).where(table.c.id == job_id, table.c.status == 'queued').values(
+                    status='running', started_at=now, heartbeat_at=now, attempts=table.c.attempts + 1,
+                    error=None
+                )
+            ).rowcount
+        if claimed:
+            current_app.logger.info('Export job %s claimed by %s', job_id, worker)
+            return job_id
+
+
+def _report_progress(job_id, **values):
+    """Record progress; raises JobCancelled once the job is no longer ours to run"""
+    table = ExportJob.__table__
+    with db.engine.begin() as connection:
+        updated = connection.execute(
+            update(table).where(table.c.id == job_id, table.c.status == 'running').values(
+                heartbeat_at=datetime.utcnow(), **values
+            )
+        ).rowcount
+    if not updated:
+        raise JobCancelled(job_id)
+
+
+class _Progress:
+    """Counts rows on their way to the file and reports them every EXPORT_PROGRESS_SECONDS"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.done = 0
+        self.interval = current_app.config['EXPORT_PROGRESS_SECONDS']
+
+    def count(self, rows):
+        reported = time.monotonic()
+        for row in rows:
+            yield row
+            self.done += 1
+            if time.monotonic() - reported >= self.interval:
+                _report_progress(self.job_id, rows_done=self.done)
+                reported = time.monotonic()
+
+
+def _excel_value(value):
+    return value.value if isinstance(value, Enum) else value
+
+
+def _write(job, path):
+    """Write the job's export to `path`; returns the number of rows"""
+    kind = EXPORT_KINDS[job.kind]
+    headers, query, shape = kind.build(job_args(job))
+    _report_progress(job.id, rows_total=query.order_by(None).count())
+    progress = _Progress(job.id)
+    if kind.write is not None:
+        kind.write(query, path, job.format, progress.count)
+        return progress.done
+    rows = progress.count(shape(row) for row in query.yield_per(current_app.config['EXPORT_CHUNK_SIZE']))
+    if job.format == 'xlsx':
+        rows = ([_excel_value(value) for value in row] for row in rows)
+        with open(path, 'wb') as fileobj:
+            for chunk in excel_chunks(rows, headers, current_app.config['EXPORT_WIDTH_SAMPLE_ROWS']):
+                fileobj.write(chunk)
+            EXPORT_BYTES.inc('xlsx', amount=fileobj.tell())
+    else:
+        with open(path, 'w', encoding='utf-8', newline='') as fileobj:
+            for chunk in export_chunks(rows, headers, job.format):
+                fileobj.write(chunk)
+    return progress.done
+
+
+def _finish(job_id, **values):
+    table = ExportJob.__table__
+    now = datetime.utcnow()
+    with db.engine.begin() as connection:
+        return connection.execute(
+            update(table).where(table.c.id == job_id, table.c.status == 'running').values(
+                finished_at=now, heartbeat_at=now, expires_at=_expiry(now), **values
+            )
+        ).rowcount == 1
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def run_job(job_id):
+    """Build the file of a claimed job and record the outcome"""
+    job = db.session.get(ExportJob, job_id)
+    path = job_path(job)
+    partial = path + '.part'
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        rows = _write(job, partial)
+    except JobCancelled:
+        _remove(partial)
+        current_app.logger.info('Export job %s cancelled', job_id)
+        return
+    except Exception as exc:
+        _remove(partial)
+        current_app.logger.exception('Export job %s failed', job_id)
+        _finish(job_id, status='failed', error=f'{type(exc).__name__}: {exc}'[:1000])
+        return
+    finally:
+        # End the read transaction before the job's row is updated
+        db.session.rollback()
+
+    stamp = job.created_at.strftime('%Y%m%d_%H%M%S')
+    os.replace(partial, path)
+    if not _finish(job_id, status='done', rows_done=rows, size_bytes=os.path.getsize(path),
+                   filename=f'{EXPORT_KINDS[job.kind].basename}_{stamp}.{_extension(job.kind, job.format)}'):
+        # Cancelled while the file was being closed
+        _remove(path)
+
+
+def housekeeping():
+    """Retry or fail jobs whose worker went away, and delete expired exports"""
+    table = ExportJob.__table__
+    config = current_app.config
+    now = datetime.utcnow()
+    stale = table.c.status == 'running', table.c.heartbeat_at < now - timedelta(seconds=config['EXPORT_JOB_STALE_SECONDS'])
+    with db.engine.begin() as connection:
+        connection.execute(
+            update(table).where(*stale, table.c.attempts < config['EXPORT_JOB_MAX_ATTEMPTS']).values(status='queued')
+        )
+        connection.execute(
+            update(table).where(*stale).values(status='failed', error='Export worker stopped responding',
+                                               finished_at=now, expires_at=_expiry(now))
+        )
+        expired = connection.execute(
+            select(table.c.id, table.c.kind, table.c.format).where(table.c.expires_at < now)
+        ).all()
+        if expired:
+            connection.execute(delete(table).where(table.c.id.in_([job_id for job_id, _, _ in expired])))
+    for job_id, kind, fmt in expired:
+        _remove(_job_path(job_id, kind, fmt))
+    return len(expired)
+
+
+class ExportWorkerPool:
+    """Threads that claim and run queued export jobs"""
+
+    def __init__(self, app, threads):
+        self.app = app
+        self.threads = threads
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._started = False
+        self._housekeeping_at = 0
+
+    def start(self):
+        with self._lock:
+            if self._started or not self.threads:
+                return
+            for n in range(self.threads):
+                threading.Thread(target=self._run, name=f'export-worker-{n}', daemon=True).start()
+            self._started = True
+
+    def wake(self):
+        self._wakeup.set()
+
+    def work_once(self):
+        """Run housekeeping when due and at most one job; True if a job ran"""
+        if time.monotonic() - self._housekeeping_at >= HOUSEKEEPING_SECONDS:
+            self._housekeeping_at = time.monotonic()
+            housekeeping()
+        job_id = claim_next(self.name)
+        if job_id is None:
+            return False
+        run_job(job_id)
+        return True
+
+    def _run(self):
+        poll = self.app.config['EXPORT_POLL_SECONDS']
+        while True:
+            busy = False
+            try:
+                with self.app.app_context():
+                    busy = self.work_once()
+            except Exception:
+                self.app.logger.exception('Export worker error')
+            if not busy:
+                self._wakeup.wait(poll)
+                self._wakeup.clear()
+
+
+@click.group('exports')
+def exports_cli():
+    """Background export jobs."""
+
+
+@exports_cli.command('worker')
+@click.option('--threads', type=int, default=1, show_default=True, help='Jobs run at the same time.')
+@with_appcontext
+def worker_command(threads):
+    """Run export jobs in this process until interrupted."""
+    pool = ExportWorkerPool(current_app._get_current_object(), threads)
+    click.echo(f'Export worker {pool.name} running {threads} thread(s)')
+    pool.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+@exports_cli.command('purge')
+@with_appcontext
+def purge_command():
+    """Delete expired export files and requeue abandoned jobs."""
+    click.echo(f'{housekeeping()} expired export(s) deleted')
+
+
+def init_app(app):
+    app.cli.add_command(exports_cli)
+    pool = app.extensions['export_workers'] = ExportWorkerPool(app, app.config['EXPORT_WORKER_THREADS'])
+
+    # Started with the first request rather than here, so CLI commands and
+    # pre-fork servers do not spin up workers they never use
+    @app.before_request
+    def start_export_workers():
+        pool.start()
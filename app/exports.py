@@ -0,0 +1,89 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from enum import Enum
+from flask import abort, current_app, request
+from app.metrics import EXPORT_BYTES, EXPORT_ROWS, count_bytes, count_rows
+from app.utils import csv_chunks, json_array_chunks, ndjson_chunks, stream_response, accepts_gzip, NDJSON_MIMETYPE
+
+# Streaming CSV / JSON / NDJSON exports. The caller hands over a column-tuple
+# query and the field names of its columns; rows are fetched in
+# EXPORT_CHUNK_SIZE batches and written to the response as they arrive, so
+# memory does not grow with the size of the export. Responses add the utf-8
+# charset to text/* types themselves, so the mapping holds bare types.
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'json': 'application/json',
+    'ndjson': NDJSON_MIMETYPE,
+}
+
+
+def export_value(value):
+    """Plain value for an export cell: money as an exact string, dates and times in ISO format"""
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
+def export_format():
+    """?format= (csv, json or ndjson; csv by default); 400 for anything else"""
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in EXPORT_MIMETYPES:
+        abort(400)
+    return fmt
+
+
+def parse_day(value, end=False):
+    """YYYY-MM-DD (the following midnight when `end` is set) or an ISO datetime; 400 if invalid"""
+    try:
+        if len(value) == 10:
+            day = datetime.strptime(value, '%Y-%m-%d')
+            return day + timedelta(days=1) if end else day
+        return datetime.fromisoformat(value)
+    except ValueError:
+        abort(400)
+
+
+def filter_created(query, column, args=None):
+    """Apply ?from= and ?to= (YYYY-MM-DD, inclusive, or ISO datetimes) to `column`"""
+    args = request.args if args is None else args
+    if args.get('from'):
+        query = query.filter(column >= parse_day(args['from']))
+    if args.get('to'):
+        query = query.filter(column < parse_day(args['to'], end=True))
+    return query
+
+
+def filter_values(query, column, arg, args=None):
+    """Apply ?<arg>=a,b as an IN filter on `column`"""
+    args = request.args if args is None else args
+    values = [v.strip() for v in args.get(arg, '').split(',') if v.strip()]
+    if values:
+        query = query.filter(column.in_(values))
+    return query
+
+
+def export_chunks(rows, fields, fmt):
+    """csv/json/ndjson text for `rows` (value sequences in `fields` order), produced incrementally"""
+    rows = ([export_value(value) for value in row] for row in count_rows(rows, EXPORT_ROWS, fmt))
+    if fmt == 'csv':
+        chunks = csv_chunks(fields, (['' if v is None else v for v in row] for row in rows))
+    else:
+        records = (dict(zip(fields, row)) for row in rows)
+        chunks = ndjson_chunks(records) if fmt == 'ndjson' else json_array_chunks(records)
+    return count_bytes(chunks, EXPORT_BYTES, fmt)
+
+
+def export_filename(basename, fmt):
+    """Download name stamped like the Excel exports: <basename>_YYYYmmdd_HHMMSS.<fmt>"""
+    return f"{basename}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+
+
+def export_response(query, fields, fmt, basename):
+    """Stream `query` (column tuples in `fields` order) as a csv/json/ndjson download"""
+    chunks = export_chunks(query.yield_per(current_app.config['EXPORT_CHUNK_SIZE']), fields, fmt)
+    return stream_response(chunks, EXPORT_MIMETYPES[fmt], filename=export_filename(basename, fmt),
+                           compress=accepts_gzip())
@@ -0,0 +1,146 @@
+import math
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+import click
+from flask import abort, current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, update, func, bindparam, case, cast, Integer
+from app import db, low_stock, refdata, tombstones
+from app.models import Item, MovementRollup, TransactionType
+from app.queries import reorder_rows
+from app.stock import stock_cli
+
+# Demand forecasts and suggested reorder levels. Daily OUT totals come from
+# movement_rollup (see app/rollups.py), so a single grouped scan of the
+# window yields every item's demand and sum of squared daily demand at once,
+# and the suggestion itself is a few more column expressions on that query:
+#
+#     daily demand  d = sum / window          (days without demand count as 0)
+#     deviation     s = sqrt(sum_sq / window - d^2)
+#     reorder level   = ceil(d * lead + z * s * sqrt(lead))
+#     days of cover   = current_stock / d
+#
+# i.e. enough stock to cover the mean demand over the replenishment lead
+# time plus z standard deviations of it (z = 1.65 is a 95% service level).
+# Only items with demand in the window get a suggestion. sqrt() and ceil()
+# are SQLite's math functions (see app/bootstrap.py for builds without).
+Settings = namedtuple('Settings', 'window_days lead_days service_z')
+Suggestion = namedtuple('Suggestion', 'daily_demand deviation reorder_level days_of_cover')
+
+WRITE_BATCH = 5000
+
+
+def _setting(args, name, default, convert):
+    # Only missing or blank values fall back; an explicit 0 is a setting
+    value = args.get(name)
+    return convert(default if value is None or value == '' else value)
+
+
+def forecast_settings(args=None):
+    """Settings from ?window_days= / ?lead_days= / ?service_z=, defaulting to config; 400 when out of range"""
+    config = current_app.config
+    args = args or {}
+    try:
+        window_days = _setting(args, 'window_days', config['REORDER_WINDOW_DAYS'], int)
+        lead_days = _setting(args, 'lead_days', config['REORDER_LEAD_DAYS'], float)
+        service_z = _setting(args, 'service_z', config['REORDER_SERVICE_Z'], float)
+    except ValueError:
+        abort(400)
+    if not (1 <= window_days <= 3660 and 0 < lead_days <= 365 and 0 <= service_z <= 5):
+        abort(400)
+    return Settings(window_days, lead_days, service_z)
+
+
+def demand_by_item(window_days, end=None):
+    """Subquery of (item_id, demand, demand_sq): OUT quantities on the `window_days` days up to `end` (today)"""
+    end = end or datetime.utcnow().date()
+    start = end - timedelta(days=window_days - 1)
+    # Rollup rows are per day and warehouse: sum each day first, so an item
+    # moved between warehouses still has one day's demand (and square) per day
+    daily = select(
+        MovementRollup.item_id,
+        func.sum(MovementRollup.quantity).label('quantity')
+    ).where(
+        MovementRollup.transaction_type == TransactionType.OUT,
+        MovementRollup.day >= start, MovementRollup.day <= end
+    ).group_by(MovementRollup.item_id, MovementRollup.day).subquery('daily')
+    return select(
+        daily.c.item_id,
+        func.sum(daily.c.quantity).label('demand'),
+        func.sum(daily.c.quantity * daily.c.quantity).label('demand_sq')
+    ).group_by(daily.c.item_id).subquery('demand')
+
+
+def suggestion_columns(demand, settings):
+    """Suggestion of column expressions over a demand_by_item() subquery"""
+    daily = demand.c.demand * 1.0 / settings.window_days
+    variance = demand.c.demand_sq * 1.0 / settings.window_days - daily * daily
+    deviation = func.sqrt(case((variance > 0, variance), else_=0.0))
+    level = cast(func.ceil(daily * settings.lead_days
+                           + settings.service_z * deviation * math.sqrt(settings.lead_days)), Integer)
+    cover = func.coalesce(Item.current_stock, 0) / daily
+    return Suggestion(daily.label('daily_demand'), deviation.label('deviation'),
+                      level.label('suggested_level'), cover.label('days_of_cover'))
+
+
+def suggestions(settings, warehouse_id=None):
+    """reorder_rows() for items with demand in the window, fewest days of cover first"""
+    demand = demand_by_item(settings.window_days)
+    query = reorder_rows(demand, suggestion_columns(demand, settings))
+    if warehouse_id:
+        query = query.filter(Item.warehouse_id == warehouse_id)
+    return query
+
+
+def _differing(settings, warehouse_id=None):
+    # (item id, suggested level) where that differs from the item's level
+    demand = demand_by_item(settings.window_days)
+    level = suggestion_columns(demand, settings).reorder_level
+    query = db.session.query(Item.id, level).select_from(demand).join(
+        Item, Item.id == demand.c.item_id
+    ).filter(demand.c.demand > 0, Item.reorder_level.is_distinct_from(level))
+    if warehouse_id:
+        query = query.filter(Item.warehouse_id == warehouse_id)
+    return query
+
+
+def apply_suggestions(settings, warehouse_id=None):
+    """Write suggested reorder levels to the items (with demand) whose level differs; returns how many"""
+    changes = [{'b_id': item_id, 'b_level': level} for item_id, level in _differing(settings, warehouse_id)]
+
+    items = Item.__table__
+    now = datetime.utcnow()
+    statement = update(items).where(items.c.id == bindparam('b_id')).values(
+        reorder_level=bindparam('b_level'), updated_at=now
+    )
+    connection = db.session.connection()
+    for offset in range(0, len(changes), WRITE_BATCH):
+        batch = changes[offset:offset + WRITE_BATCH]
+        connection.execute(statement, batch)
+        low_stock.refresh(connection, [change['b_id'] for change in batch])
+    if changes:
+        tombstones.bump(connection, [warehouse_id] if warehouse_id else [w.id for w in refdata.warehouses()])
+    db.session.commit()
+    return len(changes)
+
+
+@stock_cli.command('reorder-levels')
+@click.option('--window-days', type=int, help='Days of demand history (default: REORDER_WINDOW_DAYS).')
+@click.option('--lead-days', type=float, help='Replenishment lead time (default: REORDER_LEAD_DAYS).')
+@click.option('--service-z', type=float, help='Safety factor in standard deviations (default: REORDER_SERVICE_Z).')
+@click.option('--warehouse-id', type=int, help='Only items in this warehouse.')
+@click.option('--apply', 'apply_levels', is_flag=True, help='Write the suggested levels to the items.')
+@with_appcontext
+def reorder_levels_command(window_days, lead_days, service_z, warehouse_id, apply_levels):
+    """Suggest reorder levels from recent demand."""
+    current = forecast_settings({'window_days': window_days, 'lead_days': lead_days, 'service_z': service_z})
+    started = time.perf_counter()
+    if apply_levels:
+        changed = apply_suggestions(current, warehouse_id)
+        click.echo(f'{changed} reorder level(s) updated ({time.perf_counter() - started:.1f}s)')
+        return
+    with_demand = suggestions(current, warehouse_id).count()
+    differ = _differing(current, warehouse_id).count()
+    click.echo(f'{with_demand} item(s) with demand, {differ} with a different suggested level '
+               f'({time.perf_counter() - started:.1f}s)')
@@ -0,0 +1,132 @@
+import re
+import click
+from flask.cli import with_appcontext
+from flask import current_app
+from sqlalchemy import text, table, column, select
+from app import db
+from app.bootstrap import db_cli
+from app.models import Item, Warehouse, Category
+
+# Full-text item search on an SQLite FTS5 index over SSID, name,
+# description and category name. item_fts rows share the item's rowid and
+# are maintained by triggers, so every write path (ORM, bulk SQL, category
+# renames) keeps the index in sync. Results are ordered by FTS5's rank,
+# configured as bm25 with SSID and name weighted above category and
+# description. Ranking is done over at most SEARCH_RANK_CANDIDATES matches,
+# so very broad terms cost the same as selective ones: results are exact
+# whenever a query matches fewer items than that, and the best of the first
+# candidates otherwise. On other databases search falls back to the indexed
+# SSID/name prefix search used by the item picker.
+item_fts = table('item_fts', column('rowid'), column('rank'))
+
+RANK_WEIGHTS = (10.0, 5.0, 1.0, 2.0)  # ssid, name, description, category
+MAX_TERMS = 8
+
+_CATEGORY_OF_NEW = '(SELECT name FROM category WHERE id = new.category_id)'
+_DDL = [
+    # Prefix indexes make 2- and 3-character prefix queries index lookups
+    "CREATE VIRTUAL TABLE IF NOT EXISTS item_fts USING fts5("
+    "ssid, name, description, category, prefix='2 3')",
+    f"""CREATE TRIGGER IF NOT EXISTS item_fts_insert AFTER INSERT ON item BEGIN
+        INSERT INTO item_fts (rowid, ssid, name, description, category)
+        VALUES (new.id, new.ssid, new.name, coalesce(new.description, ''), {_CATEGORY_OF_NEW});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS item_fts_update
+    AFTER UPDATE OF ssid, name, description, category_id ON item BEGIN
+        UPDATE item_fts SET ssid = new.ssid, name = new.name,
+            description = coalesce(new.description, ''), category = {_CATEGORY_OF_NEW}
+        WHERE rowid = new.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS item_fts_delete AFTER DELETE ON item BEGIN
+        DELETE FROM item_fts WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS item_fts_category AFTER UPDATE OF name ON category BEGIN
+        UPDATE item_fts SET category = new.name
+        WHERE rowid IN (SELECT id FROM item WHERE category_id = new.id);
+    END""",
+]
+
+
+def available():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def create(connection):
+    """Create the FTS table and its triggers, and fill it from the item table"""
+    for statement in _DDL:
+        connection.exec_driver_sql(statement)
+    connection.exec_driver_sql(
+        f"INSERT INTO item_fts (item_fts, rank) VALUES ('rank', 'bm25({', '.join(map(str, RANK_WEIGHTS))})')"
+    )
+    rebuild(connection)
+
+
+def rebuild(connection):
+    """Repopulate the index from the item table"""
+    connection.exec_driver_sql('DELETE FROM item_fts')
+    connection.exec_driver_sql(
+        "INSERT INTO item_fts (rowid, ssid, name, description, category) "
+        "SELECT item.id, item.ssid, item.name, coalesce(item.description, ''), category.name "
+        "FROM item JOIN category ON category.id = item.category_id"
+    )
+
+
+def match_expression(query):
+    """FTS5 MATCH string for free text: every word must match as a prefix.
+
+    Each word is quoted, so punctuation in SSIDs (hyphens, dots) becomes a
+    phrase of its parts instead of FTS5 syntax, and the trailing * makes the
+    last part a prefix, which is what a partial scanner read needs.
+    """
+    terms = [t for t in query.split() if re.search(r'\w', t)][:MAX_TERMS]
+    if not terms:
+        return None
+    return ' '.join('"{}"*'.format(t.replace('"', '""')) for t in terms)
+
+
+def _search_rows():
+    return db.session.query(
+        Item.id, Item.ssid, Item.name, Item.current_stock, Item.unit, Item.reorder_level,
+        Warehouse.name.label('warehouse'), Category.name.label('category')
+    )
+
+
+def ranked(expression, candidates=None):
+    """Rows matching an FTS5 MATCH expression, best first"""
+    hits = select(item_fts.c.rowid, item_fts.c.rank).where(text('item_fts MATCH :match'))
+    if candidates:
+        hits = hits.limit(candidates)
+    hits = hits.subquery('hits')
+    return _search_rows().select_from(hits).join(
+        Item, Item.id == hits.c.rowid
+    ).join(Warehouse, Warehouse.id == Item.warehouse_id).join(
+        Category, Category.id == Item.category_id
+    ).params(match=expression).order_by(hits.c.rank)
+
+
+def search(query, page=1, per_page=20):
+    """Best matches for `query`, one page at a time; returns (rows, has_next)"""
+    if not available():
+        from app.queries import search_items
+        ids = [row.id for row in search_items(query, per_page)] if page == 1 else []
+        found = {row.id: row for row in _search_rows().join(Item.warehouse).join(Item.category)
+                 .filter(Item.id.in_(ids))}
+        return [found[i] for i in ids if i in found], False
+
+    expression = match_expression(query)
+    if expression is None:
+        return [], False
+    candidates = current_app.config['SEARCH_RANK_CANDIDATES']
+    rows = ranked(expression, candidates).offset((page - 1) * per_page).limit(per_page + 1).all()
+    return rows[:per_page], len(rows) > per_page
+
+
+@db_cli.command('reindex-search')
+@with_appcontext
+def reindex_command():
+    """Rebuild the full-text item search index."""
+    if not available():
+        raise click.ClickException('Full-text search needs SQLite FTS5')
+    with db.engine.begin() as connection:
+        rebuild(connection)
+    click.echo('Search index rebuilt')
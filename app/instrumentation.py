@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from flask import g, request
+from sqlalchemy import event
+
+_local = threading.local()
+
+
+class QueryStats:
+    """Statement count, time and lazy loads recorded over one request or block"""
+
+    def __init__(self, keep_statements=False):
+        self.count = 0
+        self.duration = 0.0
+        self.lazy_loads = Counter()
+        self.statements = [] if keep_statements else None
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        if self.statements is not None:
+            self.statements.append(statement)
+
+    def n_plus_one(self, threshold):
+        """Relationships lazy-loaded at least `threshold` times"""
+        return {key: n for key, n in self.lazy_loads.most_common() if n >= threshold}
+
+    def summary(self, threshold):
+        text = f'{self.count} queries in {self.duration * 1000:.1f}ms'
+        repeated = self.n_plus_one(threshold)
+        if repeated:
+            text += '; N+1 lazy loads: ' + ', '.join(f'{key} x{n}' for key, n in repeated.items())
+        return text
+
+
+def _recorders():
+    if not hasattr(_local, 'recorders'):
+        _local.recorders = []
+    return _local.recorders
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append((context, time.perf_counter()))
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info['query_start'].pop()[1]
+    for stats in _recorders():
+        stats.record(statement, duration)
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute; drop its start
+    # so later statements on the pooled connection are not timed against it
+    conn = exception_context.connection
+    starts = conn.info.get('query_start') if conn is not None else None
+    if starts and starts[-1][0] is exception_context.execution_context:
+        starts.pop()
+
+
+def _do_orm_execute(orm_execute_state):
+    if not orm_execute_state.is_relationship_load or orm_execute_state.lazy_loaded_from is None:
+        return
+    path = orm_execute_state.loader_strategy_path
+    key = str(path.prop) if path is not None else 'unknown'
+    for stats in _recorders():
+        stats.lazy_loads[key] += 1
+
+
+@contextmanager
+def record_queries(keep_statements=True):
+    """Record every statement run on this thread inside the block"""
+    stats = QueryStats(keep_statements=keep_statements)
+    recorders = _recorders()
+    recorders.append(stats)
+    try:
+        yield stats
+    finally:
+        recorders.remove(stats)
+
+
+@contextmanager
+def assert_query_budget(max_queries, allow_n_plus_one=False, threshold=None):
+    """Fail when the block runs more than `max_queries` statements.
+
+    Meant for tests, e.g. ``with assert_query_budget(5): client.get('/items/')``.
+    Repeated lazy loads fail the assertion too unless `allow_n_plus_one` is set.
+    """
+    from flask import current_app
+    if threshold is None:
+        threshold = current_app.config['SQL_N_PLUS_ONE_THRESHOLD']
+    with record_queries() as stats:
+        yield stats
+    problems = []
+    if stats.count > max_queries:
+        problems.append(f'{stats.count} queries exceeds budget of {max_queries}')
+    if not allow_n_plus_one and stats.n_plus_one(threshold):
+        problems.append('N+1 lazy loads: ' + ', '.join(
+            f'{key} x{n}' for key, n in stats.n_plus_one(threshold).items()))
+    if problems:
+        statements = '\n'.join(f'  {s}' for s in stats.statements)
+        raise AssertionError('; '.join(problems) + f'\nStatements:\n{statements}')
+
+
+def init_app(app, db):
+    """Hook statement counting into the app's engines and, with SQL_INSTRUMENTATION, the request cycle"""
+    # The listeners only time statements while something records them
+    # (record_queries, profiled requests), so they are always installed
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+            event.listen(engine, 'handle_error', _handle_error)
+    if not event.contains(db.session, 'do_orm_execute', _do_orm_execute):
+        event.listen(db.session, 'do_orm_execute', _do_orm_execute)
+
+    if not app.config['SQL_INSTRUMENTATION']:
+        return
+
+    threshold = app.config['SQL_N_PLUS_ONE_THRESHOLD']
+
+    @app.before_request
+    def start_query_stats():
+        g.query_stats = QueryStats()
+        _recorders().append(g.query_stats)
+
+    @app.after_request
+    def add_query_stats_headers(response):
+        stats = g.get('query_stats')
+        if stats is not None and (app.config['SQL_STATS_HEADERS'] or app.debug or app.testing):
+            response.headers['X-SQL-Queries'] = str(stats.count)
+            response.headers['X-SQL-Time-ms'] = f'{stats.duration * 1000:.1f}'
+            repeated = stats.n_plus_one(threshold)
+            if repeated:
+                response.headers['X-SQL-N-Plus-One'] = ','.join(f'{key}={n}' for key, n in repeated.items())
+        return response
+
+    @app.teardown_request
+    def log_query_stats(exc):
+        # Runs after streamed bodies finish, so the log line covers them too
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return
+        recorders = _recorders()
+        if stats in recorders:
+            recorders.remove(stats)
+        if stats.count:
+            log = app.logger.warning if stats.n_plus_one(threshold) else app.logger.info
+            log('%s %s: %s', request.method, request.path, stats.summary(threshold))
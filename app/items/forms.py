@@ -1,7 +1,8 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, TextAreaField, SelectField, IntegerField, DecimalField, SubmitField
 from wtforms.validators import DataRequired, Length, NumberRange, ValidationError
-from app.models import Item, Warehouse
+from app.models import Item
+from app import refdata
 
 class CreateItemForm(FlaskForm):
     ssid = StringField('SSID (Unique ID)', validators=[
@@ -37,7 +38,7 @@ class CreateItemForm(FlaskForm):
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.warehouse_id.choices = [(w.id, w.name) for w in Warehouse.query.all()]
+        self.warehouse_id.choices = refdata.warehouse_choices()
     
     def validate_ssid(self, ssid):
         item = Item.query.filter_by(ssid=ssid.data).first()
@@ -70,4 +71,4 @@ class EditItemForm(FlaskForm):
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.warehouse_id.choices = [(w.id, w.name) for w in Warehouse.query.all()]
+        self.warehouse_id.choices = refdata.warehouse_choices()
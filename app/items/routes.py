@@ -1,9 +1,14 @@
 from flask import render_template, redirect, url_for, flash, send_file, current_app, request, jsonify
 from flask_login import login_required, current_user
 from app.items import bp
-from app.models import Item, Warehouse, Category, db
+from app.models import Item, Category, db
 from app.items.forms import CreateItemForm, EditItemForm
 from app.utils import generate_qr_code
+from app.qr_cache import qr_etag
+from app.queries import items_with_refs
+from app.pagination import keyset_paginate
+from app.stats import summary_counts
+from app import refdata
 import os
 import uuid
 from datetime import datetime
@@ -12,11 +17,20 @@ from flask import abort
 @bp.route('/')
 @login_required
 def list_items():
-    page = request.args.get('page', 1, type=int)
-    items = Item.query.paginate(
-        page=page, per_page=20, error_out=False
-    )
-    return render_template('items/list.html', items=items)
+    sort = 'ssid' if request.args.get('sort') == 'ssid' else 'id'
+    columns = [Item.ssid] if sort == 'ssid' else [Item.id]
+    try:
+        items = keyset_paginate(items_with_refs(), columns,
+                                cursor=request.args.get('cursor'), per_page=20)
+    except ValueError:
+        abort(400)
+    
+    # Exact totals cost a full COUNT(*), so they are only computed on request
+    if request.args.get('count', type=int):
+        items.total, items.total_exact = Item.query.count(), True
+    else:
+        items.total = summary_counts()['items']
+    return render_template('items/list.html', items=items, sort=sort)
 
 @bp.route('/create', methods=['GET', 'POST'])
 @login_required
@@ -28,11 +42,12 @@ def create_item():
     form = CreateItemForm()
     if form.validate_on_submit():
         # Create category if it doesn't exist
-        category = Category.query.filter_by(name=form.category.data).first()
-        if not category:
+        category_id = refdata.category_id(form.category.data)
+        if category_id is None:
             category = Category(name=form.category.data)
             db.session.add(category)
             db.session.flush()  # Get the ID
+            category_id = category.id
         
         item = Item(
             ssid=form.ssid.data,
@@ -43,7 +58,7 @@ def create_item():
             reorder_level=form.reorder_level.data,
             unit_price=form.unit_price.data,
             warehouse_id=form.warehouse_id.data,
-            category_id=category.id
+            category_id=category_id
         )
         db.session.add(item)
         db.session.commit()
@@ -64,11 +79,12 @@ def edit_item(id):
     
     if form.validate_on_submit():
         # Handle category
-        category = Category.query.filter_by(name=form.category.data).first()
-        if not category:
+        category_id = refdata.category_id(form.category.data)
+        if category_id is None:
             category = Category(name=form.category.data)
             db.session.add(category)
             db.session.flush()
+            category_id = category.id
         
         item.name = form.name.data
         item.description = form.description.data
@@ -76,7 +92,7 @@ def edit_item(id):
         item.reorder_level = form.reorder_level.data
         item.unit_price = form.unit_price.data
         item.warehouse_id = form.warehouse_id.data
-        item.category_id = category.id
+        item.category_id = category_id
         
         db.session.commit()
         flash(f'Item "{item.ssid}" updated successfully!', 'success')
@@ -90,7 +106,7 @@ def edit_item(id):
 @bp.route('/qr/<int:id>')
 @login_required
 def generate_qr(id):
-    item = Item.query.get_or_404(id)
+    item = items_with_refs().filter(Item.id == id).first_or_404()
     filename = generate_qr_code(item)
     
     return render_template('items/qr_code.html', 
@@ -102,7 +118,16 @@ def generate_qr(id):
 def download_qr(filename):
     filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
     if os.path.exists(filepath):
-        return send_file(filepath, as_attachment=True)
+        # Content-addressed files never change, so they can be cached forever
+        etag = qr_etag(filename)
+        inline = request.args.get('inline', type=int) == 1
+        if etag is None:
+            return send_file(filepath, as_attachment=not inline)
+        response = send_file(filepath, as_attachment=not inline, etag=etag,
+                             max_age=current_app.config['QR_CACHE_MAX_AGE'], conditional=True)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
     else:
         flash('QR code file not found.', 'danger')
         return redirect(url_for('items.list_items'))
@@ -0,0 +1,230 @@
+import multiprocessing
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from itertools import chain, islice
+import click
+from flask import abort, current_app
+from PIL import Image, ImageDraw, ImageFont
+from app.models import Item
+from app.profiling import phase
+from app.queries import items_with_refs
+from app.utils import qr_payload, qr_matrix
+
+# Bulk QR label sheets. Payloads are built in the calling process (they need
+# the database); rendering the QR codes and composing the sheets is pure CPU
+# work, so each sheet is handed to a worker process as one task. A sheet of
+# labels per task keeps the pickling overhead small next to the rendering.
+#
+# Archives are built as "labels" export jobs (app/export_jobs.py), never on
+# the request path. Every job in a process shares one pool of LABEL_WORKERS
+# processes, started on first use, so concurrent jobs queue for the same
+# workers instead of each spawning their own.
+LABEL_FORMATS = ('png', 'pdf')
+SHEET_DPI = 200
+SHEET_SIZE = (1654, 2339)  # A4 at SHEET_DPI
+SHEET_MARGIN = 60
+LABEL_COLUMNS = 3
+LABEL_ROWS = 7
+LABELS_PER_SHEET = LABEL_COLUMNS * LABEL_ROWS
+LABEL_PADDING = 12
+
+
+def label_items(warehouse_id=None, category_id=None, item_ids=None):
+    """Items to label, in SSID order; filters are combined"""
+    query = items_with_refs()
+    if warehouse_id:
+        query = query.filter(Item.warehouse_id == warehouse_id)
+    if category_id:
+        query = query.filter(Item.category_id == category_id)
+    if item_ids is not None:
+        query = query.filter(Item.id.in_(item_ids))
+    return query.order_by(Item.ssid)
+
+
+def label_report(args):
+    """?warehouse_id=, ?category_id= and ?ids= (repeatable or comma separated); at least one"""
+    warehouse_id = args.get('warehouse_id', type=int)
+    category_id = args.get('category_id', type=int)
+    try:
+        item_ids = [int(i) for arg in args.getlist('ids') for i in arg.split(',') if i.strip()]
+    except ValueError:
+        abort(400)
+    if not (warehouse_id or category_id or item_ids):
+        abort(400)
+    return None, label_items(warehouse_id, category_id, item_ids or None), None
+
+
+def _truncate(draw, text, font, width):
+    if draw.textlength(text, font=font) <= width:
+        return text
+    while text and draw.textlength(text + '...', font=font) > width:
+        text = text[:-1]
+    return text + '...'
+
+
+def _qr_image(payload, size):
+    # Built straight from the module grid at one pixel per module, then
+    # scaled with nearest-neighbour so module edges stay sharp for scanners
+    matrix = qr_matrix(payload)
+    modules = len(matrix)
+    data = bytes(0 if dark else 255 for row in matrix for dark in row)
+    return Image.frombytes('L', (modules, modules), data).resize((size, size), Image.NEAREST)
+
+
+def render_sheet(labels, fmt='png'):
+    """Compose one printable sheet of (ssid, name, warehouse, payload) labels; returns file bytes"""
+    sheet = Image.new('L', SHEET_SIZE, 255)
+    draw = ImageDraw.Draw(sheet)
+    title_font = ImageFont.load_default(size=30)
+    text_font = ImageFont.load_default(size=22)
+    cell_w = (SHEET_SIZE[0] - 2 * SHEET_MARGIN) // LABEL_COLUMNS
+    cell_h = (SHEET_SIZE[1] - 2 * SHEET_MARGIN) // LABEL_ROWS
+    qr_size = cell_h - 2 * LABEL_PADDING
+    text_w = cell_w - qr_size - 3 * LABEL_PADDING
+
+    for index, (ssid, name, warehouse, payload) in enumerate(labels):
+        x = SHEET_MARGIN + (index % LABEL_COLUMNS) * cell_w
+        y = SHEET_MARGIN + (index // LABEL_COLUMNS) * cell_h
+        draw.rectangle([x, y, x + cell_w - 1, y + cell_h - 1], outline=200)
+
+        sheet.paste(_qr_image(payload, qr_size), (x + LABEL_PADDING, y + LABEL_PADDING))
+
+        text_x = x + qr_size + 2 * LABEL_PADDING
+        text_y = y + 3 * LABEL_PADDING
+        draw.text((text_x, text_y), _truncate(draw, ssid, title_font, text_w), font=title_font, fill=0)
+        draw.text((text_x, text_y + 48), _truncate(draw, name, text_font, text_w), font=text_font, fill=0)
+        draw.text((text_x, text_y + 80), _truncate(draw, warehouse, text_font, text_w), font=text_font, fill=90)
+
+    out = BytesIO()
+    if fmt == 'pdf':
+        sheet.save(out, format='PDF', resolution=SHEET_DPI)
+    else:
+        sheet.save(out, format='PNG', dpi=(SHEET_DPI, SHEET_DPI), optimize=False)
+    return out.getvalue()
+
+
+def _sheets(items):
+    sheet = []
+    for item in items:
+        sheet.append((item.ssid, item.name, item.warehouse.name, qr_payload(item)))
+        if len(sheet) == LABELS_PER_SHEET:
+            yield sheet
+            sheet = []
+    if sheet:
+        yield sheet
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _label_pool():
+    """The process-wide label rendering pool, started on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Export workers are threaded and hold database connections, so
+            # pool processes are spawned fresh rather than forked from them
+            _pool = ProcessPoolExecutor(max_workers=current_app.config['LABEL_WORKERS'],
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def write_label_archive(query, fileobj, fmt='png', count=None):
+    """Render the labels for `query` into a zip of sheets written to `fileobj`.
+
+    Sheets are rendered on the shared pool with at most two tasks per worker
+    in flight, and written to the archive in order as they complete, so
+    memory stays flat however large the catalog is. `count`, if given,
+    wraps the item iterator (export jobs count progress with it). Returns
+    (labels, sheets).
+    """
+    if fmt not in LABEL_FORMATS:
+        raise ValueError(f'Unsupported label format: {fmt}')
+    items = query.yield_per(current_app.config['EXPORT_CHUNK_SIZE'])
+    sheets = _sheets(count(items) if count else items)
+    labels = pages = 0
+
+    with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_STORED) as archive:
+        def write(data):
+            nonlocal pages
+            pages += 1
+            archive.writestr(f'labels_{pages:04d}.{fmt}', data)
+
+        head = list(islice(sheets, 2))
+        workers = current_app.config['LABEL_WORKERS']
+        if len(head) < 2 or workers <= 1:
+            # Not worth a round trip to the pool for a single sheet
+            for sheet in chain(head, sheets):
+                labels += len(sheet)
+                with phase('qr'):
+                    data = render_sheet(sheet, fmt)
+                write(data)
+            return labels, pages
+
+        pool = _label_pool()
+        pending = deque()
+        try:
+            for sheet in chain(head, sheets):
+                labels += len(sheet)
+                pending.append(pool.submit(render_sheet, sheet, fmt))
+                while len(pending) >= 2 * workers:
+                    write(pending.popleft().result())
+            while pending:
+                write(pending.popleft().result())
+        except BrokenProcessPool:
+            # A worker died; the next archive starts a fresh pool
+            _discard_pool(pool)
+            raise
+        finally:
+            for future in pending:
+                future.cancel()
+    return labels, pages
+
+
+def write_label_job(query, path, fmt, count):
+    """Export job writer for the "labels" kind"""
+    with open(path, 'wb') as fileobj:
+        write_label_archive(query, fileobj, fmt=fmt, count=count)
+
+
+@click.group('labels')
+def labels_cli():
+    """QR label sheet tools."""
+
+
+@labels_cli.command('build')
+@click.option('--warehouse', 'warehouse_id', type=int, help='Only items in this warehouse.')
+@click.option('--category', 'category_id', type=int, help='Only items in this category.')
+@click.option('--item', 'item_ids', type=int, multiple=True, help='Item id; repeat for several.')
+@click.option('--format', 'fmt', type=click.Choice(LABEL_FORMATS), default='png', show_default=True)
+@click.option('--workers', type=int, help='Worker processes (default: LABEL_WORKERS).')
+@click.option('--output', '-o', required=True, type=click.Path(dir_okay=False), help='Zip file to write.')
+def build_command(warehouse_id, category_id, item_ids, fmt, workers, output):
+    """Render QR label sheets into a zip archive."""
+    if workers:
+        current_app.config['LABEL_WORKERS'] = workers
+    query = label_items(warehouse_id, category_id, list(item_ids) or None)
+    started = time.perf_counter()
+    with open(output, 'wb') as fileobj:
+        labels, pages = write_label_archive(query, fileobj, fmt=fmt)
+    elapsed = time.perf_counter() - started
+    click.echo(f'{labels} labels on {pages} sheets -> {output} ({elapsed:.1f}s, '
+               f'{labels / elapsed if elapsed else 0:.0f} labels/s)')
+
+
+def init_app(app):
+    app.cli.add_command(labels_cli)
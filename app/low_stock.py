@@ -0,0 +1,84 @@
+from datetime import datetime
+from sqlalchemy import event, select, insert, delete
+from sqlalchemy.orm.attributes import get_history
+from app import db
+from app.models import Item, LowStockItem, StockLevelEvent
+
+# The low-stock watch set: low_stock_item holds exactly the items with
+# current_stock <= reorder_level, and stock_level_event records every
+# crossing of that threshold. Only items whose stock or reorder level
+# changed are re-examined, so reads and writes are O(items touched).
+_WATCHED_ATTRS = ('current_stock', 'reorder_level')
+
+
+def refresh(connection, item_ids):
+    """Re-check `item_ids` against their threshold inside the caller's transaction.
+
+    Code that changes stock with plain SQL (bypassing the ORM) must call this
+    with the ids it touched.
+    """
+    item_ids = list(item_ids)
+    if not item_ids:
+        return
+    items = Item.__table__
+    low = LowStockItem.__table__
+    rows = connection.execute(
+        select(items.c.id, items.c.current_stock, items.c.reorder_level, low.c.item_id)
+        .select_from(items.outerjoin(low, low.c.item_id == items.c.id))
+        .where(items.c.id.in_(item_ids))
+    )
+
+    now = datetime.utcnow()
+    became_low, restocked, events = [], [], []
+    for item_id, current_stock, reorder_level, watched in rows:
+        is_low = (current_stock or 0) <= (reorder_level or 0)
+        if is_low == (watched is not None):
+            continue
+        (became_low if is_low else restocked).append(item_id)
+        events.append({
+            'item_id': item_id,
+            'became_low': is_low,
+            'current_stock': current_stock or 0,
+            'reorder_level': reorder_level or 0,
+            'created_at': now,
+        })
+
+    if became_low:
+        connection.execute(insert(low), [{'item_id': i, 'since': now} for i in became_low])
+    if restocked:
+        connection.execute(delete(low).where(low.c.item_id.in_(restocked)))
+    if events:
+        connection.execute(insert(StockLevelEvent.__table__), events)
+
+
+def rebuild(connection):
+    """Repopulate the watch set from the item table, without recording events"""
+    items = Item.__table__
+    low = LowStockItem.__table__
+    connection.execute(delete(low))
+    connection.execute(insert(low).from_select(
+        ['item_id', 'since'],
+        select(items.c.id, items.c.updated_at).where(items.c.current_stock <= items.c.reorder_level)
+    ))
+
+
+def _after_flush(session, flush_context):
+    changed = set()
+    for obj in session.new:
+        if isinstance(obj, Item):
+            changed.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, Item) and any(get_history(obj, attr).has_changes() for attr in _WATCHED_ATTRS):
+            changed.add(obj.id)
+    removed = [obj.id for obj in session.deleted if isinstance(obj, Item)]
+
+    connection = session.connection()
+    refresh(connection, changed)
+    if removed:
+        connection.execute(delete(LowStockItem.__table__).where(LowStockItem.item_id.in_(removed)))
+        connection.execute(delete(StockLevelEvent.__table__).where(StockLevelEvent.item_id.in_(removed)))
+
+
+def init_app(app):
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
@@ -1,24 +1,26 @@
-from flask import render_template, request, jsonify
+import hmac
+from flask import render_template, request, jsonify, abort, current_app, Response
 from flask_login import login_required, current_user
 from app.main import bp
-from app.models import Item, Transaction, Warehouse, Category, TransactionType
 from app.main.forms import SearchForm
-from sqlalchemy import desc
+from app import queries, metrics
+from app.stats import summary_counts
 
 @bp.route('/')
 @bp.route('/dashboard')
 @login_required
 def dashboard():
     # Get low stock items
-    low_stock_items = Item.query.filter(Item.current_stock <= Item.reorder_level).all()
+    low_stock_items = queries.low_stock_items().all()
     
     # Get recent transactions
-    recent_transactions = Transaction.query.order_by(desc(Transaction.created_at)).limit(10).all()
+    recent_transactions = queries.recent_transactions(10).all()
     
     # Get summary statistics
-    total_items = Item.query.count()
-    total_warehouses = Warehouse.query.count()
-    total_transactions = Transaction.query.count()
+    counts = summary_counts()
+    total_items = counts['items']
+    total_warehouses = counts['warehouses']
+    total_transactions = counts['transactions']
     
     search_form = SearchForm()
     
@@ -37,7 +39,7 @@ def search():
     if not ssid:
         return jsonify({'error': 'SSID is required'}), 400
     
-    item = Item.query.filter_by(ssid=ssid).first()
+    item = queries.items_with_refs().filter_by(ssid=ssid).first()
     if not item:
         return jsonify({'error': 'Item not found'}), 404
     
@@ -51,4 +53,16 @@ def search():
         'unit': item.unit,
         'reorder_level': item.reorder_level,
         'is_low_stock': item.is_low_stock
-    })
\ No newline at end of file
+    })
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics for this process; admins, or scrapers sending METRICS_TOKEN as a bearer token"""
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404)
+    token = current_app.config['METRICS_TOKEN']
+    sent = request.headers.get('Authorization', '')
+    if not (token and hmac.compare_digest(sent, f'Bearer {token}')):
+        if not (current_user.is_authenticated and current_user.can_manage_users()):
+            abort(403)
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
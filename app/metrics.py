@@ -0,0 +1,291 @@
+import bisect
+import threading
+import time
+import weakref
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+
+# In-process metrics in the Prometheus text format, served to admins (or
+# scrapers sending METRICS_TOKEN) at /metrics. Each process keeps its own
+# numbers; scrape every instance.
+#
+# Recording takes no lock: every thread adds to its own shard of plain
+# dicts, and a scrape sums the shards. A shard is folded into the retired
+# totals when its thread exits, so per-request threads don't pile up.
+# Values a scrape catches mid-update are at most one observation behind.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_local = threading.local()
+_lock = threading.Lock()
+_shards = []
+_retired = {}
+_metrics = []
+_collectors = []
+_started = time.time()
+
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = {}
+        # Dropped with the thread's locals when the thread exits
+        _local.reaper = reaper = _Reaper()
+        weakref.finalize(reaper, _retire, shard)
+        with _lock:
+            _shards.append(shard)
+    return shard
+
+
+class _Reaper:
+    pass
+
+
+def _merge(into, shard):
+    for key, value in list(shard.items()):
+        if isinstance(value, list):
+            total = into.get(key)
+            if total is None:
+                into[key] = list(value)
+            else:
+                for index, n in enumerate(value):
+                    total[index] += n
+        else:
+            into[key] = into.get(key, 0) + value
+
+
+def _retire(shard):
+    with _lock:
+        _merge(_retired, shard)
+        _shards.remove(shard)
+
+
+def _snapshot():
+    with _lock:
+        totals = {key: list(value) if isinstance(value, list) else value for key, value in _retired.items()}
+        for shard in _shards:
+            _merge(totals, shard)
+    return totals
+
+
+class Counter:
+    """Monotonic count, optionally split by label values"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        _metrics.append(self)
+
+    def inc(self, *values, amount=1):
+        shard = _shard()
+        key = (self, values)
+        shard[key] = shard.get(key, 0) + amount
+
+    def samples(self, totals):
+        for (metric, values), value in sorted(totals.items(), key=_sort_key):
+            if metric is self:
+                yield self.name, dict(zip(self.labels, values)), value
+
+
+class Histogram(Counter):
+    """Distribution of observed values over fixed buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *values):
+        shard = _shard()
+        key = (self, values)
+        counts = shard.get(key)
+        if counts is None:
+            # One slot per bucket plus +Inf, then the sum
+            counts = shard[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self, totals):
+        for (metric, values), counts in sorted(totals.items(), key=_sort_key):
+            if metric is not self:
+                continue
+            labels = dict(zip(self.labels, values))
+            cumulative = 0
+            for bound, n in zip(self.buckets + ('+Inf',), counts):
+                cumulative += n
+                yield f'{self.name}_bucket', dict(labels, le=str(bound)), cumulative
+            yield f'{self.name}_sum', labels, counts[-1]
+            yield f'{self.name}_count', labels, cumulative
+
+
+def _sort_key(entry):
+    (metric, values), _ = entry
+    return metric.name, values
+
+
+def collector(name, kind, documentation):
+    """Register fn() -> [(labels dict, value)] as a metric read at scrape time"""
+    def register(fn):
+        _collectors.append((name, kind, documentation, fn))
+        return fn
+    return register
+
+
+def count_rows(rows, counter, *values):
+    """Yield `rows`, adding how many passed to `counter` once they are done"""
+    n = 0
+    try:
+        for row in rows:
+            yield row
+            n += 1
+    finally:
+        counter.inc(*values, amount=n)
+
+
+def count_bytes(chunks, counter, *values):
+    """Yield text or bytes `chunks`, adding their encoded size to `counter`"""
+    for chunk in chunks:
+        counter.inc(*values, amount=len(chunk.encode() if isinstance(chunk, str) else chunk))
+        yield chunk
+
+
+REQUESTS = Counter('http_requests_total', 'Requests handled, by endpoint, method and status',
+                   ('blueprint', 'endpoint', 'method', 'status'))
+REQUEST_SECONDS = Histogram('http_request_duration_seconds',
+                            'Request latency including streamed bodies', ('blueprint', 'endpoint'))
+POOL_CHECKOUTS = Counter('db_pool_checkouts_total', 'Connections checked out of the pool', ('engine',))
+POOL_CONNECTS = Counter('db_pool_connects_total', 'New database connections opened', ('engine',))
+POOL_TIMEOUTS = Counter('db_pool_timeouts_total', 'Checkouts that gave up waiting for a connection', ('engine',))
+POOL_WAIT_SECONDS = Histogram('db_pool_wait_seconds', 'Time spent getting a connection from the pool',
+                              ('engine',), buckets=POOL_WAIT_BUCKETS)
+EXPORT_ROWS = Counter('export_rows_total', 'Rows written to exports and export jobs', ('format',))
+EXPORT_BYTES = Counter('export_bytes_total', 'Bytes of export output before compression', ('format',))
+QR_RENDERS = Counter('qr_renders_total', 'QR codes encoded, as images or label-sheet matrices', ('kind',))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _line(name, labels, value):
+    if labels:
+        name += '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+    if isinstance(value, float) and not value.is_integer():
+        return f'{name} {value!r}'
+    return f'{name} {int(value)}'
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    totals = _snapshot()
+    lines = []
+    for metric in _metrics:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(_line(*sample) for sample in metric.samples(totals))
+    for name, kind, documentation, fn in _collectors:
+        lines.append(f'# HELP {name} {documentation}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(_line(name, labels, value) for labels, value in fn())
+    return '\n'.join(lines) + '\n'
+
+
+@collector('process_start_time_seconds', 'gauge', 'Start time of the process since the epoch')
+def _process_start():
+    return [({}, _started)]
+
+
+@collector('db_pool_connections', 'gauge', 'Pooled connections by state')
+def _pool_connections():
+    from app import db
+    samples = []
+    for key, engine in db.engines.items():
+        pool = engine.pool
+        name = key or 'default'
+        for state, method in (('size', 'size'), ('checked_out', 'checkedout'),
+                              ('idle', 'checkedin'), ('overflow', 'overflow')):
+            if hasattr(pool, method):
+                # QueuePool counts overflow from -size while it has room left
+                samples.append(({'engine': name, 'state': state}, max(getattr(pool, method)(), 0)))
+    return samples
+
+
+@collector('cache_requests_total', 'counter', 'In-process cache lookups by cache and result')
+def _cache_requests():
+    from app import refdata, user_cache
+    samples = []
+    for name, stats in sorted(refdata.cache_stats().items()):
+        samples.append(({'cache': f'refdata_{name}', 'result': 'hit'}, stats['hits']))
+        samples.append(({'cache': f'refdata_{name}', 'result': 'miss'}, stats['misses']))
+    caches = [('user', user_cache.get_cache()), ('qr', current_app.extensions.get('qr_cache'))]
+    for name, cache in caches:
+        if cache is not None:
+            samples.append(({'cache': name, 'result': 'hit'}, cache.hits))
+            samples.append(({'cache': name, 'result': 'miss'}, cache.misses))
+    return samples
+
+
+def _time_checkouts(engine, name):
+    # The pool has no event for the start of a checkout, so the wait is
+    # timed around the engine's pool access instead
+    raw_connection = engine.raw_connection
+
+    def timed_raw_connection():
+        started = time.perf_counter()
+        try:
+            return raw_connection()
+        except PoolTimeout:
+            POOL_TIMEOUTS.inc(name)
+            raise
+        finally:
+            POOL_WAIT_SECONDS.observe(time.perf_counter() - started, name)
+
+    engine.raw_connection = timed_raw_connection
+
+    @event.listens_for(engine, 'checkout')
+    def count_checkout(dbapi_connection, connection_record, connection_proxy):
+        POOL_CHECKOUTS.inc(name)
+
+    @event.listens_for(engine, 'connect')
+    def count_connect(dbapi_connection, connection_record):
+        POOL_CONNECTS.inc(name)
+
+
+def init_app(app, db):
+    """Record request and pool metrics for the app"""
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    with app.app_context():
+        for key, engine in db.engines.items():
+            _time_checkouts(engine, key or 'default')
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def note_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request(exc):
+        # Runs after streamed bodies finish, so their time is included
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        blueprint = request.blueprint or ''
+        # A response that was sent keeps its status even when the client
+        # went away mid-stream; 500 is for requests that never produced one
+        status = g.pop('metrics_status', 500)
+        REQUESTS.inc(blueprint, endpoint, request.method, str(status))
+        REQUEST_SECONDS.observe(elapsed, blueprint, endpoint)
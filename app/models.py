@@ -4,6 +4,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import db
+from app.profiling import phase
 
 class Role(Enum):
     ADMIN = 'admin'
@@ -28,10 +29,12 @@ class User(UserMixin, db.Model):
     transactions = db.relationship('Transaction', backref='user', lazy=True)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        with phase('hash'):
+            self.password_hash = generate_password_hash(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        with phase('hash'):
+            return check_password_hash(self.password_hash, password)
     
     def has_role(self, role):
         return self.role == role
@@ -100,6 +103,16 @@ class Item(db.Model):
         cascade='all, delete-orphan'
     )
     
+    __table_args__ = (
+        db.Index('ix_item_warehouse_id', 'warehouse_id', 'id'),
+        db.Index('ix_item_category_id', 'category_id'),
+        # Case-insensitive prefix search for the item picker
+        db.Index('ix_item_ssid_lower', db.text('lower(ssid)')),
+        db.Index('ix_item_name_lower', db.text('lower(name)')),
+        # Delta polling of the items API (updated_since)
+        db.Index('ix_item_updated_at', 'updated_at'),
+    )
+    
     @property
     def is_low_stock(self):
         return self.current_stock <= self.reorder_level
@@ -131,6 +144,14 @@ class Transaction(db.Model):
     warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouse.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
+    # Ledger listings sort by created_at; exports filter on one foreign key and sort by created_at
+    __table_args__ = (
+        db.Index('ix_transaction_created_at', 'created_at'),
+        db.Index('ix_transaction_warehouse_created', 'warehouse_id', 'created_at'),
+        db.Index('ix_transaction_item_created', 'item_id', 'created_at'),
+        db.Index('ix_transaction_user_created', 'user_id', 'created_at'),
+    )
+    
     def __repr__(self):
         return f'<Transaction {self.transaction_type.value}: {self.quantity} of {self.item.ssid}>'
 
@@ -158,5 +179,165 @@ class Payment(db.Model):
     processed_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Exports stream newest first, optionally within a date range and by status
+    __table_args__ = (
+        db.Index('ix_payment_created_at', 'created_at'),
+        db.Index('ix_payment_status_created', 'status', 'created_at'),
+    )
+
     def __repr__(self):
         return f'<Payment {self.id} {self.amount} {self.currency}>'
+
+class LowStockItem(db.Model):
+    """Items currently at or below their reorder level (see app/low_stock.py)"""
+    __tablename__ = 'low_stock_item'
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), primary_key=True)
+    since = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<LowStockItem {self.item_id}>'
+
+class StockLevelEvent(db.Model):
+    """An item crossing its reorder level, in either direction"""
+    __tablename__ = 'stock_level_event'
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), nullable=False, index=True)
+    became_low = db.Column(db.Boolean, nullable=False)
+    current_stock = db.Column(db.Integer, nullable=False)
+    reorder_level = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    item = db.relationship('Item')
+
+    def __repr__(self):
+        return f"<StockLevelEvent {self.item_id} {'low' if self.became_low else 'restocked'}>"
+
+class SummaryCounter(db.Model):
+    """Row counts kept current by session events (see app/stats.py)"""
+    __tablename__ = 'summary_counter'
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    recounted_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<SummaryCounter {self.name}={self.value}>'
+
+class DeletedItem(db.Model):
+    """Tombstone for a deleted item, so delta API clients learn about deletions (see app/tombstones.py)"""
+    __tablename__ = 'deleted_item'
+    item_id = db.Column(db.Integer, primary_key=True)
+    warehouse_id = db.Column(db.Integer)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<DeletedItem {self.item_id}>'
+
+class CacheVersion(db.Model):
+    """Version stamp per reference-data set or item listing, bumped by every commit that changes it
+    (see app/refdata.py and app/tombstones.py)"""
+    __tablename__ = 'cache_version'
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<CacheVersion {self.name}={self.version}>'
+
+class MovementRollup(db.Model):
+    """Ledger totals per day, item, warehouse and movement type (see app/rollups.py)"""
+    __tablename__ = 'movement_rollup'
+    day = db.Column(db.Date, primary_key=True)
+    item_id = db.Column(db.Integer, primary_key=True)
+    warehouse_id = db.Column(db.Integer, primary_key=True)
+    transaction_type = db.Column(db.Enum(TransactionType), primary_key=True)
+    # Monday of the day's ISO week and first of its month, for weekly and monthly roll-ups
+    week = db.Column(db.Date, nullable=False)
+    month = db.Column(db.Date, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False, default=0)  # sum of Transaction.quantity
+    movements = db.Column(db.Integer, nullable=False, default=0)  # number of ledger rows
+
+    # Period reports scan a day range (the primary key); per-item history goes by item first.
+    # Demand forecasts read every item's OUT quantities from the covering type index.
+    __table_args__ = (
+        db.Index('ix_movement_rollup_item_day', 'item_id', 'day'),
+        db.Index('ix_movement_rollup_warehouse_day', 'warehouse_id', 'day'),
+        db.Index('ix_movement_rollup_type_item_day', 'transaction_type', 'item_id', 'day', 'quantity'),
+    )
+
+    def __repr__(self):
+        return f'<MovementRollup {self.day} {self.item_id}/{self.warehouse_id} {self.transaction_type.value}>'
+
+class StockSnapshot(db.Model):
+    """Checkpoint of every item's stock, for point-in-time queries (see app/snapshots.py)"""
+    __tablename__ = 'stock_snapshot'
+    id = db.Column(db.Integer, primary_key=True)
+    taken_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    # The snapshot includes exactly the ledger rows with id <= this
+    last_transaction_id = db.Column(db.Integer, nullable=False, default=0)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<StockSnapshot {self.id} {self.taken_at}>'
+
+class StockSnapshotItem(db.Model):
+    """One item's stock in a snapshot; no foreign key to item, so deleting an item keeps history intact"""
+    __tablename__ = 'stock_snapshot_item'
+    snapshot_id = db.Column(db.Integer, db.ForeignKey('stock_snapshot.id'), primary_key=True)
+    item_id = db.Column(db.Integer, primary_key=True)
+    stock = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<StockSnapshotItem {self.snapshot_id}/{self.item_id}={self.stock}>'
+
+class ExportJob(db.Model):
+    """An export built by a background worker and kept for download (see app/export_jobs.py)"""
+    __tablename__ = 'export_job'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)  # key of export_jobs.EXPORT_KINDS
+    format = db.Column(db.String(10), nullable=False)
+    params = db.Column(db.Text, nullable=False, default='{}')  # JSON filter arguments
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed, cancelled
+    rows_total = db.Column(db.Integer, nullable=True)
+    rows_done = db.Column(db.Integer, nullable=False, default=0)
+    filename = db.Column(db.String(200), nullable=True)
+    size_bytes = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=True)
+
+    created_by = db.relationship('User')
+
+    # Workers claim the oldest queued job; users list their own, newest first
+    __table_args__ = (
+        db.Index('ix_export_job_status_created', 'status', 'created_at'),
+        db.Index('ix_export_job_user_created', 'created_by_id', 'created_at'),
+    )
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    @property
+    def percent(self):
+        if self.status == 'done':
+            return 100
+        if not self.rows_total:
+            return 0
+        return min(99, self.rows_done * 100 // self.rows_total)
+
+    def __repr__(self):
+        return f'<ExportJob {self.id} {self.kind} {self.status}>'
+
+class SchemaVersion(db.Model):
+    """Single row recording the last bootstrap migration applied to this database"""
+    __tablename__ = 'schema_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SchemaVersion {self.version}>'
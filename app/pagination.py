@@ -0,0 +1,80 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import tuple_
+
+
+class KeysetPage:
+    """One page of a keyset-paginated query with opaque next/prev cursors"""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None, total_exact=False):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+        self.total_exact = total_exact
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def encode_cursor(values, direction):
+    payload = [direction] + [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, columns):
+    """Return (values, direction) for a cursor; raises ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, *values = json.loads(raw)
+    except (ValueError, TypeError) as exc:
+        raise ValueError('Invalid cursor') from exc
+    if direction not in ('next', 'prev') or len(values) != len(columns):
+        raise ValueError('Invalid cursor')
+    decoded = []
+    for column, value in zip(columns, values):
+        if value is not None and column.type.python_type is datetime:
+            value = datetime.fromisoformat(value)
+        decoded.append(value)
+    return decoded, direction
+
+
+def keyset_paginate(query, columns, cursor=None, per_page=20, descending=False):
+    """Paginate `query` by the unique, ordered key `columns` without OFFSET.
+
+    Each page is a range seek on the key followed by LIMIT, so its cost does
+    not depend on how deep into the result set it is. The last column must
+    make the key unique (normally the primary key).
+    """
+    values, direction = decode_cursor(cursor, columns) if cursor else (None, 'next')
+    backward = direction == 'prev'
+    reverse = descending != backward
+
+    if values is not None:
+        key, bound = tuple_(*columns), tuple_(*values)
+        query = query.filter(key < bound if reverse else key > bound)
+    query = query.order_by(*[c.desc() if reverse else c.asc() for c in columns])
+
+    rows = query.limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backward:
+        rows.reverse()
+
+    has_next = True if backward else more
+    has_prev = more if backward else values is not None
+
+    def key_of(row):
+        return [getattr(row, c.key) for c in columns]
+
+    next_cursor = encode_cursor(key_of(rows[-1]), 'next') if rows and has_next else None
+    prev_cursor = encode_cursor(key_of(rows[0]), 'prev') if rows and has_prev else None
+    return KeysetPage(rows, per_page, next_cursor=next_cursor, prev_cursor=prev_cursor)
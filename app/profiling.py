@@ -0,0 +1,243 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+import click
+from flask import current_app, request
+from flask.cli import with_appcontext
+from flask.json.provider import DefaultJSONProvider
+from flask.signals import before_render_template, template_rendered
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from app.instrumentation import QueryStats, _recorders
+
+# Opt-in request profiling. A request is profiled when it carries a valid
+# X-Profile token (`flask profile token`) or is picked at random with
+# probability PROFILE_SAMPLE_RATE. Profiled requests get a Server-Timing
+# header splitting their time into phases:
+#
+#     db         SQL statements
+#     render     Jinja templates
+#     serialize  JSON responses
+#     xlsx       openpyxl workbooks
+#     qr         QR codes and label sheets
+#     hash       password hashing
+#     app        everything else
+#
+# Phases are exclusive: statements run inside a phase count as db only.
+# While a profiled request runs, a sampler thread records its call stack
+# every PROFILE_SAMPLE_INTERVAL_MS. Requests slower than PROFILE_SLOW_MS (and every
+# token request) have the stacks saved to PROFILE_FOLDER in folded format,
+# one "frame;frame;frame count" line per stack, ready for flamegraph tools.
+# Streamed bodies are produced after the headers are sent, so their work
+# shows in the saved stacks but not in Server-Timing.
+#
+# Unprofiled requests pay one header lookup; phase() costs an attribute
+# lookup when no profile is active.
+HEADER = 'X-Profile'
+PHASES = ('db', 'render', 'serialize', 'xlsx', 'qr', 'hash')
+
+_local = threading.local()
+_NOT_PROFILED = nullcontext()
+
+
+class Profile:
+    """Phase timings and stack samples of one request"""
+
+    def __init__(self, forced, samples):
+        self.started = time.perf_counter()
+        self.forced = forced
+        self.samples = samples
+        self.phases = Counter()
+        self.queries = QueryStats()
+        self.render_started = []
+
+    def server_timing(self):
+        total = (time.perf_counter() - self.started) * 1000
+        phases = dict(self.phases, db=self.queries.duration)
+        entries = []
+        for name in PHASES:
+            duration = phases.get(name, 0) * 1000
+            if duration:
+                desc = f';desc="{self.queries.count} queries"' if name == 'db' else ''
+                entries.append(f'{name};dur={duration:.1f}{desc}')
+        rest = max(total - sum(phases.values()) * 1000, 0)
+        entries.append(f'app;dur={rest:.1f}')
+        entries.append(f'total;dur={total:.1f}')
+        return ', '.join(entries)
+
+
+def _exclusive(profile, started, db_started):
+    # SQL run inside a phase (queries driven by an export, lazy loads in a
+    # template) is already counted as db, so phases add up to the total
+    return time.perf_counter() - started - (profile.queries.duration - db_started)
+
+
+@contextmanager
+def _timed(profile, name):
+    started, db_started = time.perf_counter(), profile.queries.duration
+    try:
+        yield
+    finally:
+        profile.phases[name] += _exclusive(profile, started, db_started)
+
+
+def phase(name):
+    """Charge the time spent in a with-block to `name` in the current request's profile"""
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        return _NOT_PROFILED
+    return _timed(profile, name)
+
+
+class _ProfiledJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        with phase('serialize'):
+            return super().dumps(obj, **kwargs)
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    path = code.co_filename.replace(os.sep, '/').rsplit('/', 2)
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Counts the call stacks of registered threads from one background thread"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, ident):
+        samples = Counter()
+        with self._lock:
+            self._threads[ident] = samples
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return samples
+
+    def remove(self, ident):
+        with self._lock:
+            self._threads.pop(ident, None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                watched = list(self._threads.items())
+            if not watched:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            frames = sys._current_frames()
+            for ident, samples in watched:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                if stack:
+                    samples[';'.join(reversed(stack))] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+def _serializer(app):
+    return URLSafeTimedSerializer(app.secret_key, salt='request-profile')
+
+
+def _save(profile, duration):
+    folder = current_app.config['PROFILE_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    endpoint = (request.endpoint or 'unknown').replace('/', '_')
+    path = os.path.join(folder, f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{endpoint}-{duration * 1000:.0f}ms.folded")
+    with open(path, 'w') as f:
+        for stack, count in profile.samples.most_common():
+            f.write(f'{stack} {count}\n')
+    current_app.logger.info('Profile of %s %s (%.0fms, %d samples) saved to %s', request.method,
+                            request.full_path, duration * 1000, sum(profile.samples.values()), path)
+
+
+def _render_started(app, template, context, **extra):
+    profile = getattr(_local, 'profile', None)
+    if profile is not None:
+        profile.render_started.append((time.perf_counter(), profile.queries.duration))
+
+
+def _render_finished(app, template, context, **extra):
+    profile = getattr(_local, 'profile', None)
+    if profile is not None and profile.render_started:
+        profile.phases['render'] += _exclusive(profile, *profile.render_started.pop())
+
+
+def init_app(app):
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    max_age = app.config['PROFILE_TOKEN_MAX_AGE']
+    sampler = StackSampler(app.config['PROFILE_SAMPLE_INTERVAL_MS'] / 1000)
+    serializer = _serializer(app)
+
+    app.json = _ProfiledJSONProvider(app)
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_finished, app)
+
+    @app.before_request
+    def start_profile():
+        token = request.headers.get(HEADER)
+        forced = False
+        if token:
+            try:
+                forced = serializer.loads(token, max_age=max_age) == 'profile'
+            except BadSignature:
+                pass
+        if not forced and not (rate and random.random() < rate):
+            return
+        profile = Profile(forced, sampler.add(threading.get_ident()))
+        _local.profile = profile
+        _recorders().append(profile.queries)
+
+    @app.after_request
+    def add_server_timing(response):
+        profile = getattr(_local, 'profile', None)
+        if profile is not None:
+            response.headers['Server-Timing'] = profile.server_timing()
+        return response
+
+    @app.teardown_request
+    def finish_profile(exc):
+        # Runs after streamed bodies finish, so saved stacks cover them too
+        profile = getattr(_local, 'profile', None)
+        if profile is None:
+            return
+        _local.profile = None
+        sampler.remove(threading.get_ident())
+        _recorders().remove(profile.queries)
+        duration = time.perf_counter() - profile.started
+        if profile.forced or duration * 1000 >= app.config['PROFILE_SLOW_MS']:
+            try:
+                _save(profile, duration)
+            except OSError:
+                app.logger.exception('Could not save request profile')
+
+    app.cli.add_command(profile_cli)
+
+
+@click.group('profile')
+def profile_cli():
+    """Request profiling tools."""
+
+
+@profile_cli.command('token')
+@with_appcontext
+def token_command():
+    """Print a token that profiles any request sending it as the X-Profile header."""
+    click.echo(_serializer(current_app).dumps('profile'))
+    click.echo(f"Valid for {current_app.config['PROFILE_TOKEN_MAX_AGE']}s, e.g. "
+               f"curl -H '{HEADER}: <token>' ...", err=True)
@@ -0,0 +1,99 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+# QR images are named after a hash of their encoded payload, so an unchanged
+# item always maps to the same file and a changed one to a new file. The
+# cache keeps the folder under a byte budget by evicting the least recently
+# used files; recency is tracked in memory so hits never write to disk.
+QR_FILENAME_RE = re.compile(r'^qr_([0-9a-f]{32})\.png$')
+
+
+def qr_filename(digest):
+    return f'qr_{digest[:32]}.png'
+
+
+def qr_etag(filename):
+    """Strong ETag for a content-addressed QR file, or None for legacy names"""
+    match = QR_FILENAME_RE.match(filename)
+    return match.group(1) if match else None
+
+
+class QRCache:
+    """Size-bounded, LRU-evicted directory of rendered QR images"""
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        # Seed recency from modification times; legacy timestamped files
+        # written before the cache existed are evicted first
+        files = []
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith('.png'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._size += size
+        self._loaded = True
+
+    def _forget(self, filename):
+        self._size -= self._entries.pop(filename, 0)
+
+    def lookup(self, filename):
+        """True if `filename` is on disk; marks it as recently used"""
+        path = os.path.join(self.folder, filename)
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            if filename in self._entries:
+                if os.path.exists(path):
+                    self._entries.move_to_end(filename)
+                    self.hits += 1
+                    return True
+                self._forget(filename)  # evicted by another process
+            elif os.path.exists(path):
+                # Rendered by another worker process
+                self._entries[filename] = os.path.getsize(path)
+                self._size += self._entries[filename]
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def store(self, filename, image):
+        """Save a PIL image under `filename` and evict down to the budget"""
+        path = os.path.join(self.folder, filename)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        image.save(tmp_path, format='PNG')
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            self._forget(filename)
+            self._entries[filename] = size
+            self._size += size
+            self._evict(keep=filename)
+
+    def _evict(self, keep):
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            filename = next(iter(self._entries))
+            if filename == keep:
+                self._entries.move_to_end(filename)
+                continue
+            self._forget(filename)
+            try:
+                os.remove(os.path.join(self.folder, filename))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,340 @@
+import sys
+from datetime import datetime
+from sqlalchemy import desc, select, tuple_, func, and_, or_, case
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import (Item, Transaction, TransactionType, Warehouse, Category, User, Payment, Seller, LowStockItem,
+                        StockLevelEvent, ExportJob, MovementRollup)
+
+# Shared query layer for listings, the dashboard and exports.
+# Pages that render ORM objects eager-load every relationship the template
+# touches; exports and APIs select plain column tuples instead of entities.
+
+
+def items_with_refs():
+    """Items with warehouse and category loaded in the same statement"""
+    return Item.query.options(
+        joinedload(Item.warehouse),
+        joinedload(Item.category)
+    )
+
+
+def transactions_with_refs():
+    """Transactions with item, warehouse and user loaded in the same statement"""
+    return Transaction.query.options(
+        joinedload(Transaction.item),
+        joinedload(Transaction.warehouse),
+        joinedload(Transaction.user)
+    )
+
+
+def payments_with_seller():
+    return Payment.query.options(joinedload(Payment.seller))
+
+
+def _in_low_stock_set():
+    # Driven by the watch set's primary key, never by a scan of the catalog
+    return Item.id.in_(select(LowStockItem.item_id))
+
+
+def low_stock_items():
+    """Items in the low-stock watch set"""
+    return items_with_refs().filter(_in_low_stock_set())
+
+
+def recent_transactions(limit=10):
+    return transactions_with_refs().order_by(desc(Transaction.created_at)).limit(limit)
+
+
+def transaction_export_rows():
+    """Column tuples for the transaction export; filter on Transaction columns"""
+    return db.session.query(
+        Transaction.created_at,
+        Transaction.transaction_type,
+        Item.ssid,
+        Item.name,
+        Warehouse.name,
+        Transaction.quantity,
+        User.username,
+        Transaction.notes
+    ).select_from(Transaction).join(
+        Item, Transaction.item_id == Item.id
+    ).join(
+        Warehouse, Transaction.warehouse_id == Warehouse.id
+    ).join(
+        User, Transaction.user_id == User.id
+    )
+
+
+def inventory_rows():
+    """Column tuples for the inventory exports; filter on Item columns"""
+    return db.session.query(
+        Item.ssid,
+        Item.name,
+        Warehouse.name,
+        Category.name,
+        Item.current_stock,
+        Item.unit,
+        Item.reorder_level,
+        Item.unit_price,
+        Item.description
+    ).select_from(Item).join(
+        Warehouse, Item.warehouse_id == Warehouse.id
+    ).join(
+        Category, Item.category_id == Category.id
+    )
+
+
+def inventory_rows_as_of(stock):
+    """inventory_rows() with the stock column taken from an (item_id, stock) subquery"""
+    return db.session.query(
+        Item.ssid,
+        Item.name,
+        Warehouse.name,
+        Category.name,
+        stock.c.stock,
+        Item.unit,
+        Item.reorder_level,
+        Item.unit_price,
+        Item.description
+    ).select_from(stock).join(
+        Item, Item.id == stock.c.item_id
+    ).join(
+        Warehouse, Item.warehouse_id == Warehouse.id
+    ).join(
+        Category, Item.category_id == Category.id
+    )
+
+
+def stock_totals_by_warehouse(stock):
+    """(warehouse, items, units, value) per warehouse for an (item_id, stock) subquery"""
+    return db.session.query(
+        Warehouse.name,
+        func.count(Item.id),
+        func.coalesce(func.sum(stock.c.stock), 0),
+        func.coalesce(func.sum(stock.c.stock * Item.unit_price), 0)
+    ).select_from(stock).join(
+        Item, Item.id == stock.c.item_id
+    ).join(
+        Warehouse, Item.warehouse_id == Warehouse.id
+    ).group_by(Warehouse.id, Warehouse.name).order_by(Warehouse.name)
+
+
+def _rollup_sum(transaction_type):
+    return func.sum(case((MovementRollup.transaction_type == transaction_type, MovementRollup.quantity), else_=0))
+
+
+def movement_totals(period='day', by='item'):
+    """(period start, [ssid, item name,] warehouse, in, out, adjustment, movements) from the daily rollups.
+
+    `period` is day, week or month; `by` is item or warehouse. Filter on
+    MovementRollup.day (the range scan) and its other columns.
+    """
+    start = getattr(MovementRollup, period)
+    if by == 'item':
+        groups = (Item.ssid, Item.name, Warehouse.name)
+        keys = (MovementRollup.item_id, MovementRollup.warehouse_id)
+    else:
+        groups = (Warehouse.name,)
+        keys = (MovementRollup.warehouse_id,)
+    query = db.session.query(
+        start,
+        *groups,
+        _rollup_sum(TransactionType.IN),
+        _rollup_sum(TransactionType.OUT),
+        _rollup_sum(TransactionType.ADJUSTMENT),
+        func.sum(MovementRollup.movements)
+    ).select_from(MovementRollup).join(
+        Warehouse, MovementRollup.warehouse_id == Warehouse.id
+    )
+    if by == 'item':
+        query = query.join(Item, MovementRollup.item_id == Item.id)
+    return query.group_by(start, *keys).order_by(start.desc(), *groups)
+
+
+def reorder_rows(demand, suggestion):
+    """(id, ssid, name, warehouse, current stock, reorder level, daily demand, deviation, suggested level,
+    days of cover) for items in an (item_id, demand, demand_sq) subquery, fewest days of cover first"""
+    return db.session.query(
+        Item.id,
+        Item.ssid,
+        Item.name,
+        Warehouse.name,
+        Item.current_stock,
+        Item.reorder_level,
+        *suggestion
+    ).select_from(demand).join(
+        Item, Item.id == demand.c.item_id
+    ).join(
+        Warehouse, Item.warehouse_id == Warehouse.id
+    ).filter(demand.c.demand > 0).order_by(
+        func.coalesce(Item.current_stock, 0) * 1.0 / demand.c.demand, Item.id
+    )
+
+
+def low_stock_rows():
+    """Inventory export tuples for items in the low-stock watch set"""
+    return inventory_rows().filter(_in_low_stock_set())
+
+
+def stock_level_events():
+    return StockLevelEvent.query.options(joinedload(StockLevelEvent.item))
+
+
+# Columns the items API can return, by field name
+ITEM_API_FIELDS = {
+    'id': Item.id,
+    'ssid': Item.ssid,
+    'name': Item.name,
+    'description': Item.description,
+    'unit': Item.unit,
+    'current_stock': Item.current_stock,
+    'reorder_level': Item.reorder_level,
+    'unit_price': Item.unit_price,
+    'warehouse_id': Item.warehouse_id,
+    'category_id': Item.category_id,
+    'created_at': Item.created_at,
+    'updated_at': Item.updated_at,
+}
+DEFAULT_ITEM_API_FIELDS = ('id', 'ssid', 'name', 'current_stock', 'warehouse_id')
+
+
+def api_item_rows(fields=DEFAULT_ITEM_API_FIELDS):
+    return db.session.query(*[ITEM_API_FIELDS[name].label(name) for name in fields])
+
+
+def api_transaction_rows():
+    return db.session.query(
+        Transaction.id,
+        Transaction.created_at,
+        Transaction.transaction_type,
+        Transaction.quantity,
+        Transaction.item_id,
+        Item.ssid,
+        Transaction.warehouse_id,
+        Transaction.user_id,
+        Transaction.notes
+    ).select_from(Transaction).join(Item, Transaction.item_id == Item.id)
+
+
+def payment_export_rows():
+    """Column tuples for the payment export with the seller name outer-joined"""
+    return db.session.query(
+        Payment.id,
+        Payment.amount,
+        Payment.currency,
+        Payment.method,
+        Payment.status,
+        Payment.notes,
+        Seller.name,
+        Payment.processed_by_id,
+        Payment.created_at
+    ).select_from(Payment).outerjoin(
+        Seller, Payment.seller_id == Seller.id
+    )
+
+
+PAYMENT_EXPORT_FIELDS = ['id', 'amount', 'currency', 'method', 'status', 'notes', 'seller',
+                         'processed_by_id', 'created_at']
+
+
+def seller_export_rows():
+    """Column tuples for the seller export"""
+    return db.session.query(Seller.id, Seller.name, Seller.email, Seller.phone, Seller.created_at)
+
+
+SELLER_EXPORT_FIELDS = ['id', 'name', 'email', 'phone', 'created_at']
+
+
+def queued_export_jobs():
+    """Queued export jobs, oldest first (the order workers claim them in)"""
+    return ExportJob.query.filter(ExportJob.status == 'queued').order_by(ExportJob.created_at, ExportJob.id)
+
+
+def export_jobs_of(user_id):
+    """A user's export jobs, newest first"""
+    return ExportJob.query.filter(ExportJob.created_by_id == user_id).order_by(ExportJob.created_at.desc())
+
+
+def _item_search_rows():
+    return db.session.query(Item.id, Item.ssid, Item.name, Item.current_stock, Item.unit)
+
+
+def _prefix_of(column, prefix):
+    # A range on lower(column) rather than LIKE, so the expression index is used
+    expr = func.lower(column)
+    # The successor of the last character that has one bounds the range;
+    # a prefix of nothing but U+10FFFF has no upper bound
+    stem = prefix.rstrip(chr(sys.maxunicode))
+    if not stem:
+        return expr >= prefix
+    return and_(expr >= prefix, expr < stem[:-1] + chr(ord(stem[-1]) + 1))
+
+
+def search_items(term, limit=20):
+    """Items whose SSID or name starts with (then contains) `term`, case-insensitively.
+
+    SSID and name prefix matches are index range seeks. Substring matches
+    need a scan, so they are only tried for terms of three or more
+    characters and only when the prefix matches did not fill `limit`.
+    """
+    term = term.strip().lower()
+    if not term:
+        return []
+    found = {}
+    for column in (Item.ssid, Item.name):
+        for row in (_item_search_rows().filter(_prefix_of(column, term))
+                    .order_by(func.lower(column)).limit(limit)):
+            found.setdefault(row.id, row)
+    if len(found) < limit and len(term) >= 3:
+        contains = or_(func.instr(func.lower(Item.ssid), term) > 0,
+                       func.instr(func.lower(Item.name), term) > 0)
+        for row in _item_search_rows().filter(contains).order_by(Item.ssid).limit(limit):
+            found.setdefault(row.id, row)
+    return list(found.values())[:limit]
+
+
+def _fulltext_query():
+    from app import fulltext
+    return fulltext.ranked('"ab"*', 2000).limit(20)
+
+
+def hot_queries():
+    """Named hot-path queries whose plans `flask db check-plans` verifies"""
+    from app.snapshots import Source, _replay
+    from app.forecast import Settings, demand_by_item, suggestion_columns
+    since = datetime(2000, 1, 1)
+    export = transaction_export_rows()
+    demand = demand_by_item(90, since.date())
+    return {
+        'transactions.list': transactions_with_refs().order_by(Transaction.created_at.desc()).limit(20),
+        'dashboard.recent_transactions': recent_transactions(10),
+        'dashboard.low_stock': low_stock_items(),
+        'export.transactions': export.order_by(Transaction.created_at.desc()),
+        'export.transactions.since': export.filter(Transaction.created_at >= since).order_by(Transaction.created_at.desc()),
+        'export.transactions.warehouse': export.filter(Transaction.warehouse_id == 1).order_by(Transaction.created_at.desc()),
+        'export.transactions.item': export.filter(Transaction.item_id == 1).order_by(Transaction.created_at.desc()),
+        'export.transactions.user': export.filter(Transaction.user_id == 1).order_by(Transaction.created_at.desc()),
+        'export.inventory.warehouse': inventory_rows().filter(Item.warehouse_id == 1),
+        'export.low_stock': low_stock_rows(),
+        'api.low_stock_events': stock_level_events().filter(StockLevelEvent.id > 0).order_by(StockLevelEvent.id).limit(100),
+        'api.items.warehouse': api_item_rows().filter(Item.warehouse_id == 1),
+        'search.ssid': Item.query.filter_by(ssid=''),
+        'search.items.ssid_prefix': _item_search_rows().filter(_prefix_of(Item.ssid, 'ab')).order_by(func.lower(Item.ssid)).limit(20),
+        'search.items.name_prefix': _item_search_rows().filter(_prefix_of(Item.name, 'ab')).order_by(func.lower(Item.name)).limit(20),
+        'api.transactions.page': api_transaction_rows().filter(
+            tuple_(Transaction.created_at, Transaction.id) < tuple_(since, 0)
+        ).order_by(Transaction.created_at.desc(), Transaction.id.desc()).limit(20),
+        'search.fulltext': _fulltext_query(),
+        'export.payments': payment_export_rows().order_by(Payment.created_at.desc()),
+        'export.payments.status': payment_export_rows().filter(Payment.status.in_(['completed'])).filter(
+            Payment.created_at >= since).order_by(Payment.created_at.desc()),
+        'stock.as_of': db.session.query(_replay(Source(1, since, 0), since).subquery()),
+        'export_jobs.next': queued_export_jobs().limit(1),
+        'export_jobs.mine': export_jobs_of(1).limit(50),
+        'rollups.items': movement_totals('week').filter(MovementRollup.day >= since.date()),
+        'rollups.warehouse': movement_totals('month', 'warehouse').filter(MovementRollup.warehouse_id == 1),
+        'rollups.item_history': movement_totals('day').filter(MovementRollup.item_id == 1),
+        'forecast.demand': reorder_rows(demand, suggestion_columns(demand, Settings(90, 7, 1.65))),
+        'items.page': items_with_refs().filter(Item.id > 0).order_by(Item.id).limit(20),
+    }
@@ -0,0 +1,188 @@
+import time
+from collections import Counter, namedtuple
+from flask import current_app, g, has_app_context, has_request_context
+from sqlalchemy import event, select, update, insert
+from app import db
+from app.models import Warehouse, Category, User, CacheVersion
+
+# Process-local cache of rarely changing reference data. Entries are plain
+# tuples (never ORM objects), so they can be shared between requests.
+#
+# Every flush that touches a Warehouse, Category or User bumps that set's
+# row in cache_version inside the same transaction, and the committing
+# process drops its own copy right away. Other processes compare their
+# entry's version with cache_version, read once per request, so they see
+# the change on their next request. REFDATA_TTL bounds staleness for
+# changes made outside the ORM.
+WarehouseRef = namedtuple('WarehouseRef', 'id name location description created_at')
+UserRef = namedtuple('UserRef', 'id username role is_active')
+
+
+def _load_warehouses():
+    rows = db.session.execute(
+        select(Warehouse.id, Warehouse.name, Warehouse.location, Warehouse.description, Warehouse.created_at)
+        .order_by(Warehouse.id)
+    )
+    return tuple(WarehouseRef(*row) for row in rows)
+
+
+def _load_categories():
+    return {name: category_id for category_id, name in db.session.execute(select(Category.id, Category.name))}
+
+
+def _load_users():
+    rows = db.session.execute(
+        select(User.id, User.username, User.role, User.is_active).order_by(User.id)
+    )
+    return tuple(UserRef(*row) for row in rows)
+
+
+DATASETS = {
+    'warehouses': (Warehouse, _load_warehouses),
+    'categories': (Category, _load_categories),
+    'users': (User, _load_users),
+}
+_DATASET_OF = {model: name for name, (model, _) in DATASETS.items()}
+
+
+class RefDataCache:
+    """Loaded reference-data sets, each tagged with its version and load time"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.hits = Counter()
+        self.misses = Counter()
+        self._entries = {}
+
+    def get(self, name, version):
+        entry = self._entries.get(name)
+        now = time.monotonic()
+        if entry is not None and entry[0] == version and now - entry[1] < self.ttl:
+            self.hits[name] += 1
+            return entry[2]
+        self.misses[name] += 1
+        # Tagged with the version read before loading, so a change committed
+        # in between only causes one extra reload
+        value = DATASETS[name][1]()
+        self._entries[name] = (version, now, value)
+        return value
+
+    def invalidate(self, names):
+        for name in names:
+            self._entries.pop(name, None)
+
+    def stats(self):
+        return {name: {'hits': self.hits[name], 'misses': self.misses[name], 'cached': name in self._entries}
+                for name in DATASETS}
+
+
+def get_cache():
+    cache = current_app.extensions.get('refdata')
+    if cache is None:
+        cache = current_app.extensions['refdata'] = RefDataCache(current_app.config['REFDATA_TTL'])
+    return cache
+
+
+def _versions():
+    if has_request_context() and '_refdata_versions' in g:
+        return g._refdata_versions
+    versions = dict(db.session.execute(select(CacheVersion.name, CacheVersion.version)).all())
+    if has_request_context():
+        g._refdata_versions = versions
+    return versions
+
+
+def version(name):
+    """Current version stamp of a reference-data set"""
+    return _versions().get(name, 0)
+
+
+def _get(name):
+    return get_cache().get(name, version(name))
+
+
+def warehouses():
+    """All warehouses as WarehouseRef tuples, by id"""
+    return _get('warehouses')
+
+
+def warehouse_choices():
+    return [(w.id, w.name) for w in warehouses()]
+
+
+def category_id(name):
+    """Id of the category called `name`, or None"""
+    found = _get('categories').get(name)
+    if found is None:
+        # Misses precede a write anyway, so confirm them against the table
+        found = db.session.execute(select(Category.id).where(Category.name == name)).scalar()
+    return found
+
+
+def users(active_only=False):
+    """All users as UserRef tuples, by id"""
+    return tuple(u for u in _get('users') if u.is_active or not active_only)
+
+
+def cache_stats():
+    return get_cache().stats()
+
+
+def seed_versions(connection):
+    """Create any missing cache_version rows"""
+    table = CacheVersion.__table__
+    existing = set(connection.execute(select(table.c.name)).scalars())
+    missing = [{'name': name, 'version': 0} for name in DATASETS if name not in existing]
+    if missing:
+        connection.execute(insert(table), missing)
+
+
+def bump(connection, names):
+    """Invalidate reference-data sets in every process, inside the caller's transaction.
+
+    Code that changes warehouses, categories or users with plain SQL must
+    call this with the set names it touched.
+    """
+    table = CacheVersion.__table__
+    for name in names:
+        result = connection.execute(
+            update(table).where(table.c.name == name).values(version=table.c.version + 1)
+        )
+        if result.rowcount == 0:
+            connection.execute(insert(table).values(name=name, version=1))
+
+
+def _after_flush(session, flush_context):
+    changed = set()
+    for obj in session.new | session.deleted:
+        name = _DATASET_OF.get(type(obj))
+        if name:
+            changed.add(name)
+    for obj in session.dirty:
+        name = _DATASET_OF.get(type(obj))
+        if name and session.is_modified(obj, include_collections=False):
+            changed.add(name)
+    changed -= session.info.get('refdata_changed', set())
+    if changed:
+        bump(session.connection(), sorted(changed))
+        session.info.setdefault('refdata_changed', set()).update(changed)
+
+
+def _after_commit(session):
+    changed = session.info.pop('refdata_changed', None)
+    if changed and has_app_context():
+        get_cache().invalidate(changed)
+        if has_request_context():
+            g.pop('_refdata_versions', None)
+
+
+def _after_rollback(session):
+    session.info.pop('refdata_changed', None)
+
+
+def init_app(app):
+    for name, listener in (('after_flush', _after_flush),
+                           ('after_commit', _after_commit),
+                           ('after_rollback', _after_rollback)):
+        if not event.contains(db.session, name, listener):
+            event.listen(db.session, name, listener)
@@ -1,10 +1,20 @@
-from flask import render_template, request
-from flask_login import login_required
+import os
+from flask import render_template, request, current_app, abort, flash, redirect, url_for, jsonify, send_file
+from flask_login import login_required, current_user
 from app.reports import bp
-from app.models import Transaction, Item, Warehouse, User
-from app.utils import create_excel_response
+from app.models import ExportJob, Item, StockSnapshot
+from app.utils import stream_excel_response, stream_response, accepts_gzip
+from app.queries import export_jobs_of, stock_totals_by_warehouse
+from app.exports import parse_day, export_response, export_filename, export_chunks, EXPORT_MIMETYPES
+from app.snapshots import stock_as_of
+from app import refdata
+from app.export_jobs import (EXPORT_KINDS, enqueue, cancel, job_path, job_mimetype,
+                             transaction_report, inventory_report, low_stock_report, movement_report,
+                             reorder_report)
+from app.forecast import forecast_settings, apply_suggestions
+from app import db
 from datetime import datetime, timedelta
-from sqlalchemy import and_
+from sqlalchemy import func
 
 @bp.route('/')
 @login_required
@@ -15,119 +25,194 @@ def index():
 @bp.route('/transactions-export')
 @login_required
 def export_transactions():
-    # Get filter parameters
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    warehouse_id = request.args.get('warehouse_id', type=int)
-    item_id = request.args.get('item_id', type=int)
-    user_id = request.args.get('user_id', type=int)
-    
-    # Build query
-    query = Transaction.query
-    
-    if start_date:
-        start_date = datetime.strptime(start_date, '%Y-%m-%d')
-        query = query.filter(Transaction.created_at >= start_date)
-    
-    if end_date:
-        end_date = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
-        query = query.filter(Transaction.created_at < end_date)
-    
-    if warehouse_id:
-        query = query.filter(Transaction.warehouse_id == warehouse_id)
-    
-    if item_id:
-        query = query.filter(Transaction.item_id == item_id)
-    
-    if user_id:
-        query = query.filter(Transaction.user_id == user_id)
-    
-    transactions = query.order_by(Transaction.created_at.desc()).all()
-    
-    # Prepare data for Excel
-    data = []
-    for t in transactions:
-        data.append([
-            t.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            t.transaction_type.value.upper(),
-            t.item.ssid,
-            t.item.name,
-            t.warehouse.name,
-            t.quantity,
-            t.user.username,
-            t.notes or ''
-        ])
-    
-    headers = [
-        'Date/Time', 'Type', 'SSID', 'Item Name', 
-        'Warehouse', 'Quantity', 'User', 'Notes'
-    ]
-    
+    # ?start_date=, ?end_date=, ?warehouse_id=, ?item_id=, ?user_id=
+    headers, query, shape = transaction_report(request.args)
+
+    # Rows are produced lazily so the ledger is never held in memory
+    data = (shape(row) for row in query.yield_per(current_app.config['EXPORT_CHUNK_SIZE']))
+
     filename = f"transactions_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    
-    return create_excel_response(data, filename, headers)
+
+    return stream_excel_response(data, filename, headers)
 
 @bp.route('/inventory-export')
 @login_required
 def export_inventory():
+    # ?warehouse_id=, ?as_of= for stock at the end of a past day
+    headers, query, shape = inventory_report(request.args)
+    data = (shape(row) for row in query.yield_per(current_app.config['EXPORT_CHUNK_SIZE']))
+
+    prefix = f"inventory_as_of_{request.args['as_of'][:10]}" if request.args.get('as_of') else 'inventory_export'
+    filename = f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+
+    return stream_excel_response(data, filename, headers)
+
+@bp.route('/inventory-as-of')
+@login_required
+def inventory_as_of():
+    as_of = request.args.get('as_of', '')
     warehouse_id = request.args.get('warehouse_id', type=int)
-    
-    query = Item.query
-    if warehouse_id:
-        query = query.filter(Item.warehouse_id == warehouse_id)
-    
-    items = query.all()
-    
-    # Prepare data for Excel
-    data = []
-    for item in items:
-        data.append([
-            item.ssid,
-            item.name,
-            item.warehouse.name,
-            item.category.name,
-            item.current_stock,
-            item.unit,
-            item.reorder_level,
-            'LOW STOCK' if item.is_low_stock else 'OK',
-            float(item.unit_price),
-            item.description or ''
-        ])
-    
-    headers = [
-        'SSID', 'Name', 'Warehouse', 'Category', 
-        'Current Stock', 'Unit', 'Reorder Level', 'Status', 'Unit Price', 'Description'
-    ]
-    
-    filename = f"inventory_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    
-    return create_excel_response(data, filename, headers)
+    totals = None
+    if as_of:
+        when = parse_day(as_of, end=True)
+        query = stock_totals_by_warehouse(stock_as_of(when)).filter(Item.created_at < when)
+        if warehouse_id:
+            query = query.filter(Item.warehouse_id == warehouse_id)
+        totals = query.all()
+    latest = db.session.query(func.max(StockSnapshot.taken_at)).scalar()
+    return render_template('reports/inventory_as_of.html', as_of=as_of, warehouse_id=warehouse_id,
+                           totals=totals, warehouses=refdata.warehouses(), latest_snapshot=latest)
+
+@bp.route('/movements')
+@login_required
+def movements():
+    # Day / week / month totals straight from the rollups; last 30 days by default
+    args = request.args.copy()
+    args.pop('format', None)
+    if 'from' not in args:
+        args['from'] = (datetime.today() - timedelta(days=30)).strftime('%Y-%m-%d')
+    headers, query, _ = movement_report(args)
+    limit = 500
+    rows = query.limit(limit + 1).all()
+    return render_template('reports/movements.html', args=args, headers=headers, rows=rows[:limit],
+                           truncated=len(rows) > limit, warehouses=refdata.warehouses())
+
+@bp.route('/movements-export')
+@login_required
+def export_movements():
+    # Same filters as /movements; ?format=xlsx (default), csv, json or ndjson
+    fmt = request.args.get('format', 'xlsx').lower()
+    headers, query, shape = movement_report(request.args)
+    if fmt in EXPORT_MIMETYPES:
+        return export_response(query, headers, fmt, 'stock_movements')
+    if fmt != 'xlsx':
+        abort(400)
+    data = (shape(row) for row in query.yield_per(current_app.config['EXPORT_CHUNK_SIZE']))
+    filename = export_filename('stock_movements', 'xlsx')
+    return stream_excel_response(data, filename, headers)
+
+@bp.route('/reorder')
+@login_required
+def reorder():
+    # Suggested reorder levels, items closest to running out first
+    headers, query, shape = reorder_report(request.args)
+    limit = 500
+    rows = [shape(row) for row in query.limit(limit + 1)]
+    return render_template('reports/reorder.html', settings=forecast_settings(request.args),
+                           warehouse_id=request.args.get('warehouse_id', type=int), headers=headers,
+                           rows=rows[:limit], truncated=len(rows) > limit, warehouses=refdata.warehouses(),
+                           can_apply=current_user.can_create_items())
+
+@bp.route('/reorder-export')
+@login_required
+def export_reorder():
+    # Same filters as /reorder; ?format=xlsx (default), csv, json or ndjson
+    fmt = request.args.get('format', 'xlsx').lower()
+    if fmt not in EXPORT_MIMETYPES and fmt != 'xlsx':
+        abort(400)
+    headers, query, shape = reorder_report(request.args)
+    data = (shape(row) for row in query.yield_per(current_app.config['EXPORT_CHUNK_SIZE']))
+    filename = export_filename('reorder_levels', fmt)
+    if fmt in EXPORT_MIMETYPES:
+        return stream_response(export_chunks(data, headers, fmt), EXPORT_MIMETYPES[fmt],
+                               filename=filename, compress=accepts_gzip())
+    return stream_excel_response(data, filename, headers)
+
+@bp.route('/reorder/apply', methods=['POST'])
+@login_required
+def apply_reorder():
+    if not current_user.can_create_items():
+        flash('Access denied. Manager or Admin privileges required.', 'danger')
+        return redirect(url_for('reports.reorder'))
+    settings = forecast_settings(request.form)
+    warehouse_id = request.form.get('warehouse_id', type=int)
+    changed = apply_suggestions(settings, warehouse_id)
+    flash(f'Reorder level updated for {changed} item(s).', 'success')
+    return redirect(url_for('reports.reorder', warehouse_id=warehouse_id, **settings._asdict()))
 
 @bp.route('/low-stock-export')
 @login_required
 def export_low_stock():
-    items = Item.query.filter(Item.current_stock <= Item.reorder_level).all()
-    
-    # Prepare data for Excel
-    data = []
-    for item in items:
-        data.append([
-            item.ssid,
-            item.name,
-            item.warehouse.name,
-            item.category.name,
-            item.current_stock,
-            item.reorder_level,
-            item.reorder_level - item.current_stock,
-            item.unit,
-            float(item.unit_price)
-        ])
-    
-    headers = [
-        'SSID', 'Name', 'Warehouse', 'Category', 
-        'Current Stock', 'Reorder Level', 'Shortage', 'Unit', 'Unit Price'
-    ]
-    
+    headers, query, shape = low_stock_report(request.args)
+    data = (shape(row) for row in query.yield_per(current_app.config['EXPORT_CHUNK_SIZE']))
+
     filename = f"low_stock_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    
-    return create_excel_response(data, filename, headers)
+
+    return stream_excel_response(data, filename, headers)
+
+def _is_admin():
+    return getattr(current_user, 'can_manage_users', lambda: False)()
+
+def _own_job(job_id):
+    job = db.session.get(ExportJob, job_id)
+    if job is None or (job.created_by_id != current_user.id and not _is_admin()):
+        abort(404)
+    return job
+
+def _job_status(job):
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'format': job.format,
+        'status': job.status,
+        'rows_done': job.rows_done,
+        'rows_total': job.rows_total,
+        'percent': job.percent,
+        'error': job.error,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'expires_at': job.expires_at.isoformat() if job.expires_at else None,
+        'download_url': url_for('reports.download_job', job_id=job.id) if job.status == 'done' else None,
+    }
+
+@bp.route('/jobs', methods=['GET', 'POST'])
+@login_required
+def jobs():
+    if request.method == 'GET':
+        return render_template('reports/jobs.html', jobs=export_jobs_of(current_user.id).limit(50).all(),
+                               kinds=EXPORT_KINDS)
+
+    # Queue an export: kind, format and the kind's filters as form fields
+    kind = request.form.get('kind')
+    if kind not in EXPORT_KINDS:
+        abort(400)
+    fmt = request.form.get('format', EXPORT_KINDS[kind].formats[0]).lower()
+    if fmt not in EXPORT_KINDS[kind].formats:
+        abort(400)
+    if EXPORT_KINDS[kind].admin_only and not _is_admin():
+        flash('Access denied. Admin privileges required.', 'danger')
+        return redirect(url_for('main.dashboard'))
+    job = enqueue(kind, fmt, request.form, current_user)
+
+    status_url = url_for('reports.job_status', job_id=job.id)
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(_job_status(job)), 202, {'Location': status_url}
+    return redirect(url_for('reports.job', job_id=job.id))
+
+@bp.route('/jobs/<int:job_id>')
+@login_required
+def job(job_id):
+    job = _own_job(job_id)
+    return render_template('reports/job.html', job=job, kind=EXPORT_KINDS.get(job.kind))
+
+@bp.route('/jobs/<int:job_id>/status')
+@login_required
+def job_status(job_id):
+    return jsonify(_job_status(_own_job(job_id)))
+
+@bp.route('/jobs/<int:job_id>/download')
+@login_required
+def download_job(job_id):
+    job = _own_job(job_id)
+    path = job_path(job)
+    if job.status != 'done' or not os.path.exists(path):
+        abort(404)
+    return send_file(path, mimetype=job_mimetype(job), as_attachment=True, download_name=job.filename)
+
+@bp.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    job = _own_job(job_id)
+    if cancel(job):
+        flash('Export cancelled.', 'info')
+    return redirect(url_for('reports.job', job_id=job.id))
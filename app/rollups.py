@@ -0,0 +1,157 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, select, insert, update, delete, func, and_, bindparam
+from app import db
+from app.bootstrap import db_cli
+from app.models import Transaction, MovementRollup
+
+# Daily movement totals: movement_rollup holds the sum of quantity and the
+# number of ledger rows per (day, item, warehouse, type), so period reports
+# read O(days x items touched) rows instead of the ledger. Rows are updated
+# in the same transaction as the ledger rows they count: stock.apply_movements
+# calls add() for its bulk inserts, and a session listener covers ledger
+# rows the ORM inserts or deletes (deleting an item deletes its history).
+# Ledger rows are never edited in place. rebuild() recomputes any day range
+# from the ledger (`flask db rebuild-rollups`).
+PERIODS = ('day', 'week', 'month')
+REBUILD_BATCH = 5000
+
+
+def week_of(day):
+    return day - timedelta(days=day.weekday())
+
+
+def month_of(day):
+    return day.replace(day=1)
+
+
+def _day(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def add(connection, movements, sign=1):
+    """Count ledger rows (dicts with created_at, item_id, warehouse_id,
+    transaction_type and quantity) in the rollups, inside the caller's
+    transaction; sign=-1 takes them back out.
+
+    Code that inserts or deletes Transaction rows with plain SQL must call this.
+    """
+    totals = defaultdict(lambda: [0, 0])
+    for m in movements:
+        key = (_day(m['created_at']), m['item_id'], m['warehouse_id'], m['transaction_type'])
+        totals[key][0] += sign * m['quantity']
+        totals[key][1] += sign
+    if not totals:
+        return
+
+    table = MovementRollup.__table__
+    key_columns = (table.c.day, table.c.item_id, table.c.warehouse_id, table.c.transaction_type)
+    # The caller holds the write lock, so the rows found here cannot change
+    # before they are updated; one lookup and two executemany statements
+    # keep large batches cheap
+    existing = set(connection.execute(
+        select(*key_columns).where(table.c.day.in_({key[0] for key in totals}),
+                                   table.c.item_id.in_({key[1] for key in totals}))
+    ).all())
+    updates, inserts = [], []
+    for (day, item_id, warehouse_id, transaction_type), (quantity, count) in totals.items():
+        values = {'k_day': day, 'k_item_id': item_id, 'k_warehouse_id': warehouse_id,
+                  'k_transaction_type': transaction_type, 'd_quantity': quantity, 'd_movements': count}
+        if (day, item_id, warehouse_id, transaction_type) in existing:
+            updates.append(values)
+        elif count > 0:
+            inserts.append({'day': day, 'item_id': item_id, 'warehouse_id': warehouse_id,
+                            'transaction_type': transaction_type, 'week': week_of(day), 'month': month_of(day),
+                            'quantity': quantity, 'movements': count})
+    key = and_(*(column == bindparam(f'k_{column.name}') for column in key_columns))
+    if updates:
+        connection.execute(
+            update(table).where(key).values(quantity=table.c.quantity + bindparam('d_quantity'),
+                                             movements=table.c.movements + bindparam('d_movements')),
+            updates
+        )
+    if inserts:
+        connection.execute(insert(table), inserts)
+    emptied = [values for values in updates if values['d_movements'] < 0]
+    if emptied:
+        connection.execute(delete(table).where(key, table.c.movements <= 0),
+                           [{name: value for name, value in values.items() if name.startswith('k_')}
+                            for values in emptied])
+
+
+def rebuild(connection, start=None, end=None):
+    """Recompute the rollups of days start..end (inclusive dates; None for open ends); returns rows written"""
+    table = MovementRollup.__table__
+    ledger = Transaction.__table__
+    day = func.date(ledger.c.created_at)
+    cleared = delete(table)
+    source = select(
+        day, ledger.c.item_id, ledger.c.warehouse_id, ledger.c.transaction_type,
+        func.sum(ledger.c.quantity), func.count()
+    ).group_by(day, ledger.c.item_id, ledger.c.warehouse_id, ledger.c.transaction_type)
+    # created_at bounds use the index; the day test keeps the rebuilt rows
+    # exactly inside the range cleared
+    if start is not None:
+        cleared = cleared.where(table.c.day >= start)
+        source = source.where(ledger.c.created_at >= datetime.combine(start, datetime.min.time()) - timedelta(days=1),
+                              day >= start.isoformat())
+    if end is not None:
+        cleared = cleared.where(table.c.day <= end)
+        source = source.where(ledger.c.created_at < datetime.combine(end, datetime.min.time()) + timedelta(days=2),
+                              day <= end.isoformat())
+    connection.execute(cleared)
+
+    written = 0
+    # Grouped by day in SQL; weeks and months are filled in here so the
+    # statement stays portable
+    for batch in connection.execute(source).partitions(REBUILD_BATCH):
+        rows = []
+        for day, item_id, warehouse_id, transaction_type, quantity, count in batch:
+            day = _day(day)
+            rows.append({'day': day, 'item_id': item_id, 'warehouse_id': warehouse_id,
+                         'transaction_type': transaction_type, 'week': week_of(day), 'month': month_of(day),
+                         'quantity': quantity or 0, 'movements': count})
+        connection.execute(insert(table), rows)
+        written += len(rows)
+    return written
+
+
+def _values(transaction):
+    return {
+        'created_at': transaction.created_at,
+        'item_id': transaction.item_id,
+        'warehouse_id': transaction.warehouse_id,
+        'transaction_type': transaction.transaction_type,
+        'quantity': transaction.quantity,
+    }
+
+
+def _after_flush(session, flush_context):
+    added = [_values(obj) for obj in session.new if isinstance(obj, Transaction)]
+    removed = [_values(obj) for obj in session.deleted if isinstance(obj, Transaction)]
+    if added or removed:
+        connection = session.connection()
+        add(connection, added)
+        add(connection, removed, sign=-1)
+
+
+@db_cli.command('rebuild-rollups')
+@click.option('--from', 'start', type=click.DateTime(['%Y-%m-%d']), help='First day to rebuild (default: all).')
+@click.option('--to', 'end', type=click.DateTime(['%Y-%m-%d']), help='Last day to rebuild (default: all).')
+@with_appcontext
+def rebuild_command(start, end):
+    """Recompute daily movement rollups from the ledger."""
+    with db.engine.begin() as connection:
+        written = rebuild(connection, start and start.date(), end and end.date())
+    click.echo(f'{written} rollup rows written')
+
+
+def init_app(app):
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
@@ -1,11 +1,10 @@
-from flask import render_template, redirect, url_for, flash, request, make_response, jsonify
+from flask import render_template, redirect, url_for, flash, request
 from flask_login import login_required, current_user
 from app.sellers import bp
 from app.models import Seller, db
 from app.sellers.forms import CreateSellerForm
-import csv
-import io
-from datetime import datetime
+from app.exports import export_format, export_response
+from app.export_jobs import seller_report
 
 @bp.route('/')
 @login_required
@@ -42,34 +41,7 @@ def export():
         flash('Access denied. Admin privileges required.', 'danger')
         return redirect(url_for('main.dashboard'))
 
-    fmt = request.args.get('format', 'csv').lower()
-    sellers = Seller.query.order_by(Seller.name).all()
-
-    if fmt == 'json':
-        data = []
-        for s in sellers:
-            data.append({
-                'id': s.id,
-                'name': s.name,
-                'email': s.email,
-                'phone': s.phone,
-                'created_at': s.created_at.isoformat() if getattr(s, 'created_at', None) else None,
-            })
-        return jsonify(data)
-
-    si = io.StringIO()
-    cw = csv.writer(si)
-    cw.writerow(['id', 'name', 'email', 'phone', 'created_at'])
-    for s in sellers:
-        cw.writerow([
-            s.id,
-            s.name,
-            s.email or '',
-            s.phone or '',
-            s.created_at.isoformat() if getattr(s, 'created_at', None) else '',
-        ])
-    output = make_response(si.getvalue())
-    stamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
-    output.headers['Content-Disposition'] = f'attachment; filename=sellers-{stamp}.csv'
-    output.headers['Content-Type'] = 'text/csv; charset=utf-8'
-    return output
\ No newline at end of file
+    # ?format=csv|json|ndjson, ?from=/?to= creation dates
+    fmt = export_format()
+    fields, query, _ = seller_report(request.args)
+    return export_response(query, fields, fmt, 'sellers')
@@ -0,0 +1,210 @@
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, insert, update, delete, func, case, and_, literal
+from app import db
+from app.models import Item, Transaction, StockSnapshot, StockSnapshotItem
+from app.stock import ledger_delta, stock_cli
+
+# Point-in-time stock. A snapshot copies every item's current_stock together
+# with the id of the last ledger row included in it, taken under SQLite's
+# write lock so no movement can commit in between. Stock as of T is then
+# answered from the snapshot nearest to T by applying only the ledger rows
+# between the two:
+#
+#     stock(T) = snapshot + rows after the snapshot created before T
+#                         - rows in the snapshot created at or after T
+#
+# which works from a snapshot on either side of T. The live item table
+# serves as the newest snapshot. Rows are matched to the snapshot by id and
+# to T by created_at, looked up through the created_at index within
+# COMMIT_SLACK of the interval: a movement's created_at is set when its
+# batch starts, slightly before it commits.
+#
+# A snapshot is taken every STOCK_SNAPSHOT_HOURS (checked lazily by
+# requests, or run `flask stock snapshot` from cron). Snapshots older than
+# STOCK_SNAPSHOT_KEEP_DAYS are pruned down to the first of each month.
+COMMIT_SLACK = timedelta(minutes=5)
+CHECK_SECONDS = 300
+
+Source = namedtuple('Source', 'snapshot_id taken_at last_transaction_id')
+
+_snapshot_lock = threading.Lock()
+
+
+def take_snapshot(min_age=None):
+    """Record every item's stock; returns the new snapshot id.
+
+    With `min_age`, nothing is recorded (and None is returned) when another
+    snapshot was taken more recently than that.
+    """
+    snapshots = StockSnapshot.__table__
+    with db.engine.connect() as connection, connection.begin() as transaction:
+        # Writing first takes the write lock, so the ledger cannot move
+        # between reading its last id and copying stock
+        taken_at = datetime.utcnow()
+        snapshot_id = connection.execute(
+            insert(snapshots).values(taken_at=taken_at, last_transaction_id=0, item_count=0)
+        ).inserted_primary_key[0]
+        if min_age is not None:
+            recent = connection.execute(
+                select(func.count()).select_from(snapshots).where(
+                    snapshots.c.id != snapshot_id, snapshots.c.taken_at > taken_at - min_age
+                )
+            ).scalar()
+            if recent:
+                transaction.rollback()
+                return None
+        last_id = connection.execute(select(func.coalesce(func.max(Transaction.id), 0))).scalar()
+        items = Item.__table__
+        copied = connection.execute(
+            insert(StockSnapshotItem.__table__).from_select(
+                ['snapshot_id', 'item_id', 'stock'],
+                select(literal(snapshot_id), items.c.id, func.coalesce(items.c.current_stock, 0))
+            )
+        ).rowcount
+        connection.execute(
+            update(snapshots).where(snapshots.c.id == snapshot_id).values(
+                last_transaction_id=last_id, item_count=copied
+            )
+        )
+    return snapshot_id
+
+
+def prune(keep_days):
+    """Delete snapshots older than `keep_days`, except the first of each month; returns how many"""
+    cutoff = datetime.utcnow() - timedelta(days=keep_days)
+    rows = db.session.execute(
+        select(StockSnapshot.id, StockSnapshot.taken_at).order_by(StockSnapshot.taken_at)
+    ).all()
+    kept_months = set()
+    doomed = []
+    for snapshot_id, taken_at in rows:
+        month = (taken_at.year, taken_at.month)
+        if month not in kept_months:
+            kept_months.add(month)
+        elif taken_at < cutoff:
+            doomed.append(snapshot_id)
+    if doomed:
+        db.session.execute(delete(StockSnapshotItem).where(StockSnapshotItem.snapshot_id.in_(doomed)))
+        db.session.execute(delete(StockSnapshot).where(StockSnapshot.id.in_(doomed)))
+    db.session.commit()
+    return len(doomed)
+
+
+def _snapshot_in_background(app):
+    if not _snapshot_lock.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            with app.app_context():
+                hours = app.config['STOCK_SNAPSHOT_HOURS']
+                if take_snapshot(min_age=timedelta(hours=hours)):
+                    prune(app.config['STOCK_SNAPSHOT_KEEP_DAYS'])
+        except Exception:
+            app.logger.exception('Stock snapshot failed')
+        finally:
+            _snapshot_lock.release()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def _nearest(when):
+    """(snapshot at or before `when`, snapshot after it) as Sources; the latter is None when there is none"""
+    columns = (StockSnapshot.id, StockSnapshot.taken_at, StockSnapshot.last_transaction_id)
+    before = db.session.execute(
+        select(*columns).where(StockSnapshot.taken_at <= when).order_by(StockSnapshot.taken_at.desc()).limit(1)
+    ).first()
+    after = db.session.execute(
+        select(*columns).where(StockSnapshot.taken_at > when).order_by(StockSnapshot.taken_at).limit(1)
+    ).first()
+    return (Source(*before) if before else None), (Source(*after) if after else None)
+
+
+def _live():
+    # The last id is a subquery of the same statement as the stock it
+    # describes, so both come from one consistent read
+    return Source(None, datetime.utcnow(), select(func.coalesce(func.max(Transaction.id), 0)).scalar_subquery())
+
+
+def _replay(source, when):
+    """(item_id, stock) as of `when` for the items in `source`"""
+    if source.snapshot_id is None:
+        base = select(Item.id.label('item_id'), func.coalesce(Item.current_stock, 0).label('stock'))
+    else:
+        base = select(StockSnapshotItem.item_id, StockSnapshotItem.stock).where(
+            StockSnapshotItem.snapshot_id == source.snapshot_id
+        )
+    base = base.subquery()
+
+    last_id = source.last_transaction_id
+    delta = ledger_delta()
+    change = case(
+        (and_(Transaction.id > last_id, Transaction.created_at < when), delta),
+        (and_(Transaction.id <= last_id, Transaction.created_at >= when), -delta),
+        else_=0
+    )
+    changes = select(Transaction.item_id, func.sum(change).label('change')).where(
+        Transaction.created_at >= min(when, source.taken_at) - COMMIT_SLACK,
+        Transaction.created_at <= max(when, source.taken_at) + COMMIT_SLACK
+    ).group_by(Transaction.item_id).subquery()
+
+    return select(
+        base.c.item_id, (base.c.stock + func.coalesce(changes.c.change, 0)).label('stock')
+    ).select_from(base).outerjoin(changes, changes.c.item_id == base.c.item_id)
+
+
+def stock_as_of(when):
+    """Subquery of (item_id, stock) after every movement before `when`.
+
+    Includes items that have since been deleted if a snapshot still holds
+    them; join to Item (and filter on Item.created_at) for the catalog.
+    """
+    before, after = _nearest(when)
+    later = after or _live()
+    if before is None or when - before.taken_at > later.taken_at - when:
+        return _replay(later, when).subquery('stock_as_of')
+
+    # Forward from the earlier snapshot; items it predates come from the later source
+    in_before = select(StockSnapshotItem.item_id).where(StockSnapshotItem.snapshot_id == before.snapshot_id)
+    newer = _replay(later, when)
+    newer = newer.where(newer.selected_columns.item_id.not_in(in_before))
+    return _replay(before, when).union_all(newer).subquery('stock_as_of')
+
+
+def init_app(app):
+    hours = app.config['STOCK_SNAPSHOT_HOURS']
+    if not hours:
+        return
+    next_check = [0]
+
+    # At most one cheap look per process every CHECK_SECONDS
+    @app.before_request
+    def snapshot_when_due():
+        now = time.monotonic()
+        if now < next_check[0]:
+            return
+        next_check[0] = now + CHECK_SECONDS
+        latest = db.session.execute(select(func.max(StockSnapshot.taken_at))).scalar()
+        if latest is None or latest < datetime.utcnow() - timedelta(hours=hours):
+            _snapshot_in_background(app)
+
+
+@stock_cli.command('snapshot')
+@click.option('--prune/--no-prune', 'prune_old', default=True, show_default=True,
+              help='Thin out snapshots older than STOCK_SNAPSHOT_KEEP_DAYS.')
+@with_appcontext
+def snapshot_command(prune_old):
+    """Record every item's current stock as a snapshot."""
+    started = time.perf_counter()
+    snapshot_id = take_snapshot()
+    snapshot = db.session.get(StockSnapshot, snapshot_id)
+    click.echo(f'Snapshot {snapshot.id}: {snapshot.item_count} items up to transaction '
+               f'{snapshot.last_transaction_id} ({time.perf_counter() - started:.1f}s)')
+    if prune_old:
+        click.echo(f"{prune(current_app.config['STOCK_SNAPSHOT_KEEP_DAYS'])} old snapshot(s) pruned")
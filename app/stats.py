@@ -0,0 +1,99 @@
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event, func, update
+from app import db
+from app.bootstrap import db_cli
+from app.models import Item, Warehouse, Transaction, SummaryCounter
+
+# Dashboard totals, maintained in the same transaction as the inserts and
+# deletes that change them and periodically recounted to heal any drift
+# (bulk SQL that bypasses the ORM, concurrent recounts, manual edits).
+COUNTED_MODELS = {
+    'items': Item,
+    'warehouses': Warehouse,
+    'transactions': Transaction,
+}
+_COUNTER_NAMES = {model: name for name, model in COUNTED_MODELS.items()}
+
+_recount_lock = threading.Lock()
+
+
+def adjust(connection, deltas):
+    """Apply {counter name: delta} on `connection`, inside the caller's transaction"""
+    table = SummaryCounter.__table__
+    for name, delta in deltas.items():
+        if delta:
+            connection.execute(
+                update(table).where(table.c.name == name).values(value=table.c.value + delta)
+            )
+
+
+def _after_flush(session, flush_context):
+    deltas = Counter()
+    for obj in session.new:
+        name = _COUNTER_NAMES.get(type(obj))
+        if name:
+            deltas[name] += 1
+    for obj in session.deleted:
+        name = _COUNTER_NAMES.get(type(obj))
+        if name:
+            deltas[name] -= 1
+    if deltas:
+        adjust(session.connection(), deltas)
+
+
+def recount():
+    """Rebuild every counter from COUNT(*)"""
+    now = datetime.utcnow()
+    for name, model in COUNTED_MODELS.items():
+        value = db.session.query(func.count(model.id)).scalar()
+        db.session.merge(SummaryCounter(name=name, value=value, recounted_at=now))
+    db.session.commit()
+
+
+def _recount_in_background(app):
+    if not _recount_lock.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            with app.app_context():
+                recount()
+        except Exception:
+            app.logger.exception('Summary counter recount failed')
+        finally:
+            _recount_lock.release()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def summary_counts():
+    """Dashboard totals from the counter table in a single query"""
+    rows = {row.name: row for row in SummaryCounter.query.all()}
+    if set(rows) != set(COUNTED_MODELS):
+        recount()
+        rows = {row.name: row for row in SummaryCounter.query.all()}
+    else:
+        interval = timedelta(seconds=current_app.config['SUMMARY_RECOUNT_SECONDS'])
+        oldest = min(row.recounted_at or datetime.min for row in rows.values())
+        if oldest < datetime.utcnow() - interval:
+            _recount_in_background(current_app._get_current_object())
+    return {name: rows[name].value for name in COUNTED_MODELS}
+
+
+@db_cli.command('recount')
+@with_appcontext
+def recount_command():
+    """Rebuild the dashboard summary counters from the tables."""
+    recount()
+    for name, value in summary_counts().items():
+        click.echo(f'{name}: {value}')
+
+
+def init_app(app):
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
@@ -0,0 +1,328 @@
+import os
+import random
+import tempfile
+import threading
+from collections import defaultdict
+from datetime import datetime
+import click
+from flask import current_app
+from sqlalchemy import select, insert, update, or_, func, case
+from app import db
+from app.models import Item, Transaction, TransactionType
+from app import stats, low_stock, rollups, tombstones
+
+# Every change to Item.current_stock goes through apply_movements().
+#
+# Stock is validated against a snapshot read without locks, then written
+# with conditional UPDATEs of the form
+#     SET current_stock = current_stock + :delta WHERE id IN (...) AND current_stock >= :required
+# where :required is the lowest starting stock at which every movement of
+# the batch still passes its check. If a concurrent writer moved stock below
+# that, the UPDATE skips the row, the whole attempt is rolled back and it is
+# retried against a fresh snapshot (STOCK_MAX_RETRIES times). Increments are
+# applied in SQL, never as read-modify-write in Python, so concurrent
+# movements on one item are never lost, and items that are not shared by two
+# batches never wait on each other's rows.
+
+
+MAX_QUANTITY = 2 ** 31 - 1  # per movement, so stock and ledger sums stay far inside 64 bits
+MAX_ID = 2 ** 63 - 1  # largest SQLite rowid
+
+
+class StockError(Exception):
+    """A movement that cannot be applied to an item's stock"""
+
+
+class StockConflict(StockError):
+    """Stock kept changing underneath a batch until retries ran out"""
+
+
+def stock_delta(transaction_type, quantity):
+    """Signed change to current_stock for one movement"""
+    if transaction_type == TransactionType.OUT:
+        return -quantity
+    return quantity  # IN is positive; ADJUSTMENT can be positive or negative
+
+
+def ledger_delta():
+    """stock_delta() of a Transaction row, as a SQL expression"""
+    return case((Transaction.transaction_type == TransactionType.OUT, -Transaction.quantity),
+                else_=Transaction.quantity)
+
+
+def check_movement(transaction_type, quantity, current_stock, can_override=False):
+    """Raise StockError if the movement is invalid against `current_stock`"""
+    if transaction_type in (TransactionType.IN, TransactionType.OUT) and quantity <= 0:
+        raise StockError(f'Quantity must be positive for stock {transaction_type.value}.')
+    if transaction_type == TransactionType.ADJUSTMENT and quantity == 0:
+        raise StockError('Adjustment quantity cannot be zero.')
+    if can_override:
+        return
+    if transaction_type == TransactionType.OUT and current_stock < quantity:
+        raise StockError(f'Insufficient stock. Available: {current_stock}, Requested: {quantity}')
+    if transaction_type == TransactionType.ADJUSTMENT and current_stock + quantity < 0:
+        raise StockError(f'Adjustment would result in negative stock: {current_stock + quantity}')
+
+
+def _parse_line(line):
+    if not isinstance(line, dict):
+        raise StockError('Movement must be an object.')
+    try:
+        transaction_type = TransactionType(str(line.get('type', '')).lower())
+    except ValueError:
+        raise StockError("type must be one of 'in', 'out', 'adjustment'.")
+    quantity = line.get('quantity')
+    if not isinstance(quantity, int) or isinstance(quantity, bool):
+        raise StockError('quantity must be an integer.')
+    if abs(quantity) > MAX_QUANTITY:
+        raise StockError(f'quantity must be between -{MAX_QUANTITY} and {MAX_QUANTITY}.')
+    item_id, ssid = line.get('item_id'), line.get('ssid')
+    if item_id is not None and (not isinstance(item_id, int) or isinstance(item_id, bool)
+                                or not 0 < item_id <= MAX_ID):
+        raise StockError('item_id must be a positive integer.')
+    if ssid is not None and not isinstance(ssid, str):
+        raise StockError('ssid must be a string.')
+    if item_id is None and not ssid:
+        raise StockError('item_id or ssid is required.')
+    notes = line.get('notes')
+    return {
+        'item_id': item_id,
+        'ssid': ssid,
+        'transaction_type': transaction_type,
+        'quantity': quantity,
+        'notes': str(notes) if notes is not None else None,
+    }
+
+
+def apply_batch(lines, user, atomic=False):
+    """Apply JSON movement lines ({item_id|ssid, type, quantity, notes}); see apply_movements"""
+    movements = []
+    errors = {}
+    for index, line in enumerate(lines):
+        try:
+            movements.append(_parse_line(line))
+        except StockError as exc:
+            errors[index] = str(exc)
+            movements.append(None)
+    return apply_movements(movements, user, atomic=atomic, errors=errors)
+
+
+def record_movement(item_id, transaction_type, quantity, notes, user):
+    """Apply a single movement; returns its result or raises StockError"""
+    result = apply_movements([{
+        'item_id': item_id,
+        'ssid': None,
+        'transaction_type': transaction_type,
+        'quantity': quantity,
+        'notes': notes,
+    }], user)[0]
+    if result['status'] != 'ok':
+        raise StockError(result['error'])
+    return result
+
+
+def apply_movements(movements, user, atomic=False, errors=None):
+    """Validate and apply stock movements in one commit.
+
+    Items are read in one query, transactions are bulk inserted, and stock is
+    changed with one conditional UPDATE per distinct (net delta, required
+    stock) pair. Movements are checked in order against the running stock of
+    their item. Returns one result dict per movement; with `atomic`, nothing
+    is written if any movement is rejected. `errors` maps positions already
+    rejected by the caller to their message.
+    """
+    retries = current_app.config['STOCK_MAX_RETRIES']
+    for _ in range(retries + 1):
+        results = _try_apply(movements, user, atomic, errors or {})
+        if results is not None:
+            return results
+        db.session.rollback()
+    raise StockConflict('Stock changed concurrently too many times; please retry.')
+
+
+def _try_apply(movements, user, atomic, errors):
+    results = [None] * len(movements)
+    for index, message in errors.items():
+        results[index] = {'line': index, 'status': 'error', 'error': message}
+
+    ids = {m['item_id'] for m in movements if m and m['item_id'] is not None}
+    ssids = {m['ssid'] for m in movements if m and m['item_id'] is None}
+    items = Item.__table__
+    rows = db.session.execute(
+        select(items.c.id, items.c.ssid, items.c.current_stock, items.c.warehouse_id)
+        .where(or_(items.c.id.in_(ids), items.c.ssid.in_(ssids)))
+    ).all()
+    by_id = {row.id: row for row in rows}
+    by_ssid = {row.ssid: row for row in rows}
+
+    can_override = user.can_override_stock()
+    now = datetime.utcnow()
+    # Running change relative to the snapshot, and its lowest point per item
+    offset = defaultdict(int)
+    lowest = defaultdict(int)
+    accepted = []
+    for index, movement in enumerate(movements):
+        if movement is None:
+            continue
+        if movement['item_id'] is not None:
+            item = by_id.get(movement['item_id'])
+        else:
+            item = by_ssid.get(movement['ssid'])
+        transaction_type, quantity = movement['transaction_type'], movement['quantity']
+        try:
+            if item is None:
+                raise StockError('Item not found.')
+            check_movement(transaction_type, quantity, (item.current_stock or 0) + offset[item.id], can_override)
+        except StockError as exc:
+            results[index] = {'line': index, 'status': 'error', 'error': str(exc)}
+            continue
+        offset[item.id] += stock_delta(transaction_type, quantity)
+        lowest[item.id] = min(lowest[item.id], offset[item.id])
+        accepted.append((index, item.id, offset[item.id], {
+            'transaction_type': transaction_type,
+            'quantity': quantity,
+            'notes': movement['notes'],
+            'item_id': item.id,
+            'warehouse_id': item.warehouse_id,
+            'user_id': user.id,
+            'created_at': now,
+        }))
+
+    if not accepted or (atomic and any(r is not None for r in results)):
+        for index, _, _, _ in accepted:
+            results[index] = {'line': index, 'status': 'skipped', 'error': 'Batch rejected.'}
+        return results
+
+    groups = defaultdict(list)
+    for item_id, net in offset.items():
+        required = None if can_override else -lowest[item_id]
+        groups[(net, required)].append(item_id)
+    final_stock = {}
+    for (net, required), item_ids in groups.items():
+        statement = update(items).where(items.c.id.in_(item_ids))
+        if required:
+            statement = statement.where(items.c.current_stock >= required)
+        updated = db.session.execute(
+            statement.values(current_stock=items.c.current_stock + net, updated_at=now)
+            .returning(items.c.id, items.c.current_stock)
+        ).all()
+        if len(updated) != len(item_ids):
+            # Another writer lowered stock since the snapshot
+            return None
+        final_stock.update(updated)
+
+    transaction_ids = db.session.execute(
+        insert(Transaction).returning(Transaction.id, sort_by_parameter_order=True),
+        [values for _, _, _, values in accepted]
+    ).scalars().all()
+
+    connection = db.session.connection()
+    stats.adjust(connection, {'transactions': len(accepted)})
+    low_stock.refresh(connection, offset.keys())
+    rollups.add(connection, [values for _, _, _, values in accepted])
+    tombstones.bump(connection, {values['warehouse_id'] for _, _, _, values in accepted})
+    db.session.commit()
+
+    for (index, item_id, running, _), transaction_id in zip(accepted, transaction_ids):
+        start = final_stock[item_id] - offset[item_id]
+        results[index] = {
+            'line': index,
+            'status': 'ok',
+            'transaction_id': transaction_id,
+            'item_id': item_id,
+            'new_stock': start + running,
+        }
+    return results
+
+
+@click.group('stock')
+def stock_cli():
+    """Stock mutation tools."""
+
+
+@stock_cli.command('stress')
+@click.option('--threads', default=8, show_default=True)
+@click.option('--movements', default=200, show_default=True, help='Movements per thread.')
+@click.option('--items', default=3, show_default=True, help='Items shared by all threads.')
+def stress_command(threads, movements, items):
+    """Run concurrent movements against a throwaway database and check the ledger."""
+    from app import create_app
+    from app.bootstrap import bootstrap
+    from app.models import User, Role, Warehouse, Category
+    from config import Config
+
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+
+    class StressConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+        SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 60}}
+        SQL_INSTRUMENTATION = False
+        STOCK_MAX_RETRIES = 50
+
+    app = create_app(StressConfig)
+    try:
+        with app.app_context():
+            bootstrap()
+            staff = User(username='stress', email='stress@warehouse.com', role=Role.STAFF)
+            staff.set_password('stress')
+            warehouse, category = Warehouse(name='Stress'), Category(name='Stress')
+            db.session.add_all([staff, warehouse, category])
+            db.session.flush()
+            db.session.add_all([
+                Item(ssid=f'STRESS-{n}', name=f'Stress item {n}', current_stock=0,
+                     warehouse_id=warehouse.id, category_id=category.id)
+                for n in range(items)
+            ])
+            db.session.commit()
+            staff_id = staff.id
+            item_ids = [item_id for (item_id,) in db.session.query(Item.id)]
+
+        outcome = defaultdict(int)
+        lock = threading.Lock()
+
+        def worker(seed):
+            rng = random.Random(seed)
+            with app.app_context():
+                user = db.session.get(User, staff_id)
+                for _ in range(movements):
+                    transaction_type = rng.choice([TransactionType.IN, TransactionType.OUT, TransactionType.OUT])
+                    try:
+                        record_movement(rng.choice(item_ids), transaction_type, rng.randint(1, 5), None, user)
+                        key = 'applied'
+                    except StockConflict:
+                        key = 'conflicts'
+                    except StockError:
+                        key = 'rejected'
+                    with lock:
+                        outcome[key] += 1
+
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+
+        with app.app_context():
+            ledger = dict(db.session.query(
+                Transaction.item_id,
+                func.sum(ledger_delta())
+            ).group_by(Transaction.item_id).all())
+            entries = db.session.query(func.count(Transaction.id)).scalar()
+            broken = []
+            for item in Item.query.order_by(Item.id):
+                total = ledger.get(item.id) or 0
+                status = 'ok' if total == item.current_stock and item.current_stock >= 0 else 'MISMATCH'
+                if status != 'ok':
+                    broken.append(item.ssid)
+                click.echo(f'{status}  {item.ssid}: current_stock={item.current_stock} ledger_sum={total}')
+        click.echo(f"applied={outcome['applied']} rejected={outcome['rejected']} "
+                   f"conflicts={outcome['conflicts']} ledger_rows={entries}")
+        if broken or entries != outcome['applied']:
+            raise click.ClickException('ledger does not match current_stock')
+    finally:
+        os.remove(path)
+
+
+def init_app(app):
+    app.cli.add_command(stock_cli)
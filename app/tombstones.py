@@ -0,0 +1,76 @@
+from datetime import datetime
+from sqlalchemy import event, inspect, select, delete
+from app import db, refdata
+from app.models import Item, DeletedItem, CacheVersion
+
+# Change tracking for API clients that poll the items list.
+#
+# Deleted item ids are kept with the time they were deleted and the
+# warehouse they were in: a changed item shows up through its updated_at, a
+# deleted one only through its tombstone. Recorded in the deleting
+# transaction; code that deletes items with plain SQL must call record().
+#
+# Every transaction that changes items also bumps an "items" version and
+# one per warehouse touched ("items:<id>") in cache_version. The bump is
+# committed with the change, so a version is never visible before the rows
+# it stands for, whatever order writers stamped updated_at in; ETags built
+# from it change with every commit. Code that changes items with plain SQL
+# must call bump() with the warehouses involved.
+
+
+def version_name(warehouse_id=None):
+    return f'items:{warehouse_id}' if warehouse_id else 'items'
+
+
+def bump(connection, warehouse_ids):
+    """Move the items version and that of each warehouse in `warehouse_ids`, inside the caller's transaction"""
+    refdata.bump(connection, [version_name()] + [version_name(w) for w in sorted(set(warehouse_ids)) if w])
+
+
+def items_version(warehouse_id=None):
+    """Version of all items, or of one warehouse's items"""
+    return db.session.execute(
+        select(CacheVersion.version).where(CacheVersion.name == version_name(warehouse_id))
+    ).scalar() or 0
+
+
+def record(connection, items, when=None):
+    """Tombstone deleted items, given as (item_id, warehouse_id) pairs"""
+    items = list(items)
+    if not items:
+        return
+    when = when or datetime.utcnow()
+    table = DeletedItem.__table__
+    # An id can be deleted twice when SQLite reuses the highest rowid
+    connection.execute(delete(table).where(table.c.item_id.in_([item_id for item_id, _ in items])))
+    connection.execute(table.insert(), [{'item_id': item_id, 'warehouse_id': warehouse_id, 'deleted_at': when}
+                                        for item_id, warehouse_id in items])
+
+
+def deleted_since(since, warehouse_id=None):
+    """Ids of items deleted at or after `since` (from one warehouse when given)"""
+    query = select(DeletedItem.item_id).where(DeletedItem.deleted_at >= since)
+    if warehouse_id:
+        query = query.where(DeletedItem.warehouse_id == warehouse_id)
+    return db.session.execute(query.order_by(DeletedItem.item_id)).scalars()
+
+
+def _after_flush(session, flush_context):
+    removed = [obj for obj in session.deleted if isinstance(obj, Item)]
+    if removed:
+        record(session.connection(), [(obj.id, obj.warehouse_id) for obj in removed])
+
+    touched = {obj.warehouse_id for obj in session.new | session.deleted if isinstance(obj, Item)}
+    for obj in session.dirty:
+        if isinstance(obj, Item) and session.is_modified(obj, include_collections=False):
+            # A move changes the listing of the warehouse it left too
+            history = inspect(obj).attrs.warehouse_id.history
+            touched.update(history.deleted or ())
+            touched.add(obj.warehouse_id)
+    if touched:
+        bump(session.connection(), touched)
+
+
+def init_app(app):
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
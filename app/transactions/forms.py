@@ -1,10 +1,14 @@
 from flask_wtf import FlaskForm
-from wtforms import SelectField, IntegerField, TextAreaField, SubmitField, HiddenField
-from wtforms.validators import DataRequired, NumberRange
-from app.models import Item, TransactionType
+from wtforms import SelectField, IntegerField, TextAreaField, SubmitField, HiddenField, StringField
+from wtforms.validators import DataRequired, ValidationError
+from app.models import Item, db
 
 class CreateTransactionForm(FlaskForm):
-    item_id = SelectField('Item (SSID)', coerce=int, validators=[DataRequired()])
+    # The item is picked with a typeahead over /api/items/search and only its
+    # id is posted, so building and validating the form costs one primary-key
+    # lookup however large the catalog is
+    item_id = HiddenField('Item', validators=[DataRequired(message='Select an item.')])
+    item_search = StringField('Item (SSID)')
     transaction_type = SelectField('Transaction Type', choices=[
         ('in', 'Stock In'),
         ('out', 'Stock Out'),
@@ -14,10 +18,15 @@ class CreateTransactionForm(FlaskForm):
     notes = TextAreaField('Notes', validators=[])
     submit = SubmitField('Create Transaction')
     
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        items = Item.query.all()
-        self.item_id.choices = [(i.id, f"{i.ssid} - {i.name} (Stock: {i.current_stock})") for i in items]
+    def validate_item_id(self, item_id):
+        try:
+            item = db.session.get(Item, int(item_id.data))
+        except (TypeError, ValueError):
+            item = None
+        if item is None:
+            raise ValidationError('Item not found.')
+        item_id.data = item.id
+        self.item_search.data = f"{item.ssid} - {item.name} (Stock: {item.current_stock})"
     
     def validate_quantity(self, quantity):
         if self.transaction_type.data == 'out' and quantity.data <= 0:
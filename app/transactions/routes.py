@@ -1,16 +1,27 @@
-from flask import render_template, redirect, url_for, flash, request
+from flask import render_template, redirect, url_for, flash, request, abort
 from flask_login import login_required, current_user
 from app.transactions import bp
-from app.models import Transaction, Item, Warehouse, TransactionType, db
+from app.models import Transaction, TransactionType
 from app.transactions.forms import CreateTransactionForm
+from app.queries import transactions_with_refs
+from app.pagination import keyset_paginate
+from app.stats import summary_counts
+from app.stock import record_movement, StockError
 
 @bp.route('/')
 @login_required
 def list_transactions():
-    page = request.args.get('page', 1, type=int)
-    transactions = Transaction.query.order_by(Transaction.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    try:
+        transactions = keyset_paginate(transactions_with_refs(), [Transaction.created_at, Transaction.id],
+                                       cursor=request.args.get('cursor'), per_page=20, descending=True)
+    except ValueError:
+        abort(400)
+    
+    # Exact totals cost a full COUNT(*), so they are only computed on request
+    if request.args.get('count', type=int):
+        transactions.total, transactions.total_exact = Transaction.query.count(), True
+    else:
+        transactions.total = summary_counts()['transactions']
     return render_template('transactions/list.html', transactions=transactions)
 
 @bp.route('/create', methods=['GET', 'POST'])
@@ -19,43 +30,20 @@ def create_transaction():
     form = CreateTransactionForm()
     
     if form.validate_on_submit():
-        item = Item.query.get(form.item_id.data)
-        transaction_type = TransactionType(form.transaction_type.data)
-        quantity = form.quantity.data
-        
-        # Check stock constraints
-        if transaction_type == TransactionType.OUT:
-            if item.current_stock < quantity and not current_user.can_override_stock():
-                flash(f'Insufficient stock. Available: {item.current_stock}, Requested: {quantity}', 'danger')
-                return render_template('transactions/create.html', form=form)
-        elif transaction_type == TransactionType.ADJUSTMENT:
-            new_stock = item.current_stock + quantity
-            if new_stock < 0 and not current_user.can_override_stock():
-                flash(f'Adjustment would result in negative stock: {new_stock}', 'danger')
-                return render_template('transactions/create.html', form=form)
-        
-        # Create transaction
-        transaction = Transaction(
-            transaction_type=transaction_type,
-            quantity=quantity,
-            notes=form.notes.data,
-            item_id=form.item_id.data,
-            warehouse_id=item.warehouse_id,
-            user_id=current_user.id
-        )
-        
-        # Update stock
-        if transaction_type == TransactionType.IN:
-            item.current_stock += quantity
-        elif transaction_type == TransactionType.OUT:
-            item.current_stock -= quantity
-        elif transaction_type == TransactionType.ADJUSTMENT:
-            item.current_stock += quantity  # Adjustment can be positive or negative
-        
-        db.session.add(transaction)
-        db.session.commit()
+        # Stock checks and the update itself happen atomically in app.stock
+        try:
+            result = record_movement(
+                form.item_id.data,
+                TransactionType(form.transaction_type.data),
+                form.quantity.data,
+                form.notes.data,
+                current_user
+            )
+        except StockError as exc:
+            flash(str(exc), 'danger')
+            return render_template('transactions/create.html', form=form)
         
-        flash(f'Transaction completed successfully! New stock: {item.current_stock}', 'success')
+        flash(f'Transaction completed successfully! New stock: {result["new_stock"]}', 'success')
         return redirect(url_for('transactions.list_transactions'))
     
     return render_template('transactions/create.html', form=form)
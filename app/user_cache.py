@@ -0,0 +1,102 @@
+import threading
+import time
+from flask import current_app, has_app_context
+from sqlalchemy import event, select
+from app import db
+from app.models import User, CacheVersion
+
+# Identity cache behind the Flask-Login user loader. Active users are kept
+# as detached instances for USER_CACHE_TTL seconds and merged into each
+# request's session without a query. A commit that changes a user drops it
+# from this process's cache at once; other processes notice through the
+# 'users' version stamp maintained by app.refdata, which is re-read at most
+# every USER_CACHE_VERSION_CHECK seconds and clears the cache when it moves.
+# Inactive users are never cached and never loaded.
+
+
+class UserCache:
+    def __init__(self, ttl, version_check):
+        self.ttl = ttl
+        self.version_check = version_check
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _check_version(self, now):
+        if self._checked_at is not None and now - self._checked_at < self.version_check:
+            return
+        version = db.session.execute(
+            select(CacheVersion.version).where(CacheVersion.name == 'users')
+        ).scalar()
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            self._checked_at = now
+
+    def get(self, user_id):
+        now = time.monotonic()
+        self._check_version(now)
+        entry = self._entries.get(user_id)
+        if entry is not None and now - entry[0] < self.ttl:
+            self.hits += 1
+            return db.session.merge(entry[1], load=False)
+
+        self.misses += 1
+        user = db.session.get(User, user_id)
+        if user is None or not user.is_active:
+            self._entries.pop(user_id, None)
+            return None
+        # Cache the loaded instance itself and hand the request a copy
+        db.session.expunge(user)
+        self._entries[user_id] = (now, user)
+        return db.session.merge(user, load=False)
+
+    def invalidate(self, user_ids):
+        for user_id in user_ids:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'cached': len(self._entries)}
+
+
+def get_cache():
+    cache = current_app.extensions.get('user_cache')
+    if cache is None:
+        cache = current_app.extensions['user_cache'] = UserCache(
+            current_app.config['USER_CACHE_TTL'],
+            current_app.config['USER_CACHE_VERSION_CHECK']
+        )
+    return cache
+
+
+def load_user(user_id):
+    """Flask-Login user loader: the active user with `user_id`, or None"""
+    return get_cache().get(user_id)
+
+
+def _after_flush(session, flush_context):
+    changed = {obj.id for obj in session.dirty | session.deleted if isinstance(obj, User)}
+    if changed:
+        session.info.setdefault('user_cache_changed', set()).update(changed)
+
+
+def _after_commit(session):
+    changed = session.info.pop('user_cache_changed', None)
+    if changed and has_app_context():
+        get_cache().invalidate(changed)
+
+
+def _after_rollback(session):
+    session.info.pop('user_cache_changed', None)
+
+
+def init_app(app):
+    for name, listener in (('after_flush', _after_flush),
+                           ('after_commit', _after_commit),
+                           ('after_rollback', _after_rollback)):
+        if not event.contains(db.session, name, listener):
+            event.listen(db.session, name, listener)
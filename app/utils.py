@@ -1,41 +1,137 @@
 import qrcode
+import csv
+import hashlib
 import json
-import os
-from io import BytesIO
+import zlib
+from decimal import Decimal
+from enum import Enum
+from itertools import islice
+from zipfile import ZipFile, ZIP_DEFLATED
 import openpyxl
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Border, Side
-from flask import current_app, make_response
+from openpyxl.utils import get_column_letter
+from openpyxl.drawing.spreadsheet_drawing import SpreadsheetDrawing
+from openpyxl.worksheet._writer import WorksheetWriter
+from openpyxl.writer.excel import ExcelWriter
+from flask import current_app, request, Response, stream_with_context
 from datetime import datetime
+from app.metrics import EXPORT_BYTES, EXPORT_ROWS, QR_RENDERS, count_rows
+from app.profiling import phase
+from app.qr_cache import QRCache, qr_filename
 
-def generate_qr_code(item):
-    """Generate QR code for an item with current details"""
-    qr_data = json.dumps(item.get_qr_data(), indent=2)
-    
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(qr_data)
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+STREAM_BUFFER_BYTES = 64 * 1024  # text collected before each chunk is sent
+
+# Encoding settings shared by every QR code the app renders
+QR_OPTIONS = {
+    'version': 1,
+    'error_correction': qrcode.constants.ERROR_CORRECT_L,
+    'box_size': 10,
+    'border': 4,
+}
+QR_COLORS = {'fill_color': 'black', 'back_color': 'white'}
+
+def qr_payload(item):
+    """Text encoded in an item's QR code"""
+    return json.dumps(item.get_qr_data(), indent=2)
+
+def qr_digest(payload):
+    """Content hash of a QR image: its payload plus the encoding settings"""
+    key = json.dumps([payload, QR_OPTIONS, QR_COLORS], sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def _encode_qr(payload):
+    qr = qrcode.QRCode(**QR_OPTIONS)
+    qr.add_data(payload)
     qr.make(fit=True)
+    return qr
+
+def render_qr_image(payload):
+    """Render a QR code PIL image for `payload` with the shared settings"""
+    QR_RENDERS.inc('image')
+    with phase('qr'):
+        return _encode_qr(payload).make_image(**QR_COLORS)
+
+def qr_matrix(payload):
+    """Module grid (rows of booleans, border included) for `payload` with the shared settings"""
+    QR_RENDERS.inc('matrix')
+    with phase('qr'):
+        return _encode_qr(payload).get_matrix()
+
+def get_qr_cache():
+    cache = current_app.extensions.get('qr_cache')
+    if cache is None:
+        cache = current_app.extensions['qr_cache'] = QRCache(
+            current_app.config['UPLOAD_FOLDER'],
+            current_app.config['QR_CACHE_MAX_BYTES']
+        )
+    return cache
+
+def generate_qr_code(item):
+    """Return the QR code filename for an item, rendering it only if its details changed"""
+    payload = qr_payload(item)
+    filename = qr_filename(qr_digest(payload))
     
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Save to file
-    filename = f"qr_{item.ssid}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-    img.save(filepath)
+    cache = get_qr_cache()
+    if not cache.lookup(filename):
+        cache.store(filename, render_qr_image(payload))
     
     return filename
 
-def create_excel_response(data, filename, headers):
-    """Create Excel file and return as response"""
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Report"
-    
-    # Style definitions
+class _ChunkBuffer:
+    """Unseekable file object collecting written bytes until they are drained"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def drain(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class _StreamedSheetWriter(ExcelWriter):
+    """ExcelWriter for a workbook whose sheet is already in the archive"""
+
+    def write_worksheet(self, ws):
+        ws._drawing = SpreadsheetDrawing()
+        ws._rels = ws._writer._rels
+        self.manifest.append(ws)
+
+
+def excel_chunks(rows, headers, sample_size, chunk_size=STREAM_BUFFER_BYTES):
+    """Bytes of an Excel file holding `headers` and `rows`, produced while rows are read.
+
+    The sheet XML is written straight into a zip entry of a write-only
+    workbook, so neither rows nor cells are kept; the rest of the workbook
+    (styles, manifest) follows once the rows run out. Column widths are taken
+    from the first `sample_size` rows only, and the first chunk goes out
+    right after them.
+    """
+    buffer = _ChunkBuffer()
+    archive = ZipFile(buffer, 'w', ZIP_DEFLATED)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title="Report")
+
+    # Column widths must be set before the first row is written
+    row_iter = count_rows(rows, EXPORT_ROWS, 'xlsx')
+    sample = list(islice(row_iter, sample_size))
+    for col, header in enumerate(headers, 1):
+        length = max([len(str(header))] + [len(str(record[col - 1])) for record in sample])
+        ws.column_dimensions[get_column_letter(col)].width = min(length + 2, 50)
+
     header_font = Font(bold=True, color="FFFFFF")
     header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
     border = Border(
@@ -44,32 +140,150 @@ def create_excel_response(data, filename, headers):
         top=Side(style='thin'),
         bottom=Side(style='thin')
     )
-    
-    # Add headers
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
+    header_cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
         cell.font = header_font
         cell.fill = header_fill
         cell.border = border
-    
-    # Add data
-    for row, record in enumerate(data, 2):
-        for col, value in enumerate(record, 1):
-            cell = ws.cell(row=row, column=col, value=value)
-            cell.border = border
-    
-    # Auto-adjust column widths
-    for column in ws.columns:
-        length = max(len(str(cell.value)) for cell in column)
-        ws.column_dimensions[column[0].column_letter].width = min(length + 2, 50)
-    
-    # Save to BytesIO
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    response = make_response(output.read())
-    response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        header_cells.append(cell)
+
+    ws._id = 1  # numbered by ExcelWriter otherwise, after the sheet is written
+    with archive.open(ws.path[1:], 'w') as sheet:
+        ws._writer = WorksheetWriter(ws, out=sheet)
+        ws._writer.write_top()
+        try:
+            ws.append(header_cells)
+            for record in sample:
+                ws.append(record)
+            yield buffer.drain()
+            for record in row_iter:
+                ws.append(record)
+                if len(buffer) >= chunk_size:
+                    yield buffer.drain()
+        finally:
+            # Also when the client goes away mid-stream: openpyxl's row
+            # writers must finish before the zip entry they write to closes
+            ws.close()
+
+    wb.properties.modified = datetime.utcnow()
+    _StreamedSheetWriter(wb, archive).save()
+    yield buffer.drain()
+
+
+def stream_excel_response(rows, filename, headers):
+    """Stream an Excel file built from an iterable of rows in constant memory.
+
+    Rows are read as the response is sent (see excel_chunks), so the client
+    gets the first bytes as soon as the header and the rows sizing the columns
+    (EXPORT_WIDTH_SAMPLE_ROWS) are written.
+    """
+    chunks = excel_chunks(rows, headers, current_app.config['EXPORT_WIDTH_SAMPLE_ROWS'])
+
+    def generate():
+        while True:
+            with phase('xlsx'):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            if chunk:
+                EXPORT_BYTES.inc('xlsx', amount=len(chunk))
+                yield chunk
+
+    response = Response(stream_with_context(generate()), mimetype=XLSX_MIMETYPE)
     response.headers['Content-Disposition'] = f'attachment; filename={filename}'
-    
     return response
+
+def json_default(value):
+    """json.dumps fallback for the column types records carry"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+def jsonable(value):
+    """`value` converted the same way json_default would, for jsonify()"""
+    return json_default(value) if isinstance(value, (datetime, Decimal, Enum)) else value
+
+def _buffered(pieces):
+    # Join small pieces so each response chunk is a reasonable size; the
+    # first piece goes out on its own so clients see bytes immediately
+    buffer, size, first = [], 0, True
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if first or size >= STREAM_BUFFER_BYTES:
+            yield ''.join(buffer)
+            buffer, size, first = [], 0, False
+    if buffer:
+        yield ''.join(buffer)
+
+class _LineBuffer:
+    """File-like target for csv.writer that hands back each written line"""
+
+    def __init__(self):
+        self.value = ''
+
+    def write(self, text):
+        self.value += text
+        return len(text)
+
+    def pop(self):
+        value, self.value = self.value, ''
+        return value
+
+def csv_chunks(header, rows):
+    """CSV text for a header and an iterable of row tuples, produced incrementally"""
+    line = _LineBuffer()
+    writer = csv.writer(line)
+    def pieces():
+        writer.writerow(header)
+        yield line.pop()
+        for row in rows:
+            writer.writerow(row)
+            yield line.pop()
+    return _buffered(pieces())
+
+def json_array_chunks(records):
+    """A JSON array of `records` (dicts), produced incrementally"""
+    def pieces():
+        yield '['
+        for index, record in enumerate(records):
+            yield (',' if index else '') + json.dumps(record, default=json_default)
+        yield ']'
+    return _buffered(pieces())
+
+def ndjson_chunks(records):
+    """One JSON document per line for each record"""
+    return _buffered(json.dumps(record, default=json_default) + '\n' for record in records)
+
+def gzip_chunks(chunks):
+    """Gzip a stream of text chunks as it is produced"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    first = True
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if first:
+            # Push the first chunk through instead of waiting for a full block
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            first = False
+        if data:
+            yield data
+    yield compressor.flush()
+
+def stream_response(chunks, mimetype, filename=None, compress=False):
+    """Response streaming text `chunks`, gzipped when `compress` is set"""
+    body = gzip_chunks(chunks) if compress else chunks
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    if filename:
+        response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+def accepts_gzip():
+    return request.accept_encodings['gzip'] > 0
@@ -12,3 +12,99 @@ class Config:
     # File upload settings
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'qr_codes')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+    
+    # Run `flask db upgrade` at deploy time and set this to 0 in production;
+    # otherwise the first request in each process creates/migrates the schema
+    BOOTSTRAP_ON_FIRST_REQUEST = os.environ.get('BOOTSTRAP_ON_FIRST_REQUEST', '1') == '1'
+    
+    # Dashboard counters are recounted in the background once they are this old
+    SUMMARY_RECOUNT_SECONDS = int(os.environ.get('SUMMARY_RECOUNT_SECONDS', 3600))
+    
+    # QR images are content-addressed; the folder is kept under this size (LRU)
+    QR_CACHE_MAX_BYTES = int(os.environ.get('QR_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    QR_CACHE_MAX_AGE = 365 * 24 * 3600  # seconds browsers may cache an image
+    
+    # Processes rendering bulk label sheets, shared by every label export
+    # job in a process; 1 renders on the job's own thread
+    LABEL_WORKERS = int(os.environ.get('LABEL_WORKERS', 2))
+    
+    # Warehouses, categories and users are cached per process for at most
+    # this long; commits that change them invalidate the cache immediately
+    REFDATA_TTL = int(os.environ.get('REFDATA_TTL', 300))
+    
+    # The logged-in user is cached per process for this long; other processes
+    # see deactivations and role changes within USER_CACHE_VERSION_CHECK seconds
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+    USER_CACHE_VERSION_CHECK = 2
+    
+    # Full-text search ranks at most this many matches per query
+    SEARCH_RANK_CANDIDATES = int(os.environ.get('SEARCH_RANK_CANDIDATES', 2000))
+    
+    # Streaming export settings
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 1000))  # rows fetched per round-trip
+    EXPORT_WIDTH_SAMPLE_ROWS = 200  # rows inspected to size spreadsheet columns
+
+    # Background export jobs are built by `flask exports worker`, run as its
+    # own process next to the web server. EXPORT_WORKER_THREADS > 0 runs that
+    # many workers inside every web process instead (handy for development,
+    # but they then compete with requests). Finished files are kept for
+    # EXPORT_RETENTION_HOURS, and a running job that has not reported
+    # progress for EXPORT_JOB_STALE_SECONDS is retried (once) elsewhere.
+    EXPORT_FOLDER = os.environ.get('EXPORT_FOLDER') or os.path.join(basedir, 'instance', 'exports')
+    EXPORT_WORKER_THREADS = int(os.environ.get('EXPORT_WORKER_THREADS', 0))
+    EXPORT_RETENTION_HOURS = int(os.environ.get('EXPORT_RETENTION_HOURS', 24))
+    EXPORT_POLL_SECONDS = 2  # how often idle workers look for queued jobs
+    EXPORT_PROGRESS_SECONDS = 1  # how often a running job records its progress
+    EXPORT_JOB_STALE_SECONDS = 120
+    EXPORT_JOB_MAX_ATTEMPTS = 2
+
+    # Write-ahead logging lets SQLite commit writes while long exports are
+    # reading; without it a writer waits for every open read to finish
+    SQLITE_WAL = os.environ.get('SQLITE_WAL', '1') == '1'
+
+    # Attempts at a stock update after concurrent writers invalidated its snapshot
+    STOCK_MAX_RETRIES = 5
+    
+    # Stock snapshots for as-of inventory: one every STOCK_SNAPSHOT_HOURS
+    # (0 turns off the automatic ones), thinned to the first of each month
+    # once they are older than STOCK_SNAPSHOT_KEEP_DAYS
+    STOCK_SNAPSHOT_HOURS = int(os.environ.get('STOCK_SNAPSHOT_HOURS', 24))
+    STOCK_SNAPSHOT_KEEP_DAYS = int(os.environ.get('STOCK_SNAPSHOT_KEEP_DAYS', 90))
+    
+    # Suggested reorder levels: demand over the last REORDER_WINDOW_DAYS,
+    # covering REORDER_LEAD_DAYS of it plus REORDER_SERVICE_Z standard
+    # deviations as safety stock (1.65 is about a 95% service level)
+    REORDER_WINDOW_DAYS = int(os.environ.get('REORDER_WINDOW_DAYS', 90))
+    REORDER_LEAD_DAYS = float(os.environ.get('REORDER_LEAD_DAYS', 7))
+    REORDER_SERVICE_Z = float(os.environ.get('REORDER_SERVICE_Z', 1.65))
+    
+    # Largest batch accepted by POST /api/transactions/batch
+    BATCH_MAX_MOVEMENTS = int(os.environ.get('BATCH_MAX_MOVEMENTS', 5000))
+    
+    # X-Updated-Until of /api/items?updated_since= trails the clock by this
+    # many seconds; it must exceed the longest item write transaction
+    API_UPDATED_SINCE_SLACK = int(os.environ.get('API_UPDATED_SINCE_SLACK', 30))
+    
+    # SQL instrumentation settings: statement counts per request, logged and
+    # (SQL_STATS_HEADERS, or always in debug and testing) sent to the client
+    # as X-SQL-Queries / X-SQL-Time-ms / X-SQL-N-Plus-One
+    SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION', '0') == '1'
+    SQL_STATS_HEADERS = os.environ.get('SQL_STATS_HEADERS', '0') == '1'
+    SQL_N_PLUS_ONE_THRESHOLD = 5  # repeated lazy loads of one relationship per request
+
+    # Request profiling: requests sending an X-Profile token from `flask
+    # profile token` (valid PROFILE_TOKEN_MAX_AGE seconds), plus a random
+    # PROFILE_SAMPLE_RATE fraction of all requests, get a Server-Timing
+    # header; those slower than PROFILE_SLOW_MS (and all token requests)
+    # also have their sampled call stacks saved to PROFILE_FOLDER
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_SLOW_MS = int(os.environ.get('PROFILE_SLOW_MS', 500))
+    PROFILE_SAMPLE_INTERVAL_MS = 5  # how often profiled requests' stacks are sampled
+    PROFILE_FOLDER = os.environ.get('PROFILE_FOLDER') or os.path.join(basedir, 'instance', 'profiles')
+    PROFILE_TOKEN_MAX_AGE = int(os.environ.get('PROFILE_TOKEN_MAX_AGE', 3600))
+    
+    # Request, database pool, export and QR metrics, served in the Prometheus
+    # text format at /metrics to admins and to scrapers sending
+    # "Authorization: Bearer <METRICS_TOKEN>" (unset: admins only)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy import select
+from app import create_app, db
+from app.benchmark.data import SCALES, generate
+from app.benchmark.suite import login
+from app.bootstrap import bootstrap
+from app.models import User, Role
+from config import Config
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp('app')
+
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{workdir / 'test.db'}"
+        WTF_CSRF_ENABLED = False
+        BOOTSTRAP_ON_FIRST_REQUEST = False
+        STOCK_SNAPSHOT_HOURS = 0
+        EXPORT_WORKER_THREADS = 0
+        EXPORT_FOLDER = str(workdir / 'exports')
+        UPLOAD_FOLDER = str(workdir / 'qr_codes')
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        bootstrap()
+        generate(SCALES['tiny'])
+        db.session.remove()
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    """Test client logged in as the admin"""
+    client = app.test_client()
+    with app.app_context():
+        admin = db.session.execute(
+            select(User.username).where(User.role == Role.ADMIN).order_by(User.id)
+        ).scalar()
+    login(client, admin)
+    return client
@@ -0,0 +1,37 @@
+import pytest
+from app.instrumentation import assert_query_budget
+
+# Statements per request on the hot endpoints. Budgets do not grow with the
+# data, so a loop that queries per row fails here even on the tiny dataset.
+BUDGETS = [
+    ('/', 5),
+    ('/items/', 3),
+    ('/transactions/', 3),
+    ('/api/items', 4),
+    ('/api/items?limit=100', 4),
+    ('/api/transactions', 4),
+    ('/search?ssid=BENCH0000001', 2),
+    ('/api/search?q=steel+bolt', 2),
+    ('/api/items/search?q=BENCH00', 3),
+    ('/reports/transactions-export', 2),
+    ('/reports/inventory-export', 2),
+    ('/reports/low-stock-export', 2),
+    ('/reports/reorder-export?window_days=1000', 2),
+    ('/payments/export', 2),
+]
+
+
+@pytest.mark.parametrize('path, max_queries', BUDGETS)
+def test_hot_endpoint_query_budget(app, client, path, max_queries):
+    client.get(path).close()  # warm the reference-data and user caches
+    with app.app_context(), assert_query_budget(max_queries):
+        response = client.get(path)
+        response.get_data()
+    assert response.status_code == 200
+
+
+def test_create_transaction_query_budget(app, client):
+    with app.app_context(), assert_query_budget(10):
+        response = client.post('/transactions/create', data={
+            'item_id': 1, 'transaction_type': 'in', 'quantity': 1, 'notes': 'budget'})
+    assert response.status_code == 302
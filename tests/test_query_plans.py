@@ -0,0 +1,8 @@
+from app.bootstrap import explain, full_scans
+from app.queries import hot_queries
+
+
+def test_hot_queries_use_indexes(app):
+    with app.app_context():
+        scans = {name: full_scans(explain(query)) for name, query in hot_queries().items()}
+    assert {name: found for name, found in scans.items() if found} == {}